@@ -24,6 +24,17 @@ TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
 # Уровень логирования
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
+# Число процессов для отрисовки графиков
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+
+# Библиотека для отчёта по дисциплине: openpyxl или xlsxwriter
+EXPORT_ENGINE = os.getenv("EXPORT_ENGINE", "openpyxl")
+
+# Webhook: если WEBHOOK_URL задан, бот принимает обновления через webhook,
+# иначе — через long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
 
 # Путь к директории с данными
 DATA_DIR = Path("data")
@@ -4,11 +4,16 @@
 """
 
 from bot.database.connection import get_session, init_db, engine
+from bot.database.session_ctx import db_session, optional_session, with_session, run_db
 from bot.database.models import Base, Teacher, Subject, Student, SubjectStudent, Attendance
 from bot.database import crud
 
 __all__ = [
     "get_session",
+    "db_session",
+    "optional_session",
+    "with_session",
+    "run_db",
     "init_db", 
     "engine",
     "Base",
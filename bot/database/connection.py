@@ -3,23 +3,57 @@
 """
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, Session
 
 from bot.config import DATABASE_URL, DATA_DIR
-from bot.database.models import Base
+from bot.database.models import Base, Attendance
 
 # Убедимся, что папка data существует
 DATA_DIR.mkdir(exist_ok=True)
 
+# Размеры пула соединений (QueuePool)
+POOL_SIZE = 20
+MAX_OVERFLOW = 40
+POOL_RECYCLE = 1800  # Пересоздавать соединения старше 30 минут
+
+
+def _engine_options(database_url: str) -> dict:
+    """
+    Параметры create_engine для указанного URL.
+
+    Размеры пула передаются только бэкендам с QueuePool: для SQLite
+    в памяти SQLAlchemy выбирает SingletonThreadPool, который их не принимает.
+    """
+    url = make_url(database_url)
+    options = {
+        "echo": False,  # True для отладки SQL запросов
+        "pool_pre_ping": True,  # Проверять соединение перед выдачей из пула
+    }
+    if url.get_backend_name() == "sqlite":
+        # Для SQLite в многопоточной среде
+        options["connect_args"] = {"check_same_thread": False}
+
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        options.update(
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_recycle=POOL_RECYCLE,
+        )
+    return options
+
+
 # Создаем движок SQLAlchemy
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,  # True для отладки SQL запросов
-    connect_args={"check_same_thread": False}  # Для SQLite в многопоточной среде
-)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
-# Фабрика сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Фабрика сессий (объекты не «протухают» после commit — без лишних SELECT)
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=engine
+)
 
 
 def get_session() -> Session:
@@ -30,3 +64,7 @@ def get_session() -> Session:
 def init_db():
     """Инициализация БД - создание всех таблиц."""
     Base.metadata.create_all(bind=engine)
+
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for index in Attendance.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
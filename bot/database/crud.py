@@ -2,11 +2,13 @@
 CRUD операции для работы с базой данных.
 """
 
-from datetime import date
+from dataclasses import dataclass, field
+from datetime import date, datetime
 from typing import Optional, List
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, insert, func, distinct, case
+from sqlalchemy.dialects import postgresql, sqlite
 
 from bot.database.models import Teacher, Subject, Student, SubjectStudent, Attendance
 
@@ -55,6 +57,75 @@ def get_subjects_by_teacher(session: Session, teacher_id: int) -> List[Subject]:
     return list(result.scalars().all())
 
 
+def get_subjects_with_counts(session: Session, teacher_id: int) -> List[tuple]:
+    """Получить дисциплины преподавателя с количеством студентов и дат занятий.
+    Возвращает строки (id, name, students_count, dates_count) одним запросом."""
+    students_count = (
+        select(func.count(SubjectStudent.id))
+        .where(SubjectStudent.subject_id == Subject.id)
+        .scalar_subquery()
+    )
+    dates_count = (
+        select(func.count(distinct(Attendance.date)))
+        .where(Attendance.subject_id == Subject.id)
+        .scalar_subquery()
+    )
+    result = session.execute(
+        select(
+            Subject.id,
+            Subject.name,
+            students_count.label("students_count"),
+            dates_count.label("dates_count"),
+        )
+        .where(Subject.teacher_id == teacher_id)
+        .order_by(Subject.name)
+    )
+    return list(result.all())
+
+
+def get_teacher_attendance_aggregate(
+    session: Session,
+    teacher_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+) -> List[tuple]:
+    """Получить сводку посещаемости по всем дисциплинам преподавателя одним запросом.
+    Возвращает строки (id, name, students_count, dates_count, present_count)."""
+    period = [Attendance.subject_id == Subject.id]
+    if date_from is not None:
+        period.append(Attendance.date >= date_from)
+    if date_to is not None:
+        period.append(Attendance.date <= date_to)
+
+    students_count = (
+        select(func.count(SubjectStudent.id))
+        .where(SubjectStudent.subject_id == Subject.id)
+        .scalar_subquery()
+    )
+    dates_count = (
+        select(func.count(distinct(Attendance.date)))
+        .where(*period)
+        .scalar_subquery()
+    )
+    present_count = (
+        select(func.coalesce(func.sum(case((Attendance.is_present, 1), else_=0)), 0))
+        .where(*period)
+        .scalar_subquery()
+    )
+    result = session.execute(
+        select(
+            Subject.id,
+            Subject.name,
+            students_count.label("students_count"),
+            dates_count.label("dates_count"),
+            present_count.label("present_count"),
+        )
+        .where(Subject.teacher_id == teacher_id)
+        .order_by(Subject.name)
+    )
+    return list(result.all())
+
+
 def get_subject_by_id(session: Session, subject_id: int) -> Optional[Subject]:
     """Получить дисциплину по ID."""
     return session.get(Subject, subject_id)
@@ -82,23 +153,37 @@ def delete_subject(session: Session, subject_id: int) -> bool:
 
 # === Student CRUD (общий пул) ===
 
-def create_student(session: Session, teacher_id: int, full_name: str) -> Student:
-    """Создать нового студента в общем пуле преподавателя."""
+def create_student(session: Session, teacher_id: int, full_name: str,
+                   commit: bool = True) -> Student:
+    """
+    Создать нового студента в общем пуле преподавателя.
+
+    При commit=False изменения только сбрасываются в БД (flush), чтобы
+    вызывающий код мог зафиксировать несколько операций одним коммитом.
+    """
     student = Student(teacher_id=teacher_id, full_name=full_name)
     session.add(student)
-    session.commit()
-    session.refresh(student)
+    if commit:
+        session.commit()
+        session.refresh(student)
+    else:
+        session.flush()
     return student
 
 
 def create_students_bulk(session: Session, teacher_id: int, names: List[str]) -> List[Student]:
-    """Массовое создание студентов в общем пуле."""
-    students = [Student(teacher_id=teacher_id, full_name=name.strip())
-                for name in names if name.strip()]
-    session.add_all(students)
+    """Массовое создание студентов в общем пуле.
+    Все строки вставляются одним INSERT ... RETURNING."""
+    rows = [{"teacher_id": teacher_id, "full_name": name.strip()}
+            for name in names if name.strip()]
+    if not rows:
+        return []
+
+    students = list(session.scalars(
+        insert(Student).returning(Student, sort_by_parameter_order=True),
+        rows
+    ))
     session.commit()
-    for student in students:
-        session.refresh(student)
     return students
 
 
@@ -116,6 +201,52 @@ def get_student_by_id(session: Session, student_id: int) -> Optional[Student]:
     return session.get(Student, student_id)
 
 
+@dataclass
+class StudentProfile:
+    """Карточка студента: данные, дисциплины и общая посещаемость."""
+    full_name: str
+    created_at: datetime
+    subjects: List[str] = field(default_factory=list)
+    total: int = 0
+    present: int = 0
+
+
+def get_student_profile(session: Session, student_id: int) -> Optional[StudentProfile]:
+    """Получить карточку студента.
+    Посещаемость агрегируется в SQL, без загрузки записей в Python."""
+    row = session.execute(
+        select(
+            Student.full_name,
+            Student.created_at,
+            func.count(Attendance.id),
+            func.coalesce(
+                func.sum(case((Attendance.is_present, 1), else_=0)), 0),
+        )
+        .outerjoin(Attendance, Attendance.student_id == Student.id)
+        .where(Student.id == student_id)
+        .group_by(Student.id)
+    ).first()
+
+    if row is None:
+        return None
+
+    subjects = session.execute(
+        select(Subject.name)
+        .join(SubjectStudent)
+        .where(SubjectStudent.student_id == student_id)
+        .order_by(Subject.name)
+    ).scalars().all()
+
+    full_name, created_at, total, present = row
+    return StudentProfile(
+        full_name=full_name,
+        created_at=created_at,
+        subjects=list(subjects),
+        total=total,
+        present=present,
+    )
+
+
 def update_student(session: Session, student_id: int, full_name: str) -> Optional[Student]:
     """Обновить ФИО студента."""
     student = session.get(Student, student_id)
@@ -138,23 +269,35 @@ def delete_student(session: Session, student_id: int) -> bool:
 
 # === SubjectStudent CRUD (связь студент-дисциплина) ===
 
-def add_student_to_subject(session: Session, subject_id: int, student_id: int) -> Optional[SubjectStudent]:
-    """Добавить студента в дисциплину."""
-    # Проверяем, не добавлен ли уже
-    existing = session.execute(
-        select(SubjectStudent).where(
-            SubjectStudent.subject_id == subject_id,
-            SubjectStudent.student_id == student_id
-        )
-    ).scalar_one_or_none()
-
-    if existing:
-        return existing  # Уже добавлен
+def _upsert(session: Session, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей БД."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def add_student_to_subject(session: Session, subject_id: int, student_id: int,
+                           commit: bool = True) -> Optional[SubjectStudent]:
+    """Добавить студента в дисциплину (commit=False — только flush).
+    Вставка с ON CONFLICT DO NOTHING: повторное добавление не создаёт дубликат."""
+    link = session.scalars(
+        _upsert(session, SubjectStudent)
+        .values(subject_id=subject_id, student_id=student_id)
+        .on_conflict_do_nothing(index_elements=["subject_id", "student_id"])
+        .returning(SubjectStudent)
+    ).one_or_none()
+
+    if link is None:
+        # Уже добавлен — возвращаем существующую связь
+        link = session.execute(
+            select(SubjectStudent).where(
+                SubjectStudent.subject_id == subject_id,
+                SubjectStudent.student_id == student_id
+            )
+        ).scalar_one()
 
-    link = SubjectStudent(subject_id=subject_id, student_id=student_id)
-    session.add(link)
-    session.commit()
-    session.refresh(link)
+    if commit:
+        session.commit()
     return link
 
 
@@ -192,24 +335,47 @@ def get_students_by_subject(session: Session, subject_id: int) -> List[Student]:
     return list(result.scalars().all())
 
 
-def get_students_not_in_subject(session: Session, teacher_id: int, subject_id: int) -> List[Student]:
-    """Получить студентов преподавателя, которые НЕ в дисциплине."""
-    # Получаем ID студентов, которые уже в дисциплине
-    in_subject = session.execute(
-        select(SubjectStudent.student_id).where(
-            SubjectStudent.subject_id == subject_id)
-    ).scalars().all()
-
-    # Получаем остальных
-    result = session.execute(
-        select(Student)
+def _not_in_subject_clause(subject_id: int):
+    """Условие NOT EXISTS: студента нет в дисциплине."""
+    # NOT EXISTS по уникальному индексу (subject_id, student_id) —
+    # один запрос вместо выборки ID и длинного NOT IN
+    return ~(
+        select(SubjectStudent.id)
         .where(
-            Student.teacher_id == teacher_id,
-            Student.id.notin_(in_subject) if in_subject else True
+            SubjectStudent.subject_id == subject_id,
+            SubjectStudent.student_id == Student.id
         )
-        .order_by(Student.full_name)
+        .exists()
     )
-    return list(result.scalars().all())
+
+
+def get_students_not_in_subject(
+    session: Session,
+    teacher_id: int,
+    subject_id: int,
+    limit: Optional[int] = None,
+    offset: int = 0
+) -> List[Student]:
+    """Получить студентов преподавателя, которые НЕ в дисциплине
+    (при указании limit — одну страницу списка)."""
+    stmt = (
+        select(Student)
+        .where(Student.teacher_id == teacher_id,
+               _not_in_subject_clause(subject_id))
+        .order_by(Student.full_name, Student.id)
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit).offset(offset)
+    return list(session.execute(stmt).scalars().all())
+
+
+def count_students_not_in_subject(session: Session, teacher_id: int, subject_id: int) -> int:
+    """Количество студентов преподавателя, которых нет в дисциплине."""
+    return session.execute(
+        select(func.count(Student.id))
+        .where(Student.teacher_id == teacher_id,
+               _not_in_subject_clause(subject_id))
+    ).scalar_one()
 
 
 def get_subjects_by_student(session: Session, student_id: int) -> List[Subject]:
@@ -223,12 +389,39 @@ def get_subjects_by_student(session: Session, student_id: int) -> List[Subject]:
     return list(result.scalars().all())
 
 
-def count_students_in_subject(session: Session, subject_id: int) -> int:
-    """Подсчитать количество студентов в дисциплине."""
+def get_student_and_subject(
+    session: Session,
+    student_id: int,
+    subject_id: int
+) -> tuple[Optional[Student], Optional[Subject]]:
+    """Получить студента и дисциплину (одного преподавателя) одним запросом.
+    Если хотя бы один из них не найден, возвращает (None, None)."""
+    row = session.execute(
+        select(Student, Subject)
+        .join(Subject, Subject.teacher_id == Student.teacher_id)
+        .where(Student.id == student_id, Subject.id == subject_id)
+    ).one_or_none()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def count_subjects_per_student(session: Session, teacher_id: int) -> dict[int, int]:
+    """Подсчитать количество дисциплин у каждого студента преподавателя.
+    Возвращает {student_id: count}; студентов без дисциплин в словаре нет."""
     result = session.execute(
-        select(SubjectStudent).where(SubjectStudent.subject_id == subject_id)
+        select(SubjectStudent.student_id, func.count(SubjectStudent.subject_id))
+        .join(Student, Student.id == SubjectStudent.student_id)
+        .where(Student.teacher_id == teacher_id)
+        .group_by(SubjectStudent.student_id)
     )
-    return len(list(result.scalars().all()))
+    return dict(result.all())
+
+
+def count_students_in_subject(session: Session, subject_id: int) -> int:
+    """Подсчитать количество студентов в дисциплине."""
+    return session.execute(
+        select(func.count(SubjectStudent.id))
+        .where(SubjectStudent.subject_id == subject_id)
+    ).scalar_one()
 
 
 # === Attendance CRUD ===
@@ -240,29 +433,25 @@ def set_attendance(
     attendance_date: date,
     is_present: bool
 ) -> Attendance:
-    """Установить/обновить посещаемость студента на дату."""
-    # Ищем существующую запись
-    attendance = session.execute(
-        select(Attendance).where(
-            Attendance.student_id == student_id,
-            Attendance.subject_id == subject_id,
-            Attendance.date == attendance_date
-        )
-    ).scalar_one_or_none()
+    """Установить/обновить посещаемость студента на дату.
+    Один запрос INSERT ... ON CONFLICT DO UPDATE вместо поиска и ветвления."""
+    stmt = _upsert(session, Attendance).values(
+        student_id=student_id,
+        subject_id=subject_id,
+        date=attendance_date,
+        is_present=is_present
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["student_id", "subject_id", "date"],
+        set_={"is_present": stmt.excluded.is_present}
+    ).returning(Attendance)
 
-    if attendance:
-        attendance.is_present = is_present
-    else:
-        attendance = Attendance(
-            student_id=student_id,
-            subject_id=subject_id,
-            date=attendance_date,
-            is_present=is_present
-        )
-        session.add(attendance)
+    # populate_existing: обновить объект, если он уже загружен в сессию
+    attendance = session.scalars(
+        stmt, execution_options={"populate_existing": True}
+    ).one()
 
     session.commit()
-    session.refresh(attendance)
     return attendance
 
 
@@ -282,6 +471,65 @@ def get_attendance_by_subject_and_date(
     return {att.student_id: att.is_present for att in result.scalars().all()}
 
 
+def get_attendance_counts_by_date(session: Session, subject_id: int) -> List[tuple[date, int, int]]:
+    """Получить (дата, присутствовало, записей) по каждой дате занятий дисциплины,
+    подсчитанные одним запросом GROUP BY."""
+    result = session.execute(
+        select(
+            Attendance.date,
+            func.sum(case((Attendance.is_present, 1), else_=0)),
+            func.count(Attendance.id),
+        )
+        .where(Attendance.subject_id == subject_id)
+        .group_by(Attendance.date)
+        .order_by(Attendance.date)
+    )
+    return [tuple(row) for row in result]
+
+
+def get_present_counts_by_student(
+    session: Session,
+    subject_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+) -> dict[int, int]:
+    """Получить число присутствий каждого студента по дисциплине за период,
+    подсчитанное одним запросом GROUP BY. Возвращает {student_id: present}."""
+    query = (
+        select(Attendance.student_id, func.count(Attendance.id))
+        .where(Attendance.subject_id == subject_id, Attendance.is_present.is_(True))
+        .group_by(Attendance.student_id)
+    )
+    if date_from is not None:
+        query = query.where(Attendance.date >= date_from)
+    if date_to is not None:
+        query = query.where(Attendance.date <= date_to)
+
+    return dict(session.execute(query).all())
+
+
+def get_attendance_matrix(
+    session: Session,
+    subject_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+) -> dict[tuple[int, date], bool]:
+    """Получить всю посещаемость по дисциплине одним запросом.
+    Возвращает {(student_id, date): is_present}."""
+    query = select(Attendance.student_id, Attendance.date, Attendance.is_present).where(
+        Attendance.subject_id == subject_id
+    )
+    if date_from is not None:
+        query = query.where(Attendance.date >= date_from)
+    if date_to is not None:
+        query = query.where(Attendance.date <= date_to)
+
+    return {
+        (student_id, att_date): is_present
+        for student_id, att_date, is_present in session.execute(query)
+    }
+
+
 def get_student_attendance_by_subject(
     session: Session,
     student_id: int,
@@ -309,15 +557,47 @@ def get_student_all_attendance(session: Session, student_id: int) -> List[Attend
     return list(result.scalars().all())
 
 
-def get_subject_attendance_dates(session: Session, subject_id: int) -> List[date]:
-    """Получить все даты занятий по дисциплине."""
-    result = session.execute(
+def get_student_attendance_summary(
+    session: Session,
+    student_id: int,
+    subject_id: Optional[int] = None
+) -> tuple[int, int]:
+    """Получить (всего отметок, присутствий) студента, подсчитанные в SQL.
+    Если subject_id не указан — по всем дисциплинам."""
+    query = (
+        select(
+            func.count(Attendance.id),
+            func.coalesce(
+                func.sum(case((Attendance.is_present, 1), else_=0)), 0),
+        )
+        .where(Attendance.student_id == student_id)
+    )
+    if subject_id is not None:
+        query = query.where(Attendance.subject_id == subject_id)
+
+    total, present = session.execute(query).one()
+    return total, present
+
+
+def get_subject_attendance_dates(
+    session: Session,
+    subject_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+) -> List[date]:
+    """Получить отсортированные даты занятий по дисциплине (с фильтром по периоду)."""
+    query = (
         select(Attendance.date)
         .where(Attendance.subject_id == subject_id)
         .distinct()
         .order_by(Attendance.date)
     )
-    return list(result.scalars().all())
+    if date_from is not None:
+        query = query.where(Attendance.date >= date_from)
+    if date_to is not None:
+        query = query.where(Attendance.date <= date_to)
+
+    return list(session.execute(query).scalars().all())
 
 
 def get_attendance(
@@ -12,7 +12,7 @@
 from datetime import datetime, date
 from typing import List
 
-from sqlalchemy import ForeignKey, String, Date, DateTime, Boolean, UniqueConstraint
+from sqlalchemy import ForeignKey, String, Date, DateTime, Boolean, UniqueConstraint, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -144,9 +144,13 @@ class Attendance(Base):
         DateTime, default=datetime.utcnow)
 
     # Уникальное ограничение - одна запись на студента/дисциплину/дату
+    # (его индекс обслуживает и выборки по студенту в дисциплине).
+    # Индекс (дисциплина, дата) — для отчётов, матрицы посещаемости
+    # и подсчётов по датам
     __table_args__ = (
         UniqueConstraint('student_id', 'subject_id',
                          'date', name='unique_attendance'),
+        Index('ix_att_subject_date', 'subject_id', 'date'),
     )
 
     # Связи
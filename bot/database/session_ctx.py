@@ -0,0 +1,66 @@
+"""
+Сессии БД в рамках одного вызова обработчика.
+"""
+
+import asyncio
+from contextlib import contextmanager
+from functools import wraps
+from typing import Iterator, Optional
+
+from sqlalchemy.orm import Session
+
+from bot.database.connection import get_session
+
+
+@contextmanager
+def db_session() -> Iterator[Session]:
+    """Открыть сессию; при ошибке откатить транзакцию, в конце закрыть."""
+    session = get_session()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@contextmanager
+def optional_session(session: Optional[Session] = None) -> Iterator[Session]:
+    """Использовать переданную сессию как есть или открыть свою через db_session()."""
+    if session is not None:
+        yield session
+        return
+
+    with db_session() as own_session:
+        yield own_session
+
+
+def with_session(handler):
+    """
+    Декоратор обработчика: одна сессия на вызов.
+
+    Сессия передаётся обработчику третьим аргументом. Соединение из пула
+    берётся только при первом запросе к БД, поэтому обработчики, которые
+    завершаются на проверке ввода, к БД не обращаются.
+    """
+    @wraps(handler)
+    async def wrapper(update, context):
+        with db_session() as session:
+            return await handler(update, context, session)
+    return wrapper
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполнить func(session, *args, **kwargs) в отдельном потоке.
+
+    Для тяжёлых запросов и пакетных изменений: цикл событий не блокируется,
+    пока идёт работа с БД. У потока своя сессия, которая закрывается
+    по завершении вызова.
+    """
+    def call():
+        with db_session() as session:
+            return func(session, *args, **kwargs)
+
+    return await asyncio.to_thread(call)
@@ -0,0 +1,177 @@
+"""
+Общие вспомогательные функции для обработчиков.
+"""
+
+import re
+from collections import namedtuple
+from functools import wraps
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy.orm import Session
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CallbackQueryHandler, ContextTypes, ConversationHandler
+
+from bot.database import crud
+
+# Лёгкое представление преподавателя (без привязки к сессии)
+TeacherRef = namedtuple("TeacherRef", ["id", "name"])
+
+# Текст кнопки отмены в диалогах ввода
+CANCEL_BTN_TEXT = "❌ Отмена"
+
+# Виды имён в кэше context.user_data["names"]
+SUBJECT_NAMES = "subj"
+STUDENT_NAMES = "stud"
+
+# Кэш telegram_id -> teacher.id (связь не меняется за время работы бота)
+_TEACHER_ID_CACHE: dict[int, int] = {}
+
+
+def get_teacher(update: Update, session: Session) -> TeacherRef:
+    """
+    Получить или создать преподавателя из update в открытой сессии.
+
+    ID преподавателя кэшируется по telegram_id, поэтому обращение
+    к таблице teachers происходит только при первом запросе пользователя.
+    """
+    user = update.effective_user
+
+    teacher_id = _TEACHER_ID_CACHE.get(user.id)
+    if teacher_id is None:
+        teacher = crud.get_or_create_teacher(
+            session,
+            telegram_id=user.id,
+            name=user.full_name
+        )
+        teacher_id = teacher.id
+        _TEACHER_ID_CACHE[user.id] = teacher_id
+
+    return TeacherRef(id=teacher_id, name=user.full_name)
+
+
+def cached_teacher_id(update: Update) -> Optional[int]:
+    """ID преподавателя из кэша (без обращения к БД) или None."""
+    return _TEACHER_ID_CACHE.get(update.effective_user.id)
+
+
+def cancel_keyboard(callback_data: str) -> InlineKeyboardMarkup:
+    """Клавиатура из одной кнопки «Отмена» с указанным callback_data."""
+    return InlineKeyboardMarkup.from_button(
+        InlineKeyboardButton(CANCEL_BTN_TEXT, callback_data=callback_data)
+    )
+
+
+# === Кэш названий в рамках диалога пользователя ===
+
+def _names(context: ContextTypes.DEFAULT_TYPE, kind: str) -> dict[int, str]:
+    """Словарь ID -> название для указанного вида сущности."""
+    names = context.user_data.setdefault(
+        "names", {SUBJECT_NAMES: {}, STUDENT_NAMES: {}})
+    return names[kind]
+
+
+def get_subject_name(context: ContextTypes.DEFAULT_TYPE, session: Session,
+                     subject_id: int) -> Optional[str]:
+    """Название дисциплины: из кэша пользователя или из БД."""
+    names = _names(context, SUBJECT_NAMES)
+    name = names.get(subject_id)
+    if name is None:
+        subject = crud.get_subject_by_id(session, subject_id)
+        if subject is None:
+            return None
+        name = names[subject_id] = subject.name
+    return name
+
+
+def get_student_name(context: ContextTypes.DEFAULT_TYPE, session: Session,
+                     student_id: int) -> Optional[str]:
+    """ФИО студента: из кэша пользователя или из БД."""
+    names = _names(context, STUDENT_NAMES)
+    name = names.get(student_id)
+    if name is None:
+        student = crud.get_student_by_id(session, student_id)
+        if student is None:
+            return None
+        name = names[student_id] = student.full_name
+    return name
+
+
+def remember_name(context: ContextTypes.DEFAULT_TYPE, kind: str,
+                  entity_id: int, name: str) -> None:
+    """Запомнить актуальное название (после создания или переименования)."""
+    _names(context, kind)[entity_id] = name
+
+
+def forget_name(context: ContextTypes.DEFAULT_TYPE, kind: str, entity_id: int) -> None:
+    """Удалить название из кэша (после удаления сущности)."""
+    _names(context, kind).pop(entity_id, None)
+
+
+
+def subject_students_snapshot(context: ContextTypes.DEFAULT_TYPE) -> dict[int, tuple]:
+    """
+    Снимки состава дисциплин: subject_id -> ((ID, ФИО), ...).
+
+    Снимок удаляется при любом изменении состава или ФИО студентов,
+    поэтому наличие записи означает, что она актуальна.
+    """
+    return context.user_data.setdefault("subject_students", {})
+
+
+def forget_subject_students(context: ContextTypes.DEFAULT_TYPE,
+                            subject_id: Optional[int] = None) -> None:
+    """Сбросить снимок состава одной дисциплины или всех сразу."""
+    if subject_id is None:
+        context.user_data.pop("subject_students", None)
+    else:
+        subject_students_snapshot(context).pop(subject_id, None)
+
+
+# === Маршрутизация callback-запросов ===
+
+Route = tuple[re.Pattern, Callable[..., Awaitable]]
+
+
+def route_key(data: str) -> str:
+    """Ключ маршрута: callback_data без хвостовых ID (subject_view_5 -> subject_view)."""
+    return data.rstrip("0123456789_")
+
+
+def callback_router(routes: dict[str, Route]) -> CallbackQueryHandler:
+    """
+    Один CallbackQueryHandler вместо списка обработчиков.
+
+    Обработчик выбирается поиском в словаре по route_key(callback_data),
+    после чего проверяется только его собственный шаблон — вместо
+    последовательной проверки всех шаблонов.
+    """
+    def check(data) -> bool:
+        if not isinstance(data, str):
+            return False
+        route = routes.get(route_key(data))
+        return route is not None and route[0].match(data) is not None
+
+    async def dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        _, handler = routes[route_key(update.callback_query.data)]
+        return await handler(update, context)
+
+    return CallbackQueryHandler(dispatch, pattern=check)
+
+
+# === Фоновое выполнение тяжёлых обработчиков ===
+
+def in_background(handler):
+    """
+    Декоратор: выполнить обработчик отдельной задачей приложения.
+
+    Обновления обрабатываются по очереди, поэтому отрисовка графика или
+    формирование отчёта задерживали бы ответы остальным пользователям.
+    Задача создаётся через application.create_task с привязкой к update:
+    исключения попадают в обработчики ошибок приложения (или в лог).
+    Диалог при этом сразу завершается.
+    """
+    @wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        context.application.create_task(handler(update, context), update=update)
+        return ConversationHandler.END
+    return wrapper
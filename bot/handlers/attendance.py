@@ -13,29 +13,45 @@ from telegram.ext import (
     filters,
 )
 
-from bot.database import get_session, crud
+from bot.database import db_session, crud, run_db
 from bot.states import AttendanceStates
 from bot.utils.calendar import create_calendar, parse_calendar_callback
+from bot.utils import stats_cache
+from bot.handlers._common import get_teacher, get_subject_name
+from bot.utils.cb import tail_id
 
 logger = logging.getLogger(__name__)
 
 
 # === Вспомогательные функции ===
 
-def get_teacher_from_update(update: Update):
-    """Получить или создать преподавателя из update."""
-    user = update.effective_user
-    session = get_session()
-    try:
-        teacher = crud.get_or_create_teacher(
-            session,
-            telegram_id=user.id,
-            name=user.full_name
-        )
-        return teacher, session
-    except Exception as e:
-        session.close()
-        raise e
+def mark_all_students(session, subject_id: int, attendance_date: date,
+                      present: bool) -> dict[int, bool]:
+    """Отметить всех студентов дисциплины одним статусом."""
+    attendance_data = {}
+    for student in crud.get_students_by_subject(session, subject_id):
+        crud.set_attendance(session, student.id,
+                            subject_id, attendance_date, present)
+        attendance_data[student.id] = present
+    return attendance_data
+
+
+def load_marked_dates(context: ContextTypes.DEFAULT_TYPE, session,
+                      subject_id: int) -> frozenset[date]:
+    """
+    Загрузить даты с отметками и запомнить их в user_data.
+
+    При переключении месяцев календарь берёт даты из user_data без
+    обращения к БД; запись сбрасывается при любой отметке посещаемости.
+    """
+    marked = frozenset(crud.get_subject_attendance_dates(session, subject_id))
+    context.user_data.setdefault("marked_dates", {})[subject_id] = marked
+    return marked
+
+
+def forget_marked_dates(context: ContextTypes.DEFAULT_TYPE, subject_id: int) -> None:
+    """Сбросить сохранённые даты с отметками дисциплины."""
+    context.user_data.get("marked_dates", {}).pop(subject_id, None)
 
 
 def format_date(d: date) -> str:
@@ -140,9 +156,8 @@ async def attendance_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if query:
         await query.answer()
 
-    teacher, session = get_teacher_from_update(update)
-
-    try:
+    with db_session() as session:
+        teacher = get_teacher(update, session)
         subjects = crud.get_subjects_by_teacher(session, teacher.id)
 
         if not subjects:
@@ -194,8 +209,6 @@ async def attendance_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     keyboard) if isinstance(keyboard, list) else keyboard,
                 parse_mode="HTML"
             )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -205,12 +218,11 @@ async def attendance_select_date(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["attendance_subject_id"] = subject_id
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
+    with db_session() as session:
+        subject_name = get_subject_name(context, session, subject_id)
         students_count = crud.count_students_in_subject(session, subject_id)
 
         if students_count == 0:
@@ -223,7 +235,7 @@ async def attendance_select_date(update: Update, context: ContextTypes.DEFAULT_T
 
             await query.edit_message_text(
                 text=(
-                    f"✏️ <b>Отметка: {subject.name}</b>\n\n"
+                    f"✏️ <b>Отметка: {subject_name}</b>\n\n"
                     "В дисциплине нет студентов.\n"
                     "Сначала добавьте студентов."
                 ),
@@ -232,12 +244,12 @@ async def attendance_select_date(update: Update, context: ContextTypes.DEFAULT_T
             )
             return ConversationHandler.END
 
-        # Получаем даты с отметками
-        marked_dates = crud.get_subject_attendance_dates(session, subject_id)
+        # Получаем даты с отметками (и запоминаем для навигации по месяцам)
+        marked_dates = load_marked_dates(context, session, subject_id)
 
         await query.edit_message_text(
             text=(
-                f"✏️ <b>Отметка: {subject.name}</b>\n\n"
+                f"✏️ <b>Отметка: {subject_name}</b>\n\n"
                 f"Студентов: {students_count}\n"
                 f"📊 Дней с отметками: {len(marked_dates)}\n\n"
                 "📅 Выберите дату занятия:\n"
@@ -247,8 +259,6 @@ async def attendance_select_date(update: Update, context: ContextTypes.DEFAULT_T
                 callback_prefix="cal", subject_id=subject_id, marked_dates=marked_dates),
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -315,7 +325,7 @@ async def attendance_date_selected(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
 
-    date_str = query.data.split("_")[-1]
+    date_str = query.data.rpartition("_")[2]
     attendance_date = date.fromisoformat(date_str)
     subject_id = context.user_data.get("attendance_subject_id")
 
@@ -331,8 +341,7 @@ async def attendance_date_selected(update: Update, context: ContextTypes.DEFAULT
 
 async def show_attendance_marking(update: Update, context: ContextTypes.DEFAULT_TYPE, subject_id: int, attendance_date: date) -> int:
     """Показать список студентов для отметки (универсальная функция)."""
-    session = get_session()
-    try:
+    with db_session() as session:
         subject = crud.get_subject_by_id(session, subject_id)
         students = crud.get_students_by_subject(session, subject_id)
 
@@ -369,8 +378,6 @@ async def show_attendance_marking(update: Update, context: ContextTypes.DEFAULT_
                 reply_markup=keyboard,
                 parse_mode="HTML"
             )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -387,8 +394,7 @@ async def attendance_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     attendance_date = date.fromisoformat(date_str)
 
-    session = get_session()
-    try:
+    with db_session() as session:
         # Получаем текущий статус
         attendance_data = context.user_data.get("attendance_data", {})
         current_status = attendance_data.get(student_id, False)
@@ -404,6 +410,11 @@ async def attendance_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         # Обновляем интерфейс
         subject = crud.get_subject_by_id(session, subject_id)
+
+        # Статистика и даты с отметками по дисциплине устарели
+        stats_cache.invalidate_subject(subject_id)
+        stats_cache.invalidate_teacher(subject.teacher_id)
+        forget_marked_dates(context, subject_id)
         students = crud.get_students_by_subject(session, subject_id)
 
         present_count = sum(1 for v in attendance_data.values() if v)
@@ -424,8 +435,6 @@ async def attendance_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE)
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -440,26 +449,26 @@ async def attendance_all_present(update: Update, context: ContextTypes.DEFAULT_T
     date_str = parts[4]
     attendance_date = date.fromisoformat(date_str)
 
-    session = get_session()
-    try:
-        students = crud.get_students_by_subject(session, subject_id)
-        attendance_data = {}
-
-        for student in students:
-            crud.set_attendance(session, student.id,
-                                subject_id, attendance_date, True)
-            attendance_data[student.id] = True
+    # Пакетная запись выполняется в отдельном потоке
+    attendance_data = await run_db(
+        mark_all_students, subject_id, attendance_date, True)
 
+    with db_session() as session:
         context.user_data["attendance_data"] = attendance_data
 
         # Обновляем интерфейс
         subject = crud.get_subject_by_id(session, subject_id)
 
+        # Статистика и даты с отметками по дисциплине устарели
+        stats_cache.invalidate_subject(subject_id)
+        stats_cache.invalidate_teacher(subject.teacher_id)
+        forget_marked_dates(context, subject_id)
+
         text = (
             f"✏️ <b>Отметка посещаемости</b>\n\n"
             f"📚 {subject.name}\n"
             f"📅 {format_date(attendance_date)}\n\n"
-            f"Присутствует: {len(students)}/{len(students)}\n\n"
+            f"Присутствует: {len(attendance_data)}/{len(attendance_data)}\n\n"
             "Нажмите на студента для изменения статуса:"
         )
 
@@ -471,8 +480,6 @@ async def attendance_all_present(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -487,26 +494,26 @@ async def attendance_all_absent(update: Update, context: ContextTypes.DEFAULT_TY
     date_str = parts[4]
     attendance_date = date.fromisoformat(date_str)
 
-    session = get_session()
-    try:
-        students = crud.get_students_by_subject(session, subject_id)
-        attendance_data = {}
-
-        for student in students:
-            crud.set_attendance(session, student.id,
-                                subject_id, attendance_date, False)
-            attendance_data[student.id] = False
+    # Пакетная запись выполняется в отдельном потоке
+    attendance_data = await run_db(
+        mark_all_students, subject_id, attendance_date, False)
 
+    with db_session() as session:
         context.user_data["attendance_data"] = attendance_data
 
         # Обновляем интерфейс
         subject = crud.get_subject_by_id(session, subject_id)
 
+        # Статистика и даты с отметками по дисциплине устарели
+        stats_cache.invalidate_subject(subject_id)
+        stats_cache.invalidate_teacher(subject.teacher_id)
+        forget_marked_dates(context, subject_id)
+
         text = (
             f"✏️ <b>Отметка посещаемости</b>\n\n"
             f"📚 {subject.name}\n"
             f"📅 {format_date(attendance_date)}\n\n"
-            f"Присутствует: 0/{len(students)}\n\n"
+            f"Присутствует: 0/{len(attendance_data)}\n\n"
             "Нажмите на студента для изменения статуса:"
         )
 
@@ -518,8 +525,6 @@ async def attendance_all_absent(update: Update, context: ContextTypes.DEFAULT_TY
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -534,8 +539,7 @@ async def attendance_done(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     date_str = parts[3]
     attendance_date = date.fromisoformat(date_str)
 
-    session = get_session()
-    try:
+    with db_session() as session:
         subject = crud.get_subject_by_id(session, subject_id)
         students = crud.get_students_by_subject(session, subject_id)
         attendance_data = crud.get_attendance_by_subject_and_date(
@@ -568,8 +572,6 @@ async def attendance_done(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     # Очищаем данные из контекста
     context.user_data.pop("attendance_data", None)
@@ -591,26 +593,16 @@ async def calendar_navigate(update: Update, context: ContextTypes.DEFAULT_TYPE)
     year = data.get("year")
     month = data.get("month")
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
-        students_count = crud.count_students_in_subject(session, subject_id)
-        marked_dates = crud.get_subject_attendance_dates(session, subject_id)
+    marked_dates = context.user_data.get("marked_dates", {}).get(subject_id)
+    if marked_dates is None:
+        with db_session() as session:
+            marked_dates = load_marked_dates(context, session, subject_id)
 
-        await query.edit_message_text(
-            text=(
-                f"✏️ <b>Отметка: {subject.name}</b>\n\n"
-                f"Студентов: {students_count}\n"
-                f"📊 Дней с отметками: {len(marked_dates)}\n\n"
-                "📅 Выберите дату занятия:\n"
-                "<i>● — дни с отметками</i>"
-            ),
-            reply_markup=create_calendar(
-                year, month, callback_prefix="cal", subject_id=subject_id, marked_dates=marked_dates),
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    # Текст сообщения не меняется — обновляем только календарь
+    await query.edit_message_reply_markup(
+        reply_markup=create_calendar(
+            year, month, callback_prefix="cal", subject_id=subject_id, marked_dates=marked_dates)
+    )
 
     return ConversationHandler.END
 
@@ -2,6 +2,7 @@
 Обработчики для экспорта данных в Excel.
 """
 
+import asyncio
 import logging
 from datetime import datetime, date, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -13,8 +14,10 @@ from telegram.ext import (
     filters,
 )
 
-from bot.database import get_session, crud
+from bot.database import db_session, crud
 from bot.utils.export import create_attendance_report, create_all_subjects_report
+from bot.handlers._common import get_teacher, get_subject_name, in_background
+from bot.utils.cb import tail_id
 
 logger = logging.getLogger(__name__)
 
@@ -25,22 +28,6 @@ WAITING_DATE_TO = 2
 
 # === Вспомогательные функции ===
 
-def get_teacher_from_update(update: Update):
-    """Получить или создать преподавателя из update."""
-    user = update.effective_user
-    session = get_session()
-    try:
-        teacher = crud.get_or_create_teacher(
-            session,
-            telegram_id=user.id,
-            name=user.full_name
-        )
-        return teacher, session
-    except Exception as e:
-        session.close()
-        raise e
-
-
 def format_date(d: date) -> str:
     """Форматировать дату."""
     return d.strftime("%d.%m.%Y")
@@ -90,10 +77,9 @@ async def export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     if query:
         await query.answer()
 
-    teacher, session = get_teacher_from_update(update)
-
-    try:
-        subjects = crud.get_subjects_by_teacher(session, teacher.id)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
+        subjects = crud.get_subjects_with_counts(session, teacher.id)
 
         if not subjects:
             keyboard = InlineKeyboardMarkup([
@@ -126,11 +112,7 @@ async def export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
             # Кнопки по дисциплинам
             for subject in subjects:
-                students_count = crud.count_students_in_subject(
-                    session, subject.id)
-                dates = crud.get_subject_attendance_dates(session, subject.id)
-
-                badge = f"({students_count} студ., {len(dates)} дат)"
+                badge = f"({subject.students_count} студ., {subject.dates_count} дат)"
                 keyboard.append([
                     InlineKeyboardButton(
                         f"📚 {subject.name} {badge}",
@@ -164,8 +146,6 @@ async def export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
                     keyboard) if isinstance(keyboard, list) else keyboard,
                 parse_mode="HTML"
             )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -184,16 +164,13 @@ async def export_select_period(update: Update, context: ContextTypes.DEFAULT_TYP
         text = "📆 <b>Экспорт всех дисциплин</b>\n\nВыберите период:"
     else:
         # subj_123
-        subject_id = int(data.split("_")[-1])
+        subject_id = tail_id(data)
         context.user_data["export_type"] = "subject"
         context.user_data["export_subject_id"] = subject_id
 
-        session = get_session()
-        try:
-            subject = crud.get_subject_by_id(session, subject_id)
-            text = f"📆 <b>Экспорт: {subject.name}</b>\n\nВыберите период:"
-        finally:
-            session.close()
+        with db_session() as session:
+            subject_name = get_subject_name(context, session, subject_id)
+            text = f"📆 <b>Экспорт: {subject_name}</b>\n\nВыберите период:"
 
         keyboard = get_period_keyboard("subj", subject_id)
 
@@ -212,11 +189,7 @@ async def export_with_period(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer("📊 Формирую отчёт...")
 
     # Парсим callback_data: exp_period_TYPE_SUBJECTID_PERIOD
-    parts = query.data.split("_")
-    period = parts[-1]  # all, week, month, custom
-
-    export_type = context.user_data.get("export_type", "all")
-    subject_id = context.user_data.get("export_subject_id")
+    period = query.data.rpartition("_")[2]  # all, week, month, custom
 
     today = date.today()
     date_from = None
@@ -248,8 +221,9 @@ async def export_with_period(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return WAITING_DATE_FROM
 
-    # Выполняем экспорт
-    return await do_export(update, context, export_type, subject_id, date_from, date_to)
+    context.user_data["export_date_from"] = date_from
+    context.user_data["export_date_to"] = date_to
+    return await run_export(update, context)
 
 
 async def export_date_from_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -317,11 +291,30 @@ async def export_date_to_input(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data["export_date_to"] = date_to
     context.user_data["export_period_text"] = f"{format_date(date_from)} — {format_date(date_to)}"
 
-    export_type = context.user_data.get("export_type", "all")
-    subject_id = context.user_data.get("export_subject_id")
+    return await run_export_from_message(update, context)
 
-    # Выполняем экспорт
-    return await do_export_from_message(update, context, export_type, subject_id, date_from, date_to)
+
+def _export_params(context: ContextTypes.DEFAULT_TYPE) -> tuple:
+    """Параметры экспорта из user_data: тип, дисциплина, начало и конец периода."""
+    user_data = context.user_data
+    return (
+        user_data.get("export_type", "all"),
+        user_data.get("export_subject_id"),
+        user_data.get("export_date_from"),
+        user_data.get("export_date_to"),
+    )
+
+
+@in_background
+async def run_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Экспорт по нажатию кнопки периода (в фоне)."""
+    return await do_export(update, context, *_export_params(context))
+
+
+@in_background
+async def run_export_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Экспорт после ввода конечной даты периода (в фоне)."""
+    return await do_export_from_message(update, context, *_export_params(context))
 
 
 async def do_export(update: Update, context, export_type: str, subject_id: int | None,
@@ -329,18 +322,12 @@ async def do_export(update: Update, context, export_type: str, subject_id: int |
     """Выполнить экспорт (из callback query)."""
     query = update.callback_query
 
-    session = get_session()
-    try:
+    with db_session() as session:
         if export_type == "subject" and subject_id:
             subject = crud.get_subject_by_id(session, subject_id)
             students = crud.get_students_by_subject(session, subject_id)
-            dates = crud.get_subject_attendance_dates(session, subject_id)
-
-            # Фильтруем даты
-            if date_from:
-                dates = [d for d in dates if d >= date_from]
-            if date_to:
-                dates = [d for d in dates if d <= date_to]
+            dates = crud.get_subject_attendance_dates(
+                session, subject_id, date_from, date_to)
 
             if not students:
                 keyboard = InlineKeyboardMarkup([
@@ -372,13 +359,15 @@ async def do_export(update: Update, context, export_type: str, subject_id: int |
                     parse_mode="HTML"
                 )
                 return ConversationHandler.END
-    finally:
-        session.close()
+        else:
+            teacher = get_teacher(update, session)
+            subjects = crud.get_subjects_by_teacher(session, teacher.id)
 
     try:
         if export_type == "subject" and subject_id:
-            file_data = create_attendance_report(
-                subject_id, date_from, date_to)
+            # Отчёт строится в отдельном потоке, чтобы не блокировать бота
+            file_data = await asyncio.to_thread(
+                create_attendance_report, subject_id, date_from, date_to)
 
             timestamp = datetime.now().strftime("%Y%m%d_%H%M")
             safe_name = "".join(
@@ -396,14 +385,8 @@ async def do_export(update: Update, context, export_type: str, subject_id: int |
                 f"📅 Дат: {len(dates)}{period_text}"
             )
         else:
-            teacher, session = get_teacher_from_update(update)
-            try:
-                subjects = crud.get_subjects_by_teacher(session, teacher.id)
-            finally:
-                session.close()
-
-            file_data = create_all_subjects_report(
-                teacher.id, date_from, date_to)
+            file_data = await asyncio.to_thread(
+                create_all_subjects_report, teacher.id, date_from, date_to)
 
             timestamp = datetime.now().strftime("%Y%m%d_%H%M")
             filename = f"Посещаемость_все_дисциплины_{timestamp}.xlsx"
@@ -461,18 +444,12 @@ async def do_export_from_message(update: Update, context, export_type: str, subj
                                  date_from: date | None, date_to: date | None) -> int:
     """Выполнить экспорт (из текстового сообщения)."""
 
-    session = get_session()
-    try:
+    with db_session() as session:
         if export_type == "subject" and subject_id:
             subject = crud.get_subject_by_id(session, subject_id)
             students = crud.get_students_by_subject(session, subject_id)
-            dates = crud.get_subject_attendance_dates(session, subject_id)
-
-            # Фильтруем даты
-            if date_from:
-                dates = [d for d in dates if d >= date_from]
-            if date_to:
-                dates = [d for d in dates if d <= date_to]
+            dates = crud.get_subject_attendance_dates(
+                session, subject_id, date_from, date_to)
 
             if not dates:
                 keyboard = InlineKeyboardMarkup([
@@ -485,13 +462,15 @@ async def do_export_from_message(update: Update, context, export_type: str, subj
                     parse_mode="HTML"
                 )
                 return ConversationHandler.END
-    finally:
-        session.close()
+        else:
+            teacher = get_teacher(update, session)
+            subjects = crud.get_subjects_by_teacher(session, teacher.id)
 
     try:
         if export_type == "subject" and subject_id:
-            file_data = create_attendance_report(
-                subject_id, date_from, date_to)
+            # Отчёт строится в отдельном потоке, чтобы не блокировать бота
+            file_data = await asyncio.to_thread(
+                create_attendance_report, subject_id, date_from, date_to)
 
             timestamp = datetime.now().strftime("%Y%m%d_%H%M")
             safe_name = "".join(
@@ -506,14 +485,8 @@ async def do_export_from_message(update: Update, context, export_type: str, subj
                 f"📆 Период: {format_date(date_from)} — {format_date(date_to)}"
             )
         else:
-            teacher, session = get_teacher_from_update(update)
-            try:
-                subjects = crud.get_subjects_by_teacher(session, teacher.id)
-            finally:
-                session.close()
-
-            file_data = create_all_subjects_report(
-                teacher.id, date_from, date_to)
+            file_data = await asyncio.to_thread(
+                create_all_subjects_report, teacher.id, date_from, date_to)
 
             timestamp = datetime.now().strftime("%Y%m%d_%H%M")
             filename = f"Посещаемость_все_дисциплины_{timestamp}.xlsx"
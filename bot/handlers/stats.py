@@ -2,8 +2,13 @@
 Обработчики для статистики и визуализации.
 """
 
+import asyncio
+import io
 import logging
+import re
 from datetime import date, timedelta, datetime
+
+import numpy as np
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes,
@@ -13,13 +18,21 @@ from telegram.ext import (
     filters,
 )
 
-from bot.database import get_session, crud
-from bot.utils.stats import get_subject_stats, get_teacher_overall_stats
+from bot.database import db_session, crud, run_db
+from bot.handlers._common import get_teacher, get_subject_name, in_background
+from bot.utils import chart_cache
+from bot.utils.stats import (
+    get_subject_stats,
+    get_teacher_overall_stats,
+    get_attendance_by_dates,
+)
 from bot.utils.charts import (
     create_dates_chart,
     create_students_chart,
     create_overall_chart,
+    render_chart,
 )
+from bot.utils.cb import tail_id
 
 
 logger = logging.getLogger(__name__)
@@ -28,24 +41,28 @@ logger = logging.getLogger(__name__)
 WAITING_STATS_DATE_FROM = 1
 WAITING_STATS_DATE_TO = 2
 
+# Шаблоны callback_data (компилируются один раз при импорте)
+_MENU_STATS_RE = re.compile(r"^menu_stats$", re.ASCII)
+_STATS_OVERALL_RE = re.compile(r"^stats_overall$", re.ASCII)
+_STATS_OVERALL_PERIOD_RE = re.compile(r"^stats_overall_period_(\w+)$", re.ASCII)
+_STATS_OVERALL_CHART_RE = re.compile(r"^stats_overall_chart$", re.ASCII)
+_STATS_SUBJECT_RE = re.compile(r"^stats_subject_(\d+)$", re.ASCII)
+_STATS_PERIOD_RE = re.compile(r"^stats_period_(\d+)_(\w+)$", re.ASCII)
+_STATS_CHART_DATES_RE = re.compile(r"^stats_chart_dates_(\d+)$", re.ASCII)
+_STATS_CHART_STUDENTS_RE = re.compile(r"^stats_chart_students_(\d+)$", re.ASCII)
+_NOOP_RE = re.compile(r"^noop$", re.ASCII)
+
+# Статичные кнопки и клавиатуры (создаются один раз при импорте)
+BACK_TO_MENU_BTN = InlineKeyboardButton(
+    "◀️ Назад в меню", callback_data="back_to_menu")
+BACK_TO_STATS_BTN = InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")
+BACK_TO_STATS_KEYBOARD = InlineKeyboardMarkup([[BACK_TO_STATS_BTN]])
+BACK_TO_OVERALL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("◀️ Назад", callback_data="stats_overall")],
+])
 
-# === Вспомогательные функции ===
-
-def get_teacher_from_update(update: Update):
-    """Получить или создать преподавателя из update."""
-    user = update.effective_user
-    session = get_session()
-    try:
-        teacher = crud.get_or_create_teacher(
-            session,
-            telegram_id=user.id,
-            name=user.full_name
-        )
-        return teacher, session
-    except Exception as e:
-        session.close()
-        raise e
 
+# === Вспомогательные функции ===
 
 def format_percentage(pct: float) -> str:
     """Форматирование процента с эмодзи."""
@@ -59,6 +76,20 @@ def format_percentage(pct: float) -> str:
         return f"🔴 {pct:.0f}%"
 
 
+# Границы уровней посещаемости и соответствующие им эмодзи
+_PCT_THRESHOLDS = (40, 60, 80)
+_PCT_EMOJI = ("🔴", "🟠", "🟡", "🟢")
+
+
+def format_percentages(pcts) -> list[str]:
+    """Форматирование списка процентов с эмодзи за один проход."""
+    values = np.asarray(pcts, dtype=float)
+    levels = np.searchsorted(_PCT_THRESHOLDS, values, side="right")
+    rounded = np.rint(values).astype(int)
+    return [f"{_PCT_EMOJI[level]} {pct}%"
+            for level, pct in zip(levels.tolist(), rounded.tolist())]
+
+
 def format_date(d: date) -> str:
     """Форматировать дату."""
     return d.strftime("%d.%m.%Y")
@@ -79,11 +110,45 @@ def get_period_keyboard(subject_id: int) -> InlineKeyboardMarkup:
                               callback_data=f"stats_period_{subject_id}_month")],
         [InlineKeyboardButton(
             "📆 Указать период...", callback_data=f"stats_period_{subject_id}_custom")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+        [BACK_TO_STATS_BTN],
     ]
     return InlineKeyboardMarkup(keyboard)
 
 
+async def send_chart(query, key: str, render, caption: str, parse_mode=None) -> bool:
+    """
+    Отправить график с использованием кэша.
+
+    Если график с такими данными уже отправлялся, он пересылается по
+    file_id, иначе отрисовывается через await render() и запоминается.
+    Возвращает False, если данных для графика нет.
+    """
+    cached = chart_cache.get(key)
+    if cached and cached["file_id"]:
+        await query.message.reply_photo(
+            photo=cached["file_id"],
+            caption=caption,
+            parse_mode=parse_mode
+        )
+        return True
+
+    if cached:
+        chart = io.BytesIO(cached["bytes"])
+    else:
+        chart = await render()
+        if not chart:
+            return False
+        chart_cache.put(key, chart.getvalue())
+
+    message = await query.message.reply_photo(
+        photo=chart,
+        caption=caption,
+        parse_mode=parse_mode
+    )
+    chart_cache.set_file_id(key, message.photo[-1].file_id)
+    return True
+
+
 # === Основные обработчики ===
 
 async def stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -92,17 +157,16 @@ async def stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if query:
         await query.answer()
 
-    teacher, session = get_teacher_from_update(update)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
 
-    try:
-        subjects = crud.get_subjects_by_teacher(session, teacher.id)
+        subjects = crud.get_subjects_with_counts(session, teacher.id)
 
         if not subjects:
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton(
                     "📚 Создать дисциплину", callback_data="subject_add")],
-                [InlineKeyboardButton(
-                    "◀️ Назад в меню", callback_data="back_to_menu")],
+                [BACK_TO_MENU_BTN],
             ])
 
             text = (
@@ -119,11 +183,7 @@ async def stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             ]
 
             for subject in subjects:
-                students_count = crud.count_students_in_subject(
-                    session, subject.id)
-                dates = crud.get_subject_attendance_dates(session, subject.id)
-
-                badge = f"({students_count} студ., {len(dates)} дат)"
+                badge = f"({subject.students_count} студ., {subject.dates_count} дат)"
                 keyboard.append([
                     InlineKeyboardButton(
                         f"📚 {subject.name} {badge}",
@@ -132,8 +192,7 @@ async def stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 ])
 
             keyboard.append([
-                InlineKeyboardButton(
-                    "◀️ Назад в меню", callback_data="back_to_menu"),
+                BACK_TO_MENU_BTN,
             ])
 
             text = (
@@ -157,8 +216,6 @@ async def stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                     keyboard) if isinstance(keyboard, list) else keyboard,
                 parse_mode="HTML"
             )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -179,7 +236,7 @@ async def stats_overall(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
                               callback_data="stats_overall_period_week")],
         [InlineKeyboardButton(f"📅 Последний месяц ({format_date(month_ago)} — {format_date(today)})",
                               callback_data="stats_overall_period_month")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+        [BACK_TO_STATS_BTN],
     ]
 
     await query.edit_message_text(
@@ -196,7 +253,7 @@ async def stats_overall_period_selected(update: Update, context: ContextTypes.DE
     query = update.callback_query
     await query.answer("📊 Загрузка статистики...")
 
-    period = query.data.split("_")[-1]
+    period = query.data.rpartition("_")[2]
 
     today = date.today()
     date_from = None
@@ -217,15 +274,13 @@ async def stats_overall_period_selected(update: Update, context: ContextTypes.DE
     context.user_data["stats_overall_date_to"] = date_to
     context.user_data["stats_overall_period_text"] = period_text
 
-    teacher, session = get_teacher_from_update(update)
-    session.close()
-
-    stats = get_teacher_overall_stats(teacher.id, date_from, date_to)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
+        stats = get_teacher_overall_stats(
+            teacher.id, date_from, date_to, session=session)
 
     if stats.get("total_subjects", 0) == 0:
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
-        ])
+        keyboard = BACK_TO_STATS_KEYBOARD
         await query.edit_message_text(
             text="📊 <b>Общая статистика</b>\n\nНет данных.",
             reply_markup=keyboard,
@@ -257,7 +312,7 @@ async def stats_overall_period_selected(update: Update, context: ContextTypes.DE
                               callback_data="stats_overall_chart")],
         [InlineKeyboardButton(
             "📅 Другой период", callback_data="stats_overall")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+        [BACK_TO_STATS_BTN],
     ]
 
     await query.edit_message_text(
@@ -269,6 +324,7 @@ async def stats_overall_period_selected(update: Update, context: ContextTypes.DE
     return ConversationHandler.END
 
 
+@in_background
 async def stats_overall_chart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отправить график по всем дисциплинам."""
     query = update.callback_query
@@ -279,35 +335,29 @@ async def stats_overall_chart(update: Update, context: ContextTypes.DEFAULT_TYPE
     date_to = context.user_data.get("stats_overall_date_to")
     period_text = context.user_data.get("stats_overall_period_text", "")
 
-    teacher, session = get_teacher_from_update(update)
-    session.close()
-
-    stats = get_teacher_overall_stats(teacher.id, date_from, date_to)
-
-    chart = create_overall_chart(stats.get("subjects_stats", []))
-
-    if not chart:
-        await query.answer("Недостаточно данных для графика", show_alert=True)
-        return ConversationHandler.END
+    with db_session() as session:
+        teacher = get_teacher(update, session)
+        stats = get_teacher_overall_stats(
+            teacher.id, date_from, date_to, session=session)
+    subjects_stats = stats.get("subjects_stats", [])
 
     caption = "📊 Посещаемость по дисциплинам"
     if period_text:
         caption += f"\n{period_text}"
 
-    await query.message.reply_photo(
-        photo=chart,
-        caption=caption
+    sent = await send_chart(
+        query,
+        chart_cache.make_key("overall", subjects_stats),
+        lambda: render_chart(create_overall_chart, subjects_stats),
+        caption
     )
 
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("◀️ Назад", callback_data="stats_overall")],
-    ])
+    if not sent:
+        await query.answer("Недостаточно данных для графика", show_alert=True)
+        return ConversationHandler.END
 
-    await query.edit_message_text(
-        text="✅ График отправлен!",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    # График уже в чате: у исходного сообщения меняем только кнопки
+    await query.edit_message_reply_markup(reply_markup=BACK_TO_OVERALL_KEYBOARD)
 
     return ConversationHandler.END
 
@@ -317,11 +367,10 @@ async def stats_subject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["stats_subject_id"] = subject_id
 
-    session = get_session()
-    try:
+    with db_session() as session:
         subject = crud.get_subject_by_id(session, subject_id)
         dates = crud.get_subject_attendance_dates(session, subject_id)
 
@@ -329,7 +378,7 @@ async def stats_subject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton(
                     "✏️ Отметить посещаемость", callback_data=f"att_select_date_{subject_id}")],
-                [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+                [BACK_TO_STATS_BTN],
             ])
             await query.edit_message_text(
                 text=f"📊 <b>{subject.name}</b>\n\nНет данных о посещаемости.",
@@ -347,8 +396,6 @@ async def stats_subject(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             reply_markup=get_period_keyboard(subject_id),
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -413,7 +460,7 @@ async def show_subject_stats(query, context, subject_id: int, date_from, date_to
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton(
                 "📅 Другой период", callback_data=f"stats_subject_{subject_id}")],
-            [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+            [BACK_TO_STATS_BTN],
         ])
         await query.edit_message_text(
             text=f"📊 <b>{stats['subject_name']}</b>\n\nНет данных {period_text}.",
@@ -443,10 +490,9 @@ async def show_subject_stats(query, context, subject_id: int, date_from, date_to
     if len(students) > 8:
         lines.append("...")
         # Худшие
-        for st in students[-3:]:
-            idx = students.index(st) + 1
+        for i, st in enumerate(students[-3:], len(students) - 2):
             lines.append(
-                f"{idx}. {st['student_name']}: {format_percentage(st['percentage'])}")
+                f"{i}. {st['student_name']}: {format_percentage(st['percentage'])}")
     elif len(students) > 5:
         for i, st in enumerate(students[5:], 6):
             lines.append(
@@ -461,7 +507,7 @@ async def show_subject_stats(query, context, subject_id: int, date_from, date_to
         ],
         [InlineKeyboardButton(
             "📅 Другой период", callback_data=f"stats_subject_{subject_id}")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+        [BACK_TO_STATS_BTN],
     ]
 
     await query.edit_message_text(
@@ -473,67 +519,95 @@ async def show_subject_stats(query, context, subject_id: int, date_from, date_to
     return ConversationHandler.END
 
 
+def dates_chart_key(subject_name: str, dates_df, date_from, date_to) -> str:
+    """
+    Ключ кэша графика по датам.
+
+    Строится по отрисовываемым строкам (дата, присутствовало, всего)
+    и периоду: итоги по студентам не отражают распределение по датам.
+    """
+    rows = [] if dates_df.empty else [
+        (day, int(present), int(total))
+        for day, present, total in dates_df[["date", "present", "total"]].itertuples(index=False)
+    ]
+    return chart_cache.make_key("dates", {
+        "subject_name": subject_name,
+        "rows": rows,
+        "date_from": date_from,
+        "date_to": date_to,
+    })
+
+
+@in_background
 async def stats_chart_dates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отправить график посещаемости по датам."""
     query = update.callback_query
     await query.answer("📊 Создаю график...")
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
 
     # Получаем период из контекста
     date_from = context.user_data.get("stats_date_from")
     date_to = context.user_data.get("stats_date_to")
     period_text = context.user_data.get("stats_period_text", "")
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
-        subject_name = subject.name if subject else "Дисциплина"
-    finally:
-        session.close()
-
-    chart = create_dates_chart(subject_id, subject_name, date_from, date_to)
-
-    if not chart:
-        await query.answer("Недостаточно данных для графика", show_alert=True)
-        return ConversationHandler.END
+    # Для подписи нужно только название: из кэша пользователя или из БД
+    # в отдельном потоке, чтобы не блокировать цикл событий
+    subject_name = await run_db(
+        lambda session: get_subject_name(context, session, subject_id)
+    ) or "Дисциплина"
 
     caption = f"📊 Посещаемость по датам: {subject_name}"
     if period_text:
         caption += f"\n{period_text}"
 
-    await query.message.reply_photo(
-        photo=chart,
-        caption=caption
+    # Данные читаются здесь: по ним строится ключ кэша, а в процесс
+    # отрисовки передаётся только DataFrame
+    dates_df = await asyncio.to_thread(get_attendance_by_dates, subject_id)
+
+    async def render():
+        return await render_chart(
+            create_dates_chart, subject_id, subject_name, date_from, date_to,
+            dates_df=dates_df)
+
+    sent = await send_chart(
+        query,
+        dates_chart_key(subject_name, dates_df, date_from, date_to),
+        render,
+        caption
     )
 
+    if not sent:
+        await query.answer("Недостаточно данных для графика", show_alert=True)
+        return ConversationHandler.END
+
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("◀️ Назад к статистике",
                               callback_data=f"stats_subject_{subject_id}")],
     ])
 
-    await query.edit_message_text(
-        text="✅ График отправлен!",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    # Результат уже в чате: у исходного сообщения меняем только кнопки
+    await query.edit_message_reply_markup(reply_markup=keyboard)
 
     return ConversationHandler.END
 
 
+@in_background
 async def stats_chart_students(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отправить график и список посещаемости по студентам."""
     query = update.callback_query
     await query.answer("📊 Создаю отчёт...")
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
 
     # Получаем период из контекста
     date_from = context.user_data.get("stats_date_from")
     date_to = context.user_data.get("stats_date_to")
     period_text = context.user_data.get("stats_period_text", "")
 
-    stats = get_subject_stats(subject_id, date_from, date_to)
+    # Статистика считается в потоке, чтобы не блокировать цикл событий
+    stats = await asyncio.to_thread(
+        get_subject_stats, subject_id, date_from, date_to)
 
     if not stats:
         await query.answer("Дисциплина не найдена", show_alert=True)
@@ -541,9 +615,6 @@ async def stats_chart_students(update: Update, context: ContextTypes.DEFAULT_TYP
 
     subject_name = stats.get("subject_name", "Дисциплина")
 
-    # Создаём график
-    chart = create_students_chart(subject_id, subject_name, date_from, date_to)
-
     # Формируем текстовый список
     students = stats.get("students_stats", [])
     lines = [f"📊 <b>{subject_name}</b>"]
@@ -551,9 +622,10 @@ async def stats_chart_students(update: Update, context: ContextTypes.DEFAULT_TYP
         lines.append(f"<i>{period_text}</i>")
     lines.append("\n<b>Все студенты:</b>\n")
 
-    for i, st in enumerate(students, 1):
+    badges = format_percentages([st["percentage"] for st in students])
+    for i, (st, badge) in enumerate(zip(students, badges), 1):
         lines.append(
-            f"{i}. {st['student_name']}: {format_percentage(st['percentage'])} "
+            f"{i}. {st['student_name']}: {badge} "
             f"({st['present']}/{st['total']})"
         )
 
@@ -562,13 +634,17 @@ async def stats_chart_students(update: Update, context: ContextTypes.DEFAULT_TYP
         text = text[:1000] + "\n\n... (список обрезан)"
 
     # Отправляем график (если есть данные)
-    if chart:
-        await query.message.reply_photo(
-            photo=chart,
-            caption=text,
-            parse_mode="HTML"
-        )
-    else:
+    sent = await send_chart(
+        query,
+        chart_cache.make_key("students", stats),
+        lambda: render_chart(
+            create_students_chart, subject_id, subject_name, date_from, date_to,
+            students_stats=students),
+        text,
+        parse_mode="HTML"
+    )
+
+    if not sent:
         await query.message.reply_text(
             text=text,
             parse_mode="HTML"
@@ -579,11 +655,8 @@ async def stats_chart_students(update: Update, context: ContextTypes.DEFAULT_TYP
                               callback_data=f"stats_subject_{subject_id}")],
     ])
 
-    await query.edit_message_text(
-        text="✅ Отчёт отправлен!",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    # Результат уже в чате: у исходного сообщения меняем только кнопки
+    await query.edit_message_reply_markup(reply_markup=keyboard)
 
     return ConversationHandler.END
 
@@ -681,7 +754,7 @@ async def stats_date_to_input(update: Update, context: ContextTypes.DEFAULT_TYPE
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton(
                 "📅 Другой период", callback_data=f"stats_subject_{subject_id}")],
-            [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+            [BACK_TO_STATS_BTN],
         ])
         await update.message.reply_text(
             text=f"📊 <b>{stats.get('subject_name', 'Дисциплина')}</b>\n\nНет данных {period_text}.",
@@ -717,7 +790,7 @@ async def stats_date_to_input(update: Update, context: ContextTypes.DEFAULT_TYPE
         ],
         [InlineKeyboardButton(
             "📅 Другой период", callback_data=f"stats_subject_{subject_id}")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="menu_stats")],
+        [BACK_TO_STATS_BTN],
     ]
 
     await update.message.reply_text(
@@ -742,38 +815,38 @@ def get_stats_conversation_handler() -> ConversationHandler:
     """Создать ConversationHandler для статистики."""
     return ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(stats_menu, pattern="^menu_stats$"),
-            CallbackQueryHandler(stats_overall, pattern="^stats_overall$"),
+            CallbackQueryHandler(stats_menu, pattern=_MENU_STATS_RE),
+            CallbackQueryHandler(stats_overall, pattern=_STATS_OVERALL_RE),
             CallbackQueryHandler(stats_overall_period_selected,
-                                 pattern=r"^stats_overall_period_\w+$"),
+                                 pattern=_STATS_OVERALL_PERIOD_RE),
             CallbackQueryHandler(stats_overall_chart,
-                                 pattern="^stats_overall_chart$"),
+                                 pattern=_STATS_OVERALL_CHART_RE),
             CallbackQueryHandler(
-                stats_subject, pattern=r"^stats_subject_\d+$"),
+                stats_subject, pattern=_STATS_SUBJECT_RE),
             CallbackQueryHandler(stats_period_selected,
-                                 pattern=r"^stats_period_\d+_\w+$"),
+                                 pattern=_STATS_PERIOD_RE),
             CallbackQueryHandler(
-                stats_chart_dates, pattern=r"^stats_chart_dates_\d+$"),
+                stats_chart_dates, pattern=_STATS_CHART_DATES_RE),
             CallbackQueryHandler(stats_chart_students,
-                                 pattern=r"^stats_chart_students_\d+$"),
-            CallbackQueryHandler(noop_callback, pattern="^noop$"),
+                                 pattern=_STATS_CHART_STUDENTS_RE),
+            CallbackQueryHandler(noop_callback, pattern=_NOOP_RE),
         ],
         states={
             WAITING_STATS_DATE_FROM: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                stats_date_from_input),
                 CallbackQueryHandler(
-                    stats_subject, pattern=r"^stats_subject_\d+$"),
+                    stats_subject, pattern=_STATS_SUBJECT_RE),
             ],
             WAITING_STATS_DATE_TO: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                stats_date_to_input),
                 CallbackQueryHandler(
-                    stats_subject, pattern=r"^stats_subject_\d+$"),
+                    stats_subject, pattern=_STATS_SUBJECT_RE),
             ],
         },
         fallbacks=[
-            CallbackQueryHandler(stats_menu, pattern="^menu_stats$"),
+            CallbackQueryHandler(stats_menu, pattern=_MENU_STATS_RE),
         ],
         allow_reentry=True,
     )
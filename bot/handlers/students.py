@@ -3,6 +3,7 @@
 """
 
 import logging
+import re
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes,
@@ -12,39 +13,50 @@ from telegram.ext import (
     filters,
 )
 
-from bot.database import get_session, crud
+from bot.database import db_session, crud
+from bot.handlers._common import (
+    get_teacher,
+    cancel_keyboard,
+    get_student_name,
+    remember_name,
+    forget_name,
+    forget_subject_students,
+    STUDENT_NAMES,
+)
 from bot.states import StudentStates
+from bot.utils import stats_cache
+from bot.utils.cb import tail_id
 
 logger = logging.getLogger(__name__)
 
+# Шаблоны callback_data (компилируются один раз при импорте)
+_MENU_STUDENTS_RE = re.compile(r"^menu_students$", re.ASCII)
+_POOL_STUDENT_ADD_RE = re.compile(r"^pool_student_add$", re.ASCII)
+_POOL_STUDENT_BULK_RE = re.compile(r"^pool_student_bulk$", re.ASCII)
+_POOL_STUDENT_VIEW_RE = re.compile(r"^pool_student_view_(\d+)$", re.ASCII)
+_POOL_STUDENT_EDIT_RE = re.compile(r"^pool_student_edit_(\d+)$", re.ASCII)
+_POOL_STUDENT_DELETE_RE = re.compile(r"^pool_student_delete_(\d+)$", re.ASCII)
+_POOL_STUDENT_DELETE_YES_RE = re.compile(r"^pool_student_delete_yes_(\d+)$", re.ASCII)
 
-# === Вспомогательные функции ===
+# Статичные кнопки и клавиатуры (создаются один раз при импорте)
+BACK_TO_MENU_BTN = InlineKeyboardButton(
+    "◀️ Назад в меню", callback_data="back_to_menu")
+CANCEL_MENU_STUDENTS_BTN = InlineKeyboardButton(
+    "❌ Отмена", callback_data="menu_students")
+CANCEL_MENU_STUDENTS_KEYBOARD = InlineKeyboardMarkup([[CANCEL_MENU_STUDENTS_BTN]])
 
-def get_teacher_from_update(update: Update):
-    """Получить или создать преподавателя из update."""
-    user = update.effective_user
-    session = get_session()
-    try:
-        teacher = crud.get_or_create_teacher(
-            session,
-            telegram_id=user.id,
-            name=user.full_name
-        )
-        return teacher, session
-    except Exception as e:
-        session.close()
-        raise e
 
+# === Вспомогательные функции ===
 
 def get_students_pool_keyboard(teacher_id: int, session) -> InlineKeyboardMarkup:
     """Создать клавиатуру со списком всех студентов (общий пул)."""
     students = crud.get_all_students_by_teacher(session, teacher_id)
+    # Количество дисциплин у студентов (одним запросом)
+    counts = crud.count_subjects_per_student(session, teacher_id)
 
     keyboard = []
     for student in students:
-        # Количество дисциплин у студента
-        subjects = crud.get_subjects_by_student(session, student.id)
-        subjects_count = len(subjects)
+        subjects_count = counts.get(student.id, 0)
         badge = f" ({subjects_count} дисц.)" if subjects_count else ""
 
         keyboard.append([
@@ -63,12 +75,19 @@ def get_students_pool_keyboard(teacher_id: int, session) -> InlineKeyboardMarkup
                              callback_data="pool_student_bulk"),
     ])
     keyboard.append([
-        InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"),
+        BACK_TO_MENU_BTN,
     ])
 
     return InlineKeyboardMarkup(keyboard)
 
 
+def _invalidate_student_stats(session, teacher_id: int, student_id: int) -> None:
+    """Сбросить кэш статистики по всем дисциплинам студента."""
+    for subject in crud.get_subjects_by_student(session, student_id):
+        stats_cache.invalidate_subject(subject.id)
+    stats_cache.invalidate_teacher(teacher_id)
+
+
 # === Основные обработчики ===
 
 async def students_pool_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -77,9 +96,9 @@ async def students_pool_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if query:
         await query.answer()
 
-    teacher, session = get_teacher_from_update(update)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
 
-    try:
         students = crud.get_all_students_by_teacher(session, teacher.id)
 
         if students:
@@ -110,8 +129,6 @@ async def students_pool_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 reply_markup=keyboard,
                 parse_mode="HTML"
             )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -121,9 +138,7 @@ async def pool_student_add_start(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
 
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("❌ Отмена", callback_data="menu_students")]
-    ])
+    keyboard = CANCEL_MENU_STUDENTS_KEYBOARD
 
     await query.edit_message_text(
         text=(
@@ -153,9 +168,9 @@ async def pool_student_add_name(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return StudentStates.WAITING_NAME
 
-    teacher, session = get_teacher_from_update(update)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
 
-    try:
         student = crud.create_student(session, teacher.id, full_name)
         logger.info("Создан студент: %s (teacher_id=%s)",
                     student.full_name, teacher.id)
@@ -167,8 +182,6 @@ async def pool_student_add_name(update: Update, context: ContextTypes.DEFAULT_TY
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -178,9 +191,7 @@ async def pool_student_bulk_start(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
 
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("❌ Отмена", callback_data="menu_students")]
-    ])
+    keyboard = CANCEL_MENU_STUDENTS_KEYBOARD
 
     await query.edit_message_text(
         text=(
@@ -221,9 +232,9 @@ async def pool_student_bulk_names(update: Update, context: ContextTypes.DEFAULT_
         )
         return StudentStates.WAITING_BULK_NAMES
 
-    teacher, session = get_teacher_from_update(update)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
 
-    try:
         students = crud.create_students_bulk(session, teacher.id, valid_names)
         logger.info("Создано %s студентов (teacher_id=%s)",
                     len(students), teacher.id)
@@ -239,8 +250,6 @@ async def pool_student_bulk_names(update: Update, context: ContextTypes.DEFAULT_
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -250,48 +259,43 @@ async def pool_student_view(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
 
-    student_id = int(query.data.split("_")[-1])
+    student_id = tail_id(query.data)
     context.user_data["current_student_id"] = student_id
 
-    session = get_session()
-    try:
-        student = crud.get_student_by_id(session, student_id)
+    with db_session() as session:
+        profile = crud.get_student_profile(session, student_id)
 
-        if not student:
+        if not profile:
             await query.edit_message_text("❌ Студент не найден.")
             return ConversationHandler.END
 
-        # Дисциплины студента
-        subjects = crud.get_subjects_by_student(session, student_id)
-
-        # Общая статистика посещаемости
-        all_attendances = crud.get_student_all_attendance(session, student_id)
-        total = len(all_attendances)
-        present = sum(1 for a in all_attendances if a.is_present)
+        total = profile.total
+        present = profile.present
         percent = round(present / total * 100) if total > 0 else 0
 
-        text = (
-            f"👤 <b>{student.full_name}</b>\n\n"
-            f"📅 Добавлен: {student.created_at.strftime('%d.%m.%Y')}\n\n"
-        )
+        parts = [
+            f"👤 <b>{profile.full_name}</b>\n\n",
+            f"📅 Добавлен: {profile.created_at.strftime('%d.%m.%Y')}\n\n",
+        ]
 
-        if subjects:
-            text += f"📚 <b>Дисциплины ({len(subjects)}):</b>\n"
-            for subj in subjects:
-                text += f"  • {subj.name}\n"
-            text += "\n"
+        if profile.subjects:
+            parts.append(f"📚 <b>Дисциплины ({len(profile.subjects)}):</b>\n")
+            parts.extend(f"  • {name}\n" for name in profile.subjects)
+            parts.append("\n")
         else:
-            text += "📚 Не привязан к дисциплинам\n\n"
+            parts.append("📚 Не привязан к дисциплинам\n\n")
 
         if total > 0:
-            text += (
+            parts.append(
                 f"📊 <b>Общая посещаемость:</b>\n"
                 f"Занятий: {total}\n"
                 f"Присутствовал: {present}\n"
                 f"Процент: {percent}%"
             )
         else:
-            text += "📊 Нет данных о посещаемости"
+            parts.append("📊 Нет данных о посещаемости")
+
+        text = "".join(parts)
 
         keyboard = InlineKeyboardMarkup([
             [
@@ -313,8 +317,6 @@ async def pool_student_view(update: Update, context: ContextTypes.DEFAULT_TYPE)
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -324,29 +326,23 @@ async def pool_student_edit_start(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
 
-    student_id = int(query.data.split("_")[-1])
+    student_id = tail_id(query.data)
     context.user_data["editing_student_id"] = student_id
 
-    session = get_session()
-    try:
-        student = crud.get_student_by_id(session, student_id)
+    with db_session() as session:
+        full_name = get_student_name(context, session, student_id)
 
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(
-                "❌ Отмена", callback_data=f"pool_student_view_{student_id}")]
-        ])
+        keyboard = cancel_keyboard(f"pool_student_view_{student_id}")
 
         await query.edit_message_text(
             text=(
                 f"✏️ <b>Редактирование студента</b>\n\n"
-                f"Текущее ФИО: <b>{student.full_name}</b>\n\n"
+                f"Текущее ФИО: <b>{full_name}</b>\n\n"
                 f"Введите новое ФИО:"
             ),
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return StudentStates.WAITING_NEW_NAME
 
@@ -366,13 +362,17 @@ async def pool_student_edit_name(update: Update, context: ContextTypes.DEFAULT_T
         )
         return StudentStates.WAITING_NEW_NAME
 
-    teacher, session = get_teacher_from_update(update)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
 
-    try:
         student = crud.update_student(session, student_id, full_name)
 
         if student:
             logger.info("Студент переименован: %s", student.full_name)
+            remember_name(context, STUDENT_NAMES, student_id, student.full_name)
+            forget_subject_students(context)
+
+            _invalidate_student_stats(session, teacher.id, student_id)
 
             keyboard = get_students_pool_keyboard(teacher.id, session)
 
@@ -383,8 +383,6 @@ async def pool_student_edit_name(update: Update, context: ContextTypes.DEFAULT_T
             )
         else:
             await update.message.reply_text("❌ Студент не найден.")
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -394,20 +392,19 @@ async def pool_student_delete_confirm(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     await query.answer()
 
-    student_id = int(query.data.split("_")[-1])
+    student_id = tail_id(query.data)
 
-    session = get_session()
-    try:
+    with db_session() as session:
         student = crud.get_student_by_id(session, student_id)
         subjects = crud.get_subjects_by_student(session, student_id)
-        attendances = crud.get_student_all_attendance(session, student_id)
+        total, _ = crud.get_student_attendance_summary(session, student_id)
 
         warnings = []
         if subjects:
             warnings.append(f"• Привязан к {len(subjects)} дисциплин(ам)")
-        if attendances:
+        if total:
             warnings.append(
-                f"• Будут удалены {len(attendances)} записей посещаемости")
+                f"• Будут удалены {total} записей посещаемости")
 
         warning_text = ""
         if warnings:
@@ -431,8 +428,6 @@ async def pool_student_delete_confirm(update: Update, context: ContextTypes.DEFA
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -442,16 +437,20 @@ async def pool_student_delete_yes(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query
     await query.answer()
 
-    student_id = int(query.data.split("_")[-1])
+    student_id = tail_id(query.data)
 
-    teacher, session = get_teacher_from_update(update)
+    with db_session() as session:
+        teacher = get_teacher(update, session)
 
-    try:
-        student = crud.get_student_by_id(session, student_id)
-        name = student.full_name if student else "Неизвестный"
+        name = get_student_name(context, session, student_id) or "Неизвестный"
+
+        # Сбрасываем кэш до удаления, пока известны дисциплины студента
+        _invalidate_student_stats(session, teacher.id, student_id)
 
         if crud.delete_student(session, student_id):
             logger.info("Удалён студент: %s", name)
+            forget_name(context, STUDENT_NAMES, student_id)
+            forget_subject_students(context)
 
             keyboard = get_students_pool_keyboard(teacher.id, session)
 
@@ -462,8 +461,6 @@ async def pool_student_delete_yes(update: Update, context: ContextTypes.DEFAULT_
             )
         else:
             await query.edit_message_text("❌ Не удалось удалить студента.")
-    finally:
-        session.close()
 
     return ConversationHandler.END
 
@@ -475,43 +472,43 @@ def get_students_conversation_handler() -> ConversationHandler:
     return ConversationHandler(
         entry_points=[
             CallbackQueryHandler(students_pool_menu,
-                                 pattern="^menu_students$"),
+                                 pattern=_MENU_STUDENTS_RE),
             CallbackQueryHandler(pool_student_add_start,
-                                 pattern="^pool_student_add$"),
+                                 pattern=_POOL_STUDENT_ADD_RE),
             CallbackQueryHandler(pool_student_bulk_start,
-                                 pattern="^pool_student_bulk$"),
+                                 pattern=_POOL_STUDENT_BULK_RE),
             CallbackQueryHandler(
-                pool_student_view, pattern=r"^pool_student_view_\d+$"),
+                pool_student_view, pattern=_POOL_STUDENT_VIEW_RE),
             CallbackQueryHandler(pool_student_edit_start,
-                                 pattern=r"^pool_student_edit_\d+$"),
+                                 pattern=_POOL_STUDENT_EDIT_RE),
             CallbackQueryHandler(pool_student_delete_confirm,
-                                 pattern=r"^pool_student_delete_\d+$"),
+                                 pattern=_POOL_STUDENT_DELETE_RE),
             CallbackQueryHandler(pool_student_delete_yes,
-                                 pattern=r"^pool_student_delete_yes_\d+$"),
+                                 pattern=_POOL_STUDENT_DELETE_YES_RE),
         ],
         states={
             StudentStates.WAITING_NAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                pool_student_add_name),
                 CallbackQueryHandler(students_pool_menu,
-                                     pattern="^menu_students$"),
+                                     pattern=_MENU_STUDENTS_RE),
             ],
             StudentStates.WAITING_BULK_NAMES: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                pool_student_bulk_names),
                 CallbackQueryHandler(students_pool_menu,
-                                     pattern="^menu_students$"),
+                                     pattern=_MENU_STUDENTS_RE),
             ],
             StudentStates.WAITING_NEW_NAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                pool_student_edit_name),
                 CallbackQueryHandler(
-                    pool_student_view, pattern=r"^pool_student_view_\d+$"),
+                    pool_student_view, pattern=_POOL_STUDENT_VIEW_RE),
             ],
         },
         fallbacks=[
             CallbackQueryHandler(students_pool_menu,
-                                 pattern="^menu_students$"),
+                                 pattern=_MENU_STUDENTS_RE),
         ],
         allow_reentry=True,
     )
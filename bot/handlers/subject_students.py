@@ -3,6 +3,9 @@
 """
 
 import logging
+import re
+from cachetools import LRUCache
+from sqlalchemy.orm import Session
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes,
@@ -12,40 +15,74 @@ from telegram.ext import (
     filters,
 )
 
-from bot.database import get_session, crud
+from bot.database import crud, with_session
+from bot.handlers._common import (
+    get_teacher,
+    cancel_keyboard,
+    get_subject_name,
+    callback_router,
+    subject_students_snapshot,
+    forget_subject_students,
+)
 from bot.states import StudentStates
+from bot.utils import stats_cache
+from bot.utils.cb import tail_id, tail_ids
 
 logger = logging.getLogger(__name__)
 
+# Количество студентов пула на одной странице выбора
+POOL_PAGE_SIZE = 20
 
-# === Вспомогательные функции ===
+# Кэш готовых клавиатур студентов дисциплины
+_KEYBOARD_CACHE = LRUCache(maxsize=1024)
 
-def get_teacher_from_update(update: Update):
-    """Получить или создать преподавателя из update."""
-    user = update.effective_user
-    session = get_session()
-    try:
-        teacher = crud.get_or_create_teacher(
-            session,
-            telegram_id=user.id,
-            name=user.full_name
-        )
-        return teacher, session
-    except Exception as e:
-        session.close()
-        raise e
+# Шаблоны callback_data (компилируются один раз при импорте)
+_STUDENTS_MENU_RE = re.compile(r"^students_menu_(\d+)$", re.ASCII)
+_SUBJ_STUDENT_FROM_POOL_RE = re.compile(r"^subj_student_from_pool_(\d+)(?:_(\d+))?$", re.ASCII)
+_SUBJ_STUDENT_ADD_RE = re.compile(r"^subj_student_add_(\d+)_(\d+)$", re.ASCII)
+_SUBJ_STUDENT_CREATE_RE = re.compile(r"^subj_student_create_(\d+)$", re.ASCII)
+_SUBJ_STUDENT_VIEW_RE = re.compile(r"^subj_student_view_(\d+)_(\d+)$", re.ASCII)
+_SUBJ_STUDENT_REMOVE_RE = re.compile(r"^subj_student_remove_(\d+)_(\d+)$", re.ASCII)
+_SUBJ_STUDENT_REMOVE_YES_RE = re.compile(r"^subj_student_remove_yes_(\d+)_(\d+)$", re.ASCII)
 
 
+# === Вспомогательные функции ===
+
 def get_subject_students_keyboard(subject_id: int, session) -> InlineKeyboardMarkup:
     """Создать клавиатуру со списком студентов дисциплины."""
     students = crud.get_students_by_subject(session, subject_id)
+    return build_subject_students_keyboard(subject_id, students)
+
+
+def build_subject_students_keyboard(subject_id: int, students) -> InlineKeyboardMarkup:
+    """
+    Создать клавиатуру по уже загруженному списку студентов дисциплины.
+
+    Готовые клавиатуры кэшируются по составу дисциплины: ключ включает
+    ID и ФИО студентов, поэтому после любых изменений ключ просто другой.
+    """
+    pairs = tuple((s.id, s.full_name) for s in students)
+    return subject_students_keyboard(subject_id, pairs)
+
 
+def subject_students_keyboard(subject_id: int, pairs: tuple) -> InlineKeyboardMarkup:
+    """Клавиатура по парам (ID, ФИО) студентов с кэшированием."""
+    key = (subject_id, pairs)
+    markup = _KEYBOARD_CACHE.get(key)
+    if markup is None:
+        markup = _build_subject_students_keyboard(subject_id, pairs)
+        _KEYBOARD_CACHE[key] = markup
+    return markup
+
+
+def _build_subject_students_keyboard(subject_id: int, students: tuple) -> InlineKeyboardMarkup:
+    """Собрать клавиатуру из пар (ID, ФИО) студентов."""
     keyboard = []
-    for student in students:
+    for student_id, full_name in students:
         keyboard.append([
             InlineKeyboardButton(
-                f"👤 {student.full_name}",
-                callback_data=f"subj_student_view_{subject_id}_{student.id}"
+                f"👤 {full_name}",
+                callback_data=f"subj_student_view_{subject_id}_{student_id}"
             )
         ])
 
@@ -67,183 +104,212 @@ def get_subject_students_keyboard(subject_id: int, session) -> InlineKeyboardMar
 
 # === Основные обработчики ===
 
-async def subject_students_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_students_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                session: Session) -> int:
     """Показать студентов дисциплины."""
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["current_subject_id"] = subject_id
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
-        if not subject:
-            await query.edit_message_text("❌ Дисциплина не найдена.")
-            return ConversationHandler.END
+    subject_name = get_subject_name(context, session, subject_id)
+    if subject_name is None:
+        await query.edit_message_text("❌ Дисциплина не найдена.")
+        return ConversationHandler.END
 
-        students = crud.get_students_by_subject(session, subject_id)
+    # Состав дисциплины берём из снимка, пока он не сброшен изменениями
+    snapshots = subject_students_snapshot(context)
+    students = snapshots.get(subject_id)
+    if students is None:
+        students = tuple(
+            (s.id, s.full_name)
+            for s in crud.get_students_by_subject(session, subject_id)
+        )
+        snapshots[subject_id] = students
 
-        if students:
-            text = (
-                f"👥 <b>Студенты: {subject.name}</b>\n\n"
-                f"Всего: {len(students)} чел.\n\n"
-                "Выберите студента или добавьте:"
-            )
-        else:
-            text = (
-                f"👥 <b>Студенты: {subject.name}</b>\n\n"
-                "Список пуст.\n\n"
-                "• <b>Добавить из пула</b> — выбрать из имеющихся студентов\n"
-                "• <b>Создать нового</b> — создать и привязать к дисциплине"
-            )
+    if students:
+        text = (
+            f"👥 <b>Студенты: {subject_name}</b>\n\n"
+            f"Всего: {len(students)} чел.\n\n"
+            "Выберите студента или добавьте:"
+        )
+    else:
+        text = (
+            f"👥 <b>Студенты: {subject_name}</b>\n\n"
+            "Список пуст.\n\n"
+            "• <b>Добавить из пула</b> — выбрать из имеющихся студентов\n"
+            "• <b>Создать нового</b> — создать и привязать к дисциплине"
+        )
 
-        keyboard = get_subject_students_keyboard(subject_id, session)
+    keyboard = subject_students_keyboard(subject_id, students)
 
-        await query.edit_message_text(
-            text=text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await query.edit_message_text(
+        text=text,
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_student_from_pool(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_from_pool(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                    session: Session) -> int:
     """Показать список студентов из пула для добавления в дисциплину."""
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    # subj_student_from_pool_{subject_id}[_{page}]
+    match = _SUBJ_STUDENT_FROM_POOL_RE.match(query.data)
+    subject_id = int(match[1])
+    page = int(match[2] or 0)
     context.user_data["adding_to_subject_id"] = subject_id
 
-    teacher, session = get_teacher_from_update(update)
-
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
-        available_students = crud.get_students_not_in_subject(
-            session, teacher.id, subject_id)
-
-        if not available_students:
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(
-                    "🆕 Создать нового", callback_data=f"subj_student_create_{subject_id}")],
-                [InlineKeyboardButton(
-                    "◀️ Назад", callback_data=f"students_menu_{subject_id}")],
-            ])
-
-            await query.edit_message_text(
-                text=(
-                    f"📋 <b>Добавить студента: {subject.name}</b>\n\n"
-                    "В пуле нет доступных студентов.\n"
-                    "Все студенты уже добавлены в эту дисциплину,\n"
-                    "или пул пуст.\n\n"
-                    "Создайте нового студента."
-                ),
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            return ConversationHandler.END
-
-        # Показываем список доступных студентов
-        keyboard = []
-        for student in available_students:
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"➕ {student.full_name}",
-                    callback_data=f"subj_student_add_{subject_id}_{student.id}"
-                )
-            ])
+    teacher = get_teacher(update, session)
 
-        keyboard.append([
-            InlineKeyboardButton(
-                "◀️ Назад", callback_data=f"students_menu_{subject_id}"),
+    subject_name = get_subject_name(context, session, subject_id)
+    available_count = crud.count_students_not_in_subject(
+        session, teacher.id, subject_id)
+
+    if not available_count:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(
+                "🆕 Создать нового", callback_data=f"subj_student_create_{subject_id}")],
+            [InlineKeyboardButton(
+                "◀️ Назад", callback_data=f"students_menu_{subject_id}")],
         ])
 
         await query.edit_message_text(
             text=(
-                f"📋 <b>Добавить студента: {subject.name}</b>\n\n"
-                f"Доступно: {len(available_students)} чел.\n\n"
-                "Выберите студента для добавления:"
+                f"📋 <b>Добавить студента: {subject_name}</b>\n\n"
+                "В пуле нет доступных студентов.\n"
+                "Все студенты уже добавлены в эту дисциплину,\n"
+                "или пул пуст.\n\n"
+                "Создайте нового студента."
             ),
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=keyboard,
             parse_mode="HTML"
         )
-    finally:
-        session.close()
+        return ConversationHandler.END
+
+    # Показываем одну страницу доступных студентов
+    pages = (available_count + POOL_PAGE_SIZE - 1) // POOL_PAGE_SIZE
+    page = min(page, pages - 1)
+    available_students = crud.get_students_not_in_subject(
+        session, teacher.id, subject_id,
+        limit=POOL_PAGE_SIZE, offset=page * POOL_PAGE_SIZE)
+
+    keyboard = []
+    for student in available_students:
+        keyboard.append([
+            InlineKeyboardButton(
+                f"➕ {student.full_name}",
+                callback_data=f"subj_student_add_{subject_id}_{student.id}"
+            )
+        ])
+
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton(
+                "◀️", callback_data=f"subj_student_from_pool_{subject_id}_{page - 1}"))
+        nav.append(InlineKeyboardButton(
+            f"{page + 1}/{pages}", callback_data="noop"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton(
+                "▶️ Далее", callback_data=f"subj_student_from_pool_{subject_id}_{page + 1}"))
+        keyboard.append(nav)
+
+    keyboard.append([
+        InlineKeyboardButton(
+            "◀️ Назад", callback_data=f"students_menu_{subject_id}"),
+    ])
+
+    await query.edit_message_text(
+        text=(
+            f"📋 <b>Добавить студента: {subject_name}</b>\n\n"
+            f"Доступно: {available_count} чел.\n\n"
+            "Выберите студента для добавления:"
+        ),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_student_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_add(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                              session: Session) -> int:
     """Добавить студента из пула в дисциплину."""
     query = update.callback_query
-    await query.answer()
+    subject_id, student_id = tail_ids(query.data)
 
-    parts = query.data.split("_")
-    subject_id = int(parts[-2])
-    student_id = int(parts[-1])
+    student, subject = crud.get_student_and_subject(
+        session, student_id, subject_id)
 
-    session = get_session()
-    try:
-        student = crud.get_student_by_id(session, student_id)
-        subject = crud.get_subject_by_id(session, subject_id)
+    if not student or not subject:
+        await query.answer("❌ Данные не найдены.", show_alert=True)
+        return ConversationHandler.END
 
-        crud.add_student_to_subject(session, subject_id, student_id)
-        logger.info(
-            "Студент %s добавлен в дисциплину %s",
-            student.full_name, subject.name
-        )
+    await query.answer("✅ Добавлен")
 
-        keyboard = get_subject_students_keyboard(subject_id, session)
+    crud.add_student_to_subject(session, subject_id, student_id)
+    forget_subject_students(context, subject_id)
+    logger.info(
+        "Студент %s добавлен в дисциплину %s",
+        student.full_name, subject.name
+    )
 
-        await query.edit_message_text(
-            f"✅ Студент <b>{student.full_name}</b> добавлен в дисциплину!",
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    stats_cache.invalidate_subject(subject_id)
+    stats_cache.invalidate_teacher(subject.teacher_id)
+
+    keyboard = get_subject_students_keyboard(subject_id, session)
+
+    # Текст меняется: вместо списка пула показывается состав дисциплины,
+    # поэтому одной клавиатуры (edit_message_reply_markup) недостаточно
+    await query.edit_message_text(
+        f"✅ Студент <b>{student.full_name}</b> добавлен в дисциплину!",
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_student_create_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_create_start(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                       session: Session) -> int:
     """Начать создание нового студента для дисциплины."""
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["creating_for_subject_id"] = subject_id
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
+    subject_name = get_subject_name(context, session, subject_id)
 
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(
-                "❌ Отмена", callback_data=f"students_menu_{subject_id}")]
-        ])
+    keyboard = cancel_keyboard(f"students_menu_{subject_id}")
 
-        await query.edit_message_text(
-            text=(
-                f"🆕 <b>Создание студента</b>\n"
-                f"Дисциплина: {subject.name}\n\n"
-                "Введите ФИО нового студента:\n\n"
-                "<i>Студент будет создан и сразу добавлен в дисциплину.</i>"
-            ),
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await query.edit_message_text(
+        text=(
+            f"🆕 <b>Создание студента</b>\n"
+            f"Дисциплина: {subject_name}\n\n"
+            "Введите ФИО нового студента:\n\n"
+            "<i>Студент будет создан и сразу добавлен в дисциплину.</i>"
+        ),
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return StudentStates.WAITING_NAME
 
 
-async def subject_student_create_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_create_name(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                      session: Session) -> int:
     """Создать студента и добавить в дисциплину."""
     full_name = update.message.text.strip()
     subject_id = context.user_data.get("creating_for_subject_id")
@@ -264,175 +330,176 @@ async def subject_student_create_name(update: Update, context: ContextTypes.DEFA
         )
         return StudentStates.WAITING_NAME
 
-    teacher, session = get_teacher_from_update(update)
+    teacher = get_teacher(update, session)
 
-    try:
-        # Создаём студента в пуле
-        student = crud.create_student(session, teacher.id, full_name)
-        # Добавляем в дисциплину
-        crud.add_student_to_subject(session, subject_id, student.id)
+    # Создаём студента в пуле и добавляем в дисциплину одним коммитом
+    student = crud.create_student(
+        session, teacher.id, full_name, commit=False)
+    crud.add_student_to_subject(
+        session, subject_id, student.id, commit=False)
+    session.commit()
+    forget_subject_students(context, subject_id)
 
-        logger.info(
-            "Создан студент %s и добавлен в дисциплину %s",
-            student.full_name, subject_id
-        )
+    logger.info(
+        "Создан студент %s и добавлен в дисциплину %s",
+        student.full_name, subject_id
+    )
 
-        keyboard = get_subject_students_keyboard(subject_id, session)
+    stats_cache.invalidate_subject(subject_id)
+    stats_cache.invalidate_teacher(teacher.id)
 
-        await update.message.reply_text(
-            f"✅ Студент <b>{full_name}</b> создан и добавлен в дисциплину!",
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    keyboard = get_subject_students_keyboard(subject_id, session)
+
+    await update.message.reply_text(
+        f"✅ Студент <b>{full_name}</b> создан и добавлен в дисциплину!",
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_student_view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_view(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               session: Session) -> int:
     """Показать информацию о студенте в контексте дисциплины."""
     query = update.callback_query
-    await query.answer()
+    subject_id, student_id = tail_ids(query.data)
+
+    student, subject = crud.get_student_and_subject(
+        session, student_id, subject_id)
 
-    parts = query.data.split("_")
-    subject_id = int(parts[-2])
-    student_id = int(parts[-1])
+    if not student or not subject:
+        await query.answer("❌ Данные не найдены.", show_alert=True)
+        return ConversationHandler.END
 
-    session = get_session()
-    try:
-        student = crud.get_student_by_id(session, student_id)
-        subject = crud.get_subject_by_id(session, subject_id)
+    await query.answer()
 
-        if not student or not subject:
-            await query.edit_message_text("❌ Данные не найдены.")
-            return ConversationHandler.END
+    # Статистика посещаемости по этой дисциплине
+    total, present = crud.get_student_attendance_summary(
+        session, student_id, subject_id)
+    percent = round(present / total * 100) if total > 0 else 0
 
-        # Статистика посещаемости по этой дисциплине
-        attendances = crud.get_student_attendance_by_subject(
-            session, student_id, subject_id)
-        total = len(attendances)
-        present = sum(1 for a in attendances if a.is_present)
-        percent = round(present / total * 100) if total > 0 else 0
+    text = (
+        f"👤 <b>{student.full_name}</b>\n"
+        f"📚 Дисциплина: {subject.name}\n\n"
+    )
 
-        text = (
-            f"👤 <b>{student.full_name}</b>\n"
-            f"📚 Дисциплина: {subject.name}\n\n"
+    if total > 0:
+        text += (
+            f"📊 <b>Посещаемость:</b>\n"
+            f"Занятий: {total}\n"
+            f"Присутствовал: {present}\n"
+            f"Процент: {percent}%"
         )
+    else:
+        text += "📊 Нет данных о посещаемости"
 
-        if total > 0:
-            text += (
-                f"📊 <b>Посещаемость:</b>\n"
-                f"Занятий: {total}\n"
-                f"Присутствовал: {present}\n"
-                f"Процент: {percent}%"
-            )
-        else:
-            text += "📊 Нет данных о посещаемости"
-
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton(
-                    "🔓 Убрать из дисциплины",
-                    callback_data=f"subj_student_remove_{subject_id}_{student_id}"
-                ),
-            ],
-            [
-                InlineKeyboardButton(
-                    "◀️ К студентам", callback_data=f"students_menu_{subject_id}"),
-            ],
-        ])
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(
+                "🔓 Убрать из дисциплины",
+                callback_data=f"subj_student_remove_{subject_id}_{student_id}"
+            ),
+        ],
+        [
+            InlineKeyboardButton(
+                "◀️ К студентам", callback_data=f"students_menu_{subject_id}"),
+        ],
+    ])
 
-        await query.edit_message_text(
-            text=text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await query.edit_message_text(
+        text=text,
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_student_remove_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_remove_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                         session: Session) -> int:
     """Подтверждение удаления студента из дисциплины."""
     query = update.callback_query
-    await query.answer()
+    subject_id, student_id = tail_ids(query.data)
 
-    parts = query.data.split("_")
-    subject_id = int(parts[-2])
-    student_id = int(parts[-1])
+    student, subject = crud.get_student_and_subject(
+        session, student_id, subject_id)
+
+    if not student or not subject:
+        await query.answer("❌ Данные не найдены.", show_alert=True)
+        return ConversationHandler.END
 
-    session = get_session()
-    try:
-        student = crud.get_student_by_id(session, student_id)
-        subject = crud.get_subject_by_id(session, subject_id)
-        attendances = crud.get_student_attendance_by_subject(
-            session, student_id, subject_id)
+    await query.answer()
 
-        warning = ""
-        if attendances:
-            warning = f"\n\n⚠️ Будут удалены {len(attendances)} записей посещаемости!"
+    total, _ = crud.get_student_attendance_summary(
+        session, student_id, subject_id)
 
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton(
-                    "✅ Да, убрать",
-                    callback_data=f"subj_student_remove_yes_{subject_id}_{student_id}"
-                ),
-                InlineKeyboardButton(
-                    "❌ Отмена",
-                    callback_data=f"subj_student_view_{subject_id}_{student_id}"
-                ),
-            ],
-        ])
+    warning = ""
+    if total:
+        warning = f"\n\n⚠️ Будут удалены {total} записей посещаемости!"
 
-        await query.edit_message_text(
-            text=(
-                f"🔓 <b>Убрать из дисциплины</b>\n\n"
-                f"Убрать студента <b>{student.full_name}</b>\n"
-                f"из дисциплины <b>{subject.name}</b>?\n\n"
-                f"<i>Студент останется в общем пуле.</i>"
-                f"{warning}"
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(
+                "✅ Да, убрать",
+                callback_data=f"subj_student_remove_yes_{subject_id}_{student_id}"
             ),
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+            InlineKeyboardButton(
+                "❌ Отмена",
+                callback_data=f"subj_student_view_{subject_id}_{student_id}"
+            ),
+        ],
+    ])
+
+    await query.edit_message_text(
+        text=(
+            f"🔓 <b>Убрать из дисциплины</b>\n\n"
+            f"Убрать студента <b>{student.full_name}</b>\n"
+            f"из дисциплины <b>{subject.name}</b>?\n\n"
+            f"<i>Студент останется в общем пуле.</i>"
+            f"{warning}"
+        ),
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_student_remove_yes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_student_remove_yes(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     session: Session) -> int:
     """Убрать студента из дисциплины."""
     query = update.callback_query
     await query.answer()
 
-    parts = query.data.split("_")
-    subject_id = int(parts[-2])
-    student_id = int(parts[-1])
+    subject_id, student_id = tail_ids(query.data)
 
-    session = get_session()
-    try:
-        student = crud.get_student_by_id(session, student_id)
-        name = student.full_name if student else "Студент"
+    student = crud.get_student_by_id(session, student_id)
+    name = student.full_name if student else "Студент"
 
-        if crud.remove_student_from_subject(session, subject_id, student_id):
-            logger.info("Студент %s убран из дисциплины %s", name, subject_id)
+    if crud.remove_student_from_subject(session, subject_id, student_id):
+        forget_subject_students(context, subject_id)
+        logger.info("Студент %s убран из дисциплины %s", name, subject_id)
 
-            keyboard = get_subject_students_keyboard(subject_id, session)
+        stats_cache.invalidate_subject(subject_id)
+        if student:
+            stats_cache.invalidate_teacher(student.teacher_id)
 
-            await query.edit_message_text(
-                f"✅ Студент <b>{name}</b> убран из дисциплины.\n"
-                f"<i>Он остался в общем пуле.</i>",
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        else:
-            await query.edit_message_text("❌ Не удалось убрать студента.")
-    finally:
-        session.close()
+        keyboard = get_subject_students_keyboard(subject_id, session)
+
+        # Текст меняется: вместо подтверждения удаления показывается
+        # состав дисциплины, поэтому одной клавиатуры недостаточно
+        await query.edit_message_text(
+            f"✅ Студент <b>{name}</b> убран из дисциплины.\n"
+            f"<i>Он остался в общем пуле.</i>",
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+    else:
+        await query.edit_message_text("❌ Не удалось убрать студента.")
 
     return ConversationHandler.END
 
@@ -443,32 +510,31 @@ def get_subject_students_conversation_handler() -> ConversationHandler:
     """Создать ConversationHandler для управления студентами дисциплины."""
     return ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(subject_students_menu,
-                                 pattern=r"^students_menu_\d+$"),
-            CallbackQueryHandler(subject_student_from_pool,
-                                 pattern=r"^subj_student_from_pool_\d+$"),
-            CallbackQueryHandler(subject_student_add,
-                                 pattern=r"^subj_student_add_\d+_\d+$"),
-            CallbackQueryHandler(subject_student_create_start,
-                                 pattern=r"^subj_student_create_\d+$"),
-            CallbackQueryHandler(subject_student_view,
-                                 pattern=r"^subj_student_view_\d+_\d+$"),
-            CallbackQueryHandler(subject_student_remove_confirm,
-                                 pattern=r"^subj_student_remove_\d+_\d+$"),
-            CallbackQueryHandler(subject_student_remove_yes,
-                                 pattern=r"^subj_student_remove_yes_\d+_\d+$"),
+            callback_router({
+                "students_menu": (_STUDENTS_MENU_RE, subject_students_menu),
+                "subj_student_from_pool": (_SUBJ_STUDENT_FROM_POOL_RE,
+                                           subject_student_from_pool),
+                "subj_student_add": (_SUBJ_STUDENT_ADD_RE, subject_student_add),
+                "subj_student_create": (_SUBJ_STUDENT_CREATE_RE,
+                                        subject_student_create_start),
+                "subj_student_view": (_SUBJ_STUDENT_VIEW_RE, subject_student_view),
+                "subj_student_remove": (_SUBJ_STUDENT_REMOVE_RE,
+                                        subject_student_remove_confirm),
+                "subj_student_remove_yes": (_SUBJ_STUDENT_REMOVE_YES_RE,
+                                            subject_student_remove_yes),
+            }),
         ],
         states={
             StudentStates.WAITING_NAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                subject_student_create_name),
                 CallbackQueryHandler(subject_students_menu,
-                                     pattern=r"^students_menu_\d+$"),
+                                     pattern=_STUDENTS_MENU_RE),
             ],
         },
         fallbacks=[
             CallbackQueryHandler(subject_students_menu,
-                                 pattern=r"^students_menu_\d+$"),
+                                 pattern=_STUDENTS_MENU_RE),
         ],
         allow_reentry=True,
     )
@@ -3,6 +3,9 @@
 """
 
 import logging
+import re
+from cachetools import LRUCache
+from sqlalchemy.orm import Session
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ContextTypes,
@@ -13,93 +16,130 @@ from telegram.ext import (
     filters,
 )
 
-from bot.database import get_session, crud
+from bot.database import crud, with_session
+from bot.handlers._common import (
+    get_teacher,
+    cached_teacher_id,
+    callback_router,
+    forget_subject_students,
+    cancel_keyboard,
+    get_subject_name,
+    remember_name,
+    forget_name,
+    SUBJECT_NAMES,
+)
 from bot.states import SubjectStates
+from bot.utils import stats_cache
+from bot.utils.cb import tail_id
 
 logger = logging.getLogger(__name__)
 
+# Кэш готовых клавиатур со списком дисциплин
+_KEYBOARD_CACHE = LRUCache(maxsize=1024)
 
-# === Вспомогательные функции ===
+# Последнее показанное меню дисциплин: teacher_id -> (текст, клавиатура).
+# Сбрасывается при создании, переименовании и удалении дисциплины.
+_MENU_CACHE = LRUCache(maxsize=1024)
 
-def get_teacher_from_update(update: Update):
-    """Получить или создать преподавателя из update."""
-    user = update.effective_user
-    session = get_session()
-    try:
-        teacher = crud.get_or_create_teacher(
-            session,
-            telegram_id=user.id,
-            name=user.full_name
-        )
-        return teacher, session
-    except Exception as e:
-        session.close()
-        raise e
+# Шаблоны callback_data (компилируются один раз при импорте)
+_MENU_SUBJECTS_RE = re.compile(r"^menu_subjects$", re.ASCII)
+_SUBJECTS_MENU_RE = re.compile(r"^subjects_menu$", re.ASCII)
+_SUBJECT_ADD_RE = re.compile(r"^subject_add$", re.ASCII)
+_SUBJECT_VIEW_RE = re.compile(r"^subject_view_(\d+)$", re.ASCII)
+_SUBJECT_EDIT_RE = re.compile(r"^subject_edit_(\d+)$", re.ASCII)
+_SUBJECT_DELETE_RE = re.compile(r"^subject_delete_(\d+)$", re.ASCII)
+_SUBJECT_DELETE_YES_RE = re.compile(r"^subject_delete_yes_(\d+)$", re.ASCII)
+_BACK_TO_MENU_RE = re.compile(r"^back_to_menu$", re.ASCII)
 
+# Статичные кнопки и клавиатуры (создаются один раз при импорте)
+ADD_SUBJECT_BTN = InlineKeyboardButton(
+    "➕ Добавить дисциплину", callback_data="subject_add")
+BACK_TO_MENU_BTN = InlineKeyboardButton(
+    "◀️ Назад в меню", callback_data="back_to_menu")
+_SUBJECTS_TAIL_ROWS = ((ADD_SUBJECT_BTN,), (BACK_TO_MENU_BTN,))
+CANCEL_SUBJECTS_MENU_KEYBOARD = cancel_keyboard("subjects_menu")
 
-def get_subjects_keyboard(teacher_id: int, session) -> InlineKeyboardMarkup:
-    """Создать клавиатуру со списком дисциплин."""
-    subjects = crud.get_subjects_by_teacher(session, teacher_id)
 
-    keyboard = []
-    for subject in subjects:
-        keyboard.append([
-            InlineKeyboardButton(
-                f"📚 {subject.name}",
-                callback_data=f"subject_view_{subject.id}"
-            )
-        ])
-
-    keyboard.append([
-        InlineKeyboardButton("➕ Добавить дисциплину",
-                             callback_data="subject_add")
-    ])
-    keyboard.append([
-        InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")
-    ])
+# === Вспомогательные функции ===
+
+def get_subjects_keyboard(teacher_id: int, session, subjects=None) -> InlineKeyboardMarkup:
+    """
+    Создать клавиатуру со списком дисциплин.
+
+    Готовые клавиатуры кэшируются по списку (ID, название) дисциплин.
+    Уже загруженный список можно передать в subjects.
+    """
+    if subjects is None:
+        subjects = crud.get_subjects_by_teacher(session, teacher_id)
+
+    key = tuple((subject.id, subject.name) for subject in subjects)
+    markup = _KEYBOARD_CACHE.get(key)
+    if markup is None:
+        markup = _build_subjects_keyboard(key)
+        _KEYBOARD_CACHE[key] = markup
+    return markup
+
+
+def _build_subjects_keyboard(subjects: tuple) -> InlineKeyboardMarkup:
+    """Собрать клавиатуру из пар (ID, название) дисциплин."""
+    keyboard = [
+        (InlineKeyboardButton(
+            f"📚 {name}",
+            callback_data=f"subject_view_{subject_id}"
+        ),)
+        for subject_id, name in subjects
+    ]
+    keyboard.extend(_SUBJECTS_TAIL_ROWS)
 
     return InlineKeyboardMarkup(keyboard)
 
 
+async def _show_subjects_menu(update: Update, text: str,
+                              keyboard: InlineKeyboardMarkup) -> None:
+    """Показать меню дисциплин: отредактировать сообщение или ответить."""
+    query = update.callback_query
+    if query:
+        await query.edit_message_text(
+            text=text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+    else:
+        await update.message.reply_text(
+            text=text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+
+
 # === Основные обработчики ===
 
-async def subjects_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subjects_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                        session: Session) -> int:
     """Показать меню дисциплин."""
     query = update.callback_query
     if query:
         await query.answer()
 
-    teacher, session = get_teacher_from_update(update)
+    teacher = get_teacher(update, session)
 
-    try:
-        subjects = crud.get_subjects_by_teacher(session, teacher.id)
+    subjects = crud.get_subjects_by_teacher(session, teacher.id)
 
-        if subjects:
-            text = f"📚 <b>Ваши дисциплины</b> ({len(subjects)}):\n\n"
-            text += "Выберите дисциплину для управления:"
-        else:
-            text = (
-                "📚 <b>Дисциплины</b>\n\n"
-                "У вас пока нет дисциплин.\n"
-                "Нажмите кнопку ниже, чтобы добавить первую!"
-            )
+    if subjects:
+        text = f"📚 <b>Ваши дисциплины</b> ({len(subjects)}):\n\n"
+        text += "Выберите дисциплину для управления:"
+    else:
+        text = (
+            "📚 <b>Дисциплины</b>\n\n"
+            "У вас пока нет дисциплин.\n"
+            "Нажмите кнопку ниже, чтобы добавить первую!"
+        )
 
-        keyboard = get_subjects_keyboard(teacher.id, session)
+    keyboard = get_subjects_keyboard(teacher.id, session, subjects)
+    _MENU_CACHE[teacher.id] = (text, keyboard)
 
-        if query:
-            await query.edit_message_text(
-                text=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        else:
-            await update.message.reply_text(
-                text=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-    finally:
-        session.close()
+    await _show_subjects_menu(update, text, keyboard)
 
     return ConversationHandler.END
 
@@ -109,9 +149,7 @@ async def subject_add_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
 
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("❌ Отмена", callback_data="subjects_menu")]
-    ])
+    keyboard = CANCEL_SUBJECTS_MENU_KEYBOARD
 
     await query.edit_message_text(
         text=(
@@ -125,7 +163,9 @@ async def subject_add_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return SubjectStates.WAITING_NAME
 
 
-async def subject_add_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_add_name(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                           session: Session) -> int:
     """Сохранить название дисциплины."""
     name = update.message.text.strip()
 
@@ -141,113 +181,107 @@ async def subject_add_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return SubjectStates.WAITING_NAME
 
-    teacher, session = get_teacher_from_update(update)
+    teacher = get_teacher(update, session)
 
-    try:
-        subject = crud.create_subject(session, teacher.id, name)
-        logger.info(
-            "Создана дисциплина: %s (teacher_id=%s)", subject.name, teacher.id)
+    subject = crud.create_subject(session, teacher.id, name)
+    _MENU_CACHE.pop(teacher.id, None)
+    logger.info(
+        "Создана дисциплина: %s (teacher_id=%s)", subject.name, teacher.id)
 
-        keyboard = get_subjects_keyboard(teacher.id, session)
+    stats_cache.invalidate_teacher(teacher.id)
 
-        await update.message.reply_text(
-            f"✅ Дисциплина <b>«{name}»</b> успешно добавлена!",
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    keyboard = get_subjects_keyboard(teacher.id, session)
+
+    await update.message.reply_text(
+        f"✅ Дисциплина <b>«{name}»</b> успешно добавлена!",
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_view(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                       session: Session) -> int:
     """Показать информацию о дисциплине."""
     query = update.callback_query
     await query.answer()
 
     # Извлекаем ID дисциплины из callback_data
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["current_subject_id"] = subject_id
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
+    subject = crud.get_subject_by_id(session, subject_id)
 
-        if not subject:
-            await query.edit_message_text("❌ Дисциплина не найдена.")
-            return ConversationHandler.END
+    if not subject:
+        await query.edit_message_text("❌ Дисциплина не найдена.")
+        return ConversationHandler.END
 
-        students = crud.get_students_by_subject(session, subject_id)
-        students_count = len(students)
+    students_count = crud.count_students_in_subject(session, subject_id)
 
-        text = (
-            f"📚 <b>{subject.name}</b>\n\n"
-            f"👥 Студентов: {students_count}\n"
-            f"📅 Создана: {subject.created_at.strftime('%d.%m.%Y')}\n"
-        )
+    text = (
+        f"📚 <b>{subject.name}</b>\n\n"
+        f"👥 Студентов: {students_count}\n"
+        f"📅 Создана: {subject.created_at.strftime('%d.%m.%Y')}\n"
+    )
 
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton(
-                    "👥 Студенты", callback_data=f"students_menu_{subject_id}"),
-                InlineKeyboardButton(
-                    "✏️ Переименовать", callback_data=f"subject_edit_{subject_id}"),
-            ],
-            [
-                InlineKeyboardButton(
-                    "🗑 Удалить", callback_data=f"subject_delete_{subject_id}"),
-            ],
-            [
-                InlineKeyboardButton("◀️ К дисциплинам",
-                                     callback_data="subjects_menu"),
-            ],
-        ])
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(
+                "👥 Студенты", callback_data=f"students_menu_{subject_id}"),
+            InlineKeyboardButton(
+                "✏️ Переименовать", callback_data=f"subject_edit_{subject_id}"),
+        ],
+        [
+            InlineKeyboardButton(
+                "🗑 Удалить", callback_data=f"subject_delete_{subject_id}"),
+        ],
+        [
+            InlineKeyboardButton("◀️ К дисциплинам",
+                                 callback_data="subjects_menu"),
+        ],
+    ])
 
-        await query.edit_message_text(
-            text=text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await query.edit_message_text(
+        text=text,
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_edit_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_edit_start(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             session: Session) -> int:
     """Начать редактирование дисциплины."""
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["editing_subject_id"] = subject_id
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
+    subject_name = get_subject_name(context, session, subject_id)
 
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(
-                "❌ Отмена", callback_data=f"subject_view_{subject_id}")]
-        ])
+    keyboard = cancel_keyboard(f"subject_view_{subject_id}")
 
-        await query.edit_message_text(
-            text=(
-                f"✏️ <b>Редактирование дисциплины</b>\n\n"
-                f"Текущее название: <b>{subject.name}</b>\n\n"
-                f"Введите новое название:"
-            ),
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await query.edit_message_text(
+        text=(
+            f"✏️ <b>Редактирование дисциплины</b>\n\n"
+            f"Текущее название: <b>{subject_name}</b>\n\n"
+            f"Введите новое название:"
+        ),
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return SubjectStates.WAITING_NEW_NAME
 
 
-async def subject_edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            session: Session) -> int:
     """Сохранить новое название дисциплины."""
     name = update.message.text.strip()
     subject_id = context.user_data.get("editing_subject_id")
@@ -262,97 +296,99 @@ async def subject_edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return SubjectStates.WAITING_NEW_NAME
 
-    session = get_session()
-    try:
-        subject = crud.update_subject(session, subject_id, name)
+    subject = crud.update_subject(session, subject_id, name)
 
-        if subject:
-            logger.info("Дисциплина переименована: %s", subject.name)
+    if subject:
+        logger.info("Дисциплина переименована: %s", subject.name)
+        remember_name(context, SUBJECT_NAMES, subject_id, subject.name)
+        _MENU_CACHE.pop(subject.teacher_id, None)
 
-            teacher, _ = get_teacher_from_update(update)
-            keyboard = get_subjects_keyboard(teacher.id, session)
+        stats_cache.invalidate_subject(subject_id)
+        stats_cache.invalidate_teacher(subject.teacher_id)
 
-            await update.message.reply_text(
-                f"✅ Дисциплина переименована в <b>«{name}»</b>",
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        else:
-            await update.message.reply_text("❌ Дисциплина не найдена.")
-    finally:
-        session.close()
+        keyboard = get_subjects_keyboard(subject.teacher_id, session)
+
+        await update.message.reply_text(
+            f"✅ Дисциплина переименована в <b>«{name}»</b>",
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+    else:
+        await update.message.reply_text("❌ Дисциплина не найдена.")
 
     return ConversationHandler.END
 
 
-async def subject_delete_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_delete_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 session: Session) -> int:
     """Запросить подтверждение удаления дисциплины."""
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
     context.user_data["deleting_subject_id"] = subject_id
 
-    session = get_session()
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
-        students = crud.get_students_by_subject(session, subject_id)
-
-        warning = ""
-        if students:
-            warning = f"\n\n⚠️ <b>Внимание!</b> Будут удалены {len(students)} студент(ов) и все записи посещаемости!"
-
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton(
-                    "✅ Да, удалить", callback_data=f"subject_delete_yes_{subject_id}"),
-                InlineKeyboardButton(
-                    "❌ Отмена", callback_data=f"subject_view_{subject_id}"),
-            ],
-        ])
+    subject = crud.get_subject_by_id(session, subject_id)
+    students_count = crud.count_students_in_subject(session, subject_id)
 
-        await query.edit_message_text(
-            text=(
-                f"🗑 <b>Удаление дисциплины</b>\n\n"
-                f"Вы уверены, что хотите удалить дисциплину <b>«{subject.name}»</b>?"
-                f"{warning}"
-            ),
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    warning = ""
+    if students_count:
+        warning = f"\n\n⚠️ <b>Внимание!</b> Будут удалены {students_count} студент(ов) и все записи посещаемости!"
+
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(
+                "✅ Да, удалить", callback_data=f"subject_delete_yes_{subject_id}"),
+            InlineKeyboardButton(
+                "❌ Отмена", callback_data=f"subject_view_{subject_id}"),
+        ],
+    ])
+
+    await query.edit_message_text(
+        text=(
+            f"🗑 <b>Удаление дисциплины</b>\n\n"
+            f"Вы уверены, что хотите удалить дисциплину <b>«{subject.name}»</b>?"
+            f"{warning}"
+        ),
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
 
     return ConversationHandler.END
 
 
-async def subject_delete_yes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+@with_session
+async def subject_delete_yes(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             session: Session) -> int:
     """Подтвердить удаление дисциплины."""
     query = update.callback_query
     await query.answer()
 
-    subject_id = int(query.data.split("_")[-1])
+    subject_id = tail_id(query.data)
+
+    teacher = get_teacher(update, session)
 
-    teacher, session = get_teacher_from_update(update)
+    name = get_subject_name(context, session, subject_id) or "Неизвестная"
 
-    try:
-        subject = crud.get_subject_by_id(session, subject_id)
-        name = subject.name if subject else "Неизвестная"
+    if crud.delete_subject(session, subject_id):
+        logger.info("Удалена дисциплина: %s", name)
+        forget_name(context, SUBJECT_NAMES, subject_id)
+        forget_subject_students(context, subject_id)
+        _MENU_CACHE.pop(teacher.id, None)
 
-        if crud.delete_subject(session, subject_id):
-            logger.info("Удалена дисциплина: %s", name)
+        stats_cache.invalidate_subject(subject_id)
+        stats_cache.invalidate_teacher(teacher.id)
 
-            keyboard = get_subjects_keyboard(teacher.id, session)
+        keyboard = get_subjects_keyboard(teacher.id, session)
 
-            await query.edit_message_text(
-                f"✅ Дисциплина <b>«{name}»</b> удалена.",
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-        else:
-            await query.edit_message_text("❌ Не удалось удалить дисциплину.")
-    finally:
-        session.close()
+        await query.edit_message_text(
+            f"✅ Дисциплина <b>«{name}»</b> удалена.",
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+    else:
+        await query.edit_message_text("❌ Не удалось удалить дисциплину.")
 
     return ConversationHandler.END
 
@@ -363,8 +399,16 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.pop("editing_subject_id", None)
     context.user_data.pop("deleting_subject_id", None)
 
-    # Возвращаемся к меню дисциплин
-    return await subjects_menu(update, context)
+    # Возвращаемся к меню дисциплин: без запросов к БД, если оно уже строилось
+    teacher_id = cached_teacher_id(update)
+    cached = _MENU_CACHE.get(teacher_id) if teacher_id is not None else None
+    if cached is None:
+        return await subjects_menu(update, context)
+
+    if update.callback_query:
+        await update.callback_query.answer()
+    await _show_subjects_menu(update, *cached)
+    return ConversationHandler.END
 
 
 # === ConversationHandler для дисциплин ===
@@ -373,34 +417,33 @@ def get_subjects_conversation_handler() -> ConversationHandler:
     """Создать ConversationHandler для управления дисциплинами."""
     return ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(subjects_menu, pattern="^menu_subjects$"),
-            CallbackQueryHandler(subjects_menu, pattern="^subjects_menu$"),
-            CallbackQueryHandler(subject_add_start, pattern="^subject_add$"),
-            CallbackQueryHandler(subject_view, pattern=r"^subject_view_\d+$"),
-            CallbackQueryHandler(subject_edit_start,
-                                 pattern=r"^subject_edit_\d+$"),
-            CallbackQueryHandler(subject_delete_confirm,
-                                 pattern=r"^subject_delete_\d+$"),
-            CallbackQueryHandler(subject_delete_yes,
-                                 pattern=r"^subject_delete_yes_\d+$"),
+            callback_router({
+                "menu_subjects": (_MENU_SUBJECTS_RE, subjects_menu),
+                "subjects_menu": (_SUBJECTS_MENU_RE, subjects_menu),
+                "subject_add": (_SUBJECT_ADD_RE, subject_add_start),
+                "subject_view": (_SUBJECT_VIEW_RE, subject_view),
+                "subject_edit": (_SUBJECT_EDIT_RE, subject_edit_start),
+                "subject_delete": (_SUBJECT_DELETE_RE, subject_delete_confirm),
+                "subject_delete_yes": (_SUBJECT_DELETE_YES_RE, subject_delete_yes),
+            }),
         ],
         states={
             SubjectStates.WAITING_NAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                subject_add_name),
-                CallbackQueryHandler(subjects_menu, pattern="^subjects_menu$"),
+                CallbackQueryHandler(subjects_menu, pattern=_SUBJECTS_MENU_RE),
             ],
             SubjectStates.WAITING_NEW_NAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND,
                                subject_edit_name),
                 CallbackQueryHandler(
-                    subject_view, pattern=r"^subject_view_\d+$"),
+                    subject_view, pattern=_SUBJECT_VIEW_RE),
             ],
         },
         fallbacks=[
             CommandHandler("cancel", cancel),
-            CallbackQueryHandler(subjects_menu, pattern="^subjects_menu$"),
-            CallbackQueryHandler(cancel, pattern="^back_to_menu$"),
+            CallbackQueryHandler(subjects_menu, pattern=_SUBJECTS_MENU_RE),
+            CallbackQueryHandler(cancel, pattern=_BACK_TO_MENU_RE),
         ],
         allow_reentry=True,
     )
@@ -12,7 +12,7 @@ from telegram.ext import (
     ContextTypes,
 )
 
-from bot.config import BOT_TOKEN, LOG_LEVEL, LOGS_DIR
+from bot.config import BOT_TOKEN, LOG_LEVEL, LOGS_DIR, WEBHOOK_URL, WEBHOOK_PORT
 from bot.database import init_db
 from bot.handlers.subjects import get_subjects_conversation_handler
 from bot.handlers.students import get_students_conversation_handler
@@ -20,6 +20,7 @@ from bot.handlers.subject_students import get_subject_students_conversation_hand
 from bot.handlers.attendance import get_attendance_conversation_handler
 from bot.handlers.export import get_export_conversation_handler
 from bot.handlers.stats import get_stats_conversation_handler
+from bot.utils.charts import shutdown_chart_pool, warmup_chart_pool
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,28 +34,39 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Типы обновлений, которые обрабатывает бот (остальные Telegram не присылает)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
 # === Главное меню ===
+# Клавиатуры статичны, поэтому создаются один раз при импорте
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton(
+            "📚 Дисциплины", callback_data="menu_subjects"),
+        InlineKeyboardButton("👥 Студенты", callback_data="menu_students"),
+    ],
+    [
+        InlineKeyboardButton("✏️ Отметить посещаемость",
+                             callback_data="menu_attendance"),
+    ],
+    [
+        InlineKeyboardButton("📊 Статистика", callback_data="menu_stats"),
+        InlineKeyboardButton("💾 Экспорт", callback_data="menu_export"),
+    ],
+    [
+        InlineKeyboardButton("ℹ️ Помощь", callback_data="menu_help"),
+    ],
+])
+
+BACK_TO_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")]
+])
+
+
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
-    """Создает клавиатуру главного меню."""
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                "📚 Дисциплины", callback_data="menu_subjects"),
-            InlineKeyboardButton("👥 Студенты", callback_data="menu_students"),
-        ],
-        [
-            InlineKeyboardButton("✏️ Отметить посещаемость",
-                                 callback_data="menu_attendance"),
-        ],
-        [
-            InlineKeyboardButton("📊 Статистика", callback_data="menu_stats"),
-            InlineKeyboardButton("💾 Экспорт", callback_data="menu_export"),
-        ],
-        [
-            InlineKeyboardButton("ℹ️ Помощь", callback_data="menu_help"),
-        ],
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    """Клавиатура главного меню."""
+    return MAIN_MENU_KEYBOARD
 
 
 # === Обработчики команд ===
@@ -127,13 +139,9 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     text = messages.get(callback_data, "Неизвестная команда")
 
     # Добавляем кнопку "Назад" к ответу
-    back_keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")]
-    ])
-
     await query.edit_message_text(
         text=text,
-        reply_markup=back_keyboard,
+        reply_markup=BACK_TO_MENU_KEYBOARD,
         parse_mode="HTML",
     )
 
@@ -149,6 +157,21 @@ async def back_to_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
 
+def _is_back_to_menu(data) -> bool:
+    """Фильтр callback_data кнопки «В меню» (сравнение строк вместо regex)."""
+    return data == "back_to_menu"
+
+
+def _is_menu_item(data) -> bool:
+    """Фильтр callback_data пунктов главного меню (префикс menu_)."""
+    return isinstance(data, str) and data.startswith("menu_")
+
+
+async def post_shutdown(application: Application) -> None:
+    """Освобождение ресурсов при остановке бота."""
+    shutdown_chart_pool()
+
+
 def main() -> None:
     """Запуск бота."""
     logger.info("Запуск бота...")
@@ -158,8 +181,16 @@ def main() -> None:
     init_db()
     logger.info("База данных готова!")
 
+    # Процессы отрисовки графиков запускаются и прогреваются в фоне
+    warmup_chart_pool()
+
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -176,13 +207,26 @@ def main() -> None:
 
     # Регистрируем обработчики кнопок
     application.add_handler(CallbackQueryHandler(
-        back_to_menu_callback, pattern="^back_to_menu$"))
+        back_to_menu_callback, pattern=_is_back_to_menu))
     application.add_handler(CallbackQueryHandler(
-        menu_callback, pattern="^menu_"))
+        menu_callback, pattern=_is_menu_item))
 
     # Запускаем бота
     logger.info("Бот запущен и готов к работе!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            webhook_url=WEBHOOK_URL,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        # Long polling: запрос getUpdates ждёт новых обновлений до 30 секунд
+        application.run_polling(
+            poll_interval=0.0,
+            timeout=30,
+            allowed_updates=ALLOWED_UPDATES,
+        )
 
 
 if __name__ == "__main__":
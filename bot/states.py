@@ -1,27 +1,29 @@
 """
 Состояния для ConversationHandler (FSM).
-"""
 
-from enum import IntEnum, auto
+Состояния — обычные int-константы, сгруппированные по классам:
+ConversationHandler ищет их в словаре states, и для простых int
+хэширование и сравнение обходятся дешевле, чем для IntEnum.
+"""
 
 
-class SubjectStates(IntEnum):
+class SubjectStates:
     """Состояния для управления дисциплинами."""
-    WAITING_NAME = auto()           # Ожидание названия новой дисциплины
-    WAITING_NEW_NAME = auto()       # Ожидание нового названия (редактирование)
-    CONFIRM_DELETE = auto()         # Подтверждение удаления
+    WAITING_NAME = 1                # Ожидание названия новой дисциплины
+    WAITING_NEW_NAME = 2            # Ожидание нового названия (редактирование)
+    CONFIRM_DELETE = 3              # Подтверждение удаления
 
 
-class StudentStates(IntEnum):
+class StudentStates:
     """Состояния для управления студентами."""
-    WAITING_NAME = auto()           # Ожидание ФИО студента
-    WAITING_BULK_NAMES = auto()     # Ожидание списка ФИО (массовое добавление)
-    WAITING_NEW_NAME = auto()       # Ожидание нового ФИО (редактирование)
-    CONFIRM_DELETE = auto()         # Подтверждение удаления
+    WAITING_NAME = 1                # Ожидание ФИО студента
+    WAITING_BULK_NAMES = 2          # Ожидание списка ФИО (массовое добавление)
+    WAITING_NEW_NAME = 3            # Ожидание нового ФИО (редактирование)
+    CONFIRM_DELETE = 4              # Подтверждение удаления
 
 
-class AttendanceStates(IntEnum):
+class AttendanceStates:
     """Состояния для отметки посещаемости."""
-    SELECT_SUBJECT = auto()         # Выбор дисциплины
-    SELECT_DATE = auto()            # Выбор даты
-    MARKING = auto()                # Отметка студентов
+    SELECT_SUBJECT = 1              # Выбор дисциплины
+    SELECT_DATE = 2                 # Выбор даты
+    MARKING = 3                     # Отметка студентов
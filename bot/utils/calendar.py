@@ -3,7 +3,10 @@
 """
 
 import calendar
+import re
 from datetime import date, timedelta
+from functools import lru_cache
+from typing import Iterable
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 # Названия месяцев на русском
@@ -15,13 +18,38 @@ MONTHS_RU = [
 # Дни недели на русском (сокращённые)
 DAYS_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
+# Неизменные строки и кнопки календаря (создаются один раз при импорте)
+_DAYS_HEADER_ROW = tuple(
+    InlineKeyboardButton(day, callback_data="noop") for day in DAYS_RU)
+_EMPTY_CELL = InlineKeyboardButton(" ", callback_data="noop")
+_BACK_ROW = (InlineKeyboardButton("◀️ Назад", callback_data="menu_attendance"),)
+
+# Формат дня: индекс = сегодня * 2 + отмечено
+_DAY_FORMATS = (
+    "{}",       # Обычный день
+    "●{}",      # Отмечено
+    "[{}]",     # Сегодня
+    "●[{}]",    # Сегодня + отмечено
+)
+
+# Шаблоны callback_data календаря (в порядке частоты использования)
+_CAL_DAY_RE = re.compile(r"^([a-z]+)_day_(\d+)_(\d+)_(\d+)_(\d+)$", re.ASCII)
+_CAL_NAV_RE = re.compile(r"^([a-z]+)_nav_(\d+)_(\d+)_(\d+)$", re.ASCII)
+_CAL_QUICK_RE = re.compile(r"^([a-z]+)_(today|yesterday)_(\d+)$", re.ASCII)
+
+
+@lru_cache(maxsize=256)
+def _month_weeks(year: int, month: int) -> tuple[tuple[int, ...], ...]:
+    """Недели месяца (0 — день другого месяца); кэшируется по (год, месяц)."""
+    return tuple(tuple(week) for week in calendar.monthcalendar(year, month))
+
 
 def create_calendar(
     year: int = None,
     month: int = None,
     callback_prefix: str = "cal",
     subject_id: int = None,
-    marked_dates: list[date] = None,
+    marked_dates: Iterable[date] = None,
 ) -> InlineKeyboardMarkup:
     """
     Создать inline-клавиатуру с календарём.
@@ -31,13 +59,16 @@ def create_calendar(
         month: Месяц (по умолчанию текущий)
         callback_prefix: Префикс для callback_data
         subject_id: ID дисциплины (для передачи в callback)
-        marked_dates: Список дат, когда были отметки (будут выделены)
+        marked_dates: Даты, когда были отметки (будут выделены);
+            один раз преобразуются в множество кортежей (год, месяц, день)
 
     Returns:
         InlineKeyboardMarkup с календарём
     """
     today = date.today()
-    marked_dates = marked_dates or []
+    today_ymd = (today.year, today.month, today.day)
+    # Отмеченные даты как кортежи (год, месяц, день): ячейкам не нужен date()
+    marked_set = frozenset((d.year, d.month, d.day) for d in marked_dates or ())
 
     if year is None:
         year = today.year
@@ -46,6 +77,10 @@ def create_calendar(
 
     keyboard = []
 
+    # Общие части callback_data формируются один раз на весь месяц
+    nav_prefix = f"{callback_prefix}_nav_{subject_id}_"
+    day_prefix = f"{callback_prefix}_day_{subject_id}_{year}_{month}_"
+
     # Заголовок: ◀️ Месяц Год ▶️
     nav_row = []
 
@@ -57,7 +92,7 @@ def create_calendar(
         prev_year -= 1
     nav_row.append(InlineKeyboardButton(
         "◀️",
-        callback_data=f"{callback_prefix}_nav_{subject_id}_{prev_year}_{prev_month}"
+        callback_data=f"{nav_prefix}{prev_year}_{prev_month}"
     ))
 
     # Название месяца и год
@@ -74,52 +109,43 @@ def create_calendar(
         next_year += 1
     nav_row.append(InlineKeyboardButton(
         "▶️",
-        callback_data=f"{callback_prefix}_nav_{subject_id}_{next_year}_{next_month}"
+        callback_data=f"{nav_prefix}{next_year}_{next_month}"
     ))
 
     keyboard.append(nav_row)
 
     # Дни недели
-    days_row = [InlineKeyboardButton(
-        day, callback_data="noop") for day in DAYS_RU]
-    keyboard.append(days_row)
+    keyboard.append(_DAYS_HEADER_ROW)
 
     # Получаем календарь месяца
-    cal = calendar.monthcalendar(year, month)
+    cal = _month_weeks(year, month)
 
     for week in cal:
         week_row = []
         for day in week:
             if day == 0:
                 # Пустая ячейка
-                week_row.append(InlineKeyboardButton(
-                    " ", callback_data="noop"))
+                week_row.append(_EMPTY_CELL)
             else:
-                current_date = date(year, month, day)
+                # Кортежи (год, месяц, день) сравниваются как даты
+                current_ymd = (year, month, day)
 
                 # Проверяем, не в будущем ли дата
-                if current_date > today:
+                if current_ymd > today_ymd:
                     # Будущая дата — некликабельна
                     week_row.append(InlineKeyboardButton(
                         f"·{day}·",
                         callback_data="noop"
                     ))
                 else:
-                    # Форматируем день
-                    is_marked = current_date in marked_dates
-
-                    if current_date == today and is_marked:
-                        day_text = f"●[{day}]"  # Сегодня + отмечено
-                    elif current_date == today:
-                        day_text = f"[{day}]"  # Сегодня
-                    elif is_marked:
-                        day_text = f"●{day}"  # Отмечено
-                    else:
-                        day_text = str(day)
+                    # Форматируем день по таблице форматов
+                    day_format = _DAY_FORMATS[
+                        (current_ymd == today_ymd) * 2 + (current_ymd in marked_set)]
+                    day_text = day_format.format(day)
 
                     week_row.append(InlineKeyboardButton(
                         day_text,
-                        callback_data=f"{callback_prefix}_day_{subject_id}_{year}_{month}_{day}"
+                        callback_data=day_prefix + str(day)
                     ))
 
         keyboard.append(week_row)
@@ -134,9 +160,7 @@ def create_calendar(
     keyboard.append(quick_row)
 
     # Кнопка "Назад"
-    keyboard.append([
-        InlineKeyboardButton("◀️ Назад", callback_data="menu_attendance")
-    ])
+    keyboard.append(_BACK_ROW)
 
     return InlineKeyboardMarkup(keyboard)
 
@@ -148,6 +172,44 @@ def parse_calendar_callback(callback_data: str) -> dict:
     Returns:
         dict с полями: action, subject_id, year, month, day
     """
+    match = _CAL_DAY_RE.match(callback_data)
+    if match:
+        prefix, *numbers = match.groups()
+        subject_id, year, month, day = map(int, numbers)
+        return {
+            "prefix": prefix,
+            "action": "day",
+            "subject_id": subject_id,
+            "year": year,
+            "month": month,
+            "day": day,
+            "date": date(year, month, day),
+        }
+
+    match = _CAL_NAV_RE.match(callback_data)
+    if match:
+        prefix, *numbers = match.groups()
+        subject_id, year, month = map(int, numbers)
+        return {
+            "prefix": prefix,
+            "action": "nav",
+            "subject_id": subject_id,
+            "year": year,
+            "month": month,
+        }
+
+    match = _CAL_QUICK_RE.match(callback_data)
+    if match:
+        prefix, action, subject_id = match.groups()
+        offset = 0 if action == "today" else 1
+        return {
+            "prefix": prefix,
+            "action": action,
+            "subject_id": int(subject_id),
+            "date": date.today() - timedelta(days=offset),
+        }
+
+    # Нестандартные данные (например, без subject_id) — разбор по частям
     parts = callback_data.split("_")
 
     result = {
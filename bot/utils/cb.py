@@ -0,0 +1,14 @@
+"""
+Разбор callback_data.
+"""
+
+
+def tail_id(data: str) -> int:
+    """Получить числовой ID из конца callback_data вида "prefix_..._<id>"."""
+    return int(data[data.rfind("_") + 1:])
+
+
+def tail_ids(data: str) -> tuple[int, int]:
+    """Получить два числовых ID из конца callback_data вида "prefix_..._<a>_<b>"."""
+    _, first, second = data.rsplit("_", 2)
+    return int(first), int(second)
@@ -0,0 +1,49 @@
+"""
+Кэш готовых графиков.
+
+Ключ — хэш данных, по которым строится график. Значение — PNG и
+file_id фотографии в Telegram: если график уже отправлялся, его можно
+переслать по file_id без повторной отрисовки и загрузки.
+"""
+
+from hashlib import blake2b
+from threading import Lock
+from typing import Optional
+
+import orjson
+from cachetools import LRUCache
+
+_cache = LRUCache(maxsize=256)
+_lock = Lock()
+
+
+def make_key(kind: str, payload) -> str:
+    """Построить ключ кэша по типу графика и исходным данным."""
+    raw = orjson.dumps([kind, payload], option=orjson.OPT_SORT_KEYS)
+    return blake2b(raw, digest_size=16).hexdigest()
+
+
+def get(key: str) -> Optional[dict]:
+    """Получить запись {"bytes": bytes, "file_id": str | None} или None."""
+    with _lock:
+        return _cache.get(key)
+
+
+def put(key: str, png: bytes) -> None:
+    """Сохранить отрисованный график."""
+    with _lock:
+        _cache[key] = {"bytes": png, "file_id": None}
+
+
+def set_file_id(key: str, file_id: str) -> None:
+    """Запомнить file_id отправленной фотографии."""
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            entry["file_id"] = file_id
+
+
+def clear() -> None:
+    """Полностью очистить кэш графиков."""
+    with _lock:
+        _cache.clear()
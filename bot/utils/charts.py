@@ -2,12 +2,20 @@
 Утилиты для создания графиков посещаемости.
 """
 
+import asyncio
 import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from bot.config import CHART_WORKERS
 from bot.utils.stats import get_attendance_by_dates, get_students_attendance_df
 
 matplotlib.use('Agg')  # Для работы без GUI
@@ -16,11 +24,137 @@ matplotlib.use('Agg')  # Для работы без GUI
 sns.set_theme(style="whitegrid")
 plt.rcParams['font.family'] = 'DejaVu Sans'
 plt.rcParams['figure.figsize'] = (12, 6)
-plt.rcParams['figure.dpi'] = 100
+# 80 dpi достаточно для превью в Telegram (клиент всё равно масштабирует)
+plt.rcParams['figure.dpi'] = 80
+
+# Цвета столбцов по проценту посещаемости: [0, 40), [40, 60), [60, 80), [80, 100]
+_COLOR_BINS = [0, 40, 60, 80, 101]
+_COLOR_LABELS = ['#F44336', '#FF9800', '#FFC107', '#4CAF50']
+
+# Фигура, переиспользуемая между графиками в пределах потока
+_tls = threading.local()
+
+# Пул процессов для отрисовки (создаётся при первом использовании)
+_chart_pool: ProcessPoolExecutor | None = None
+
+
+def get_chart_pool() -> ProcessPoolExecutor:
+    """
+    Получить пул процессов для отрисовки графиков.
+
+    Процессы запускаются через spawn: дочерний процесс заново импортирует
+    этот модуль (с бэкендом Agg) и не наследует потоки и соединения с БД.
+    """
+    global _chart_pool
+    if _chart_pool is None:
+        _chart_pool = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warmup
+        )
+    return _chart_pool
+
+
+def _warmup() -> None:
+    """
+    Прогреть matplotlib: построить кэш шрифтов и сохранить пробный PNG.
+
+    Первый savefig в новом процессе загружает шрифты и бэкенд, что
+    занимает сотни миллисекунд. Выполняется при запуске процесса пула,
+    чтобы эту задержку не получил первый запрошенный пользователем график.
+    """
+    fig, ax = _get_figure((2, 1))
+    ax.set_title('Прогрев')
+    ax.bar([0], [1])
+    fig.tight_layout()
+    _render_png(fig)
+
+
+def warmup_chart_pool() -> None:
+    """
+    Запустить процессы пула отрисовки заранее (при старте бота).
+
+    ProcessPoolExecutor создаёт процессы по мере поступления задач,
+    поэтому в пул отправляется по одной пустой задаче на процесс —
+    каждый процесс при запуске выполняет _warmup.
+    """
+    pool = get_chart_pool()
+    for _ in range(CHART_WORKERS):
+        pool.submit(int)
+
+
+def shutdown_chart_pool() -> None:
+    """Остановить пул процессов отрисовки."""
+    global _chart_pool
+    if _chart_pool is not None:
+        _chart_pool.shutdown(wait=False, cancel_futures=True)
+        _chart_pool = None
+
+
+async def render_chart(func, *args, **kwargs) -> io.BytesIO | None:
+    """
+    Отрисовать график в отдельном процессе, не блокируя цикл событий.
+
+    Аргументы передаются в процесс через pickle, поэтому функции нужно
+    передавать уже подготовленные данные, а не объекты БД.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_chart_pool(), partial(func, *args, **kwargs))
+
+
+def _get_figure(figsize: tuple[float, float]):
+    """
+    Получить очищенную фигуру нужного размера и оси на ней.
+
+    Фигура создаётся один раз на поток и затем только очищается:
+    так не приходится заново создавать холст и менеджер фигуры.
+    """
+    fig = getattr(_tls, "fig", None)
+    if fig is None:
+        fig = plt.figure()
+        _tls.fig = fig
+    fig.clear()
+    fig.set_size_inches(*figsize)
+    ax = fig.add_subplot(111)
+    return fig, ax
+
+
+def _bar_colors(percentages) -> np.ndarray:
+    """Цвета столбцов по процентам посещаемости (векторно через pd.cut)."""
+    return pd.cut(
+        pd.Series(percentages, dtype=float),
+        bins=_COLOR_BINS,
+        labels=_COLOR_LABELS,
+        right=False
+    ).astype(str).to_numpy()
+
+
+def _render_png(fig) -> io.BytesIO:
+    """
+    Сохранить фигуру в PNG и очистить её для следующего графика.
+
+    PNG пишется через Pillow с минимальным уровнем сжатия: файл чуть
+    больше, зато кодирование заметно быстрее. Поля уже подогнаны через
+    tight_layout, поэтому bbox_inches='tight' (повторная отрисовка для
+    обрезки) не используется.
+    """
+    buf = io.BytesIO()
+    fig.savefig(
+        buf,
+        format='png',
+        facecolor='white',
+        pil_kwargs={"compress_level": 1, "optimize": False}
+    )
+    fig.clear()
+    buf.seek(0)
+
+    return buf
 
 
 def create_dates_chart(subject_id: int, subject_name: str,
-                       date_from=None, date_to=None) -> io.BytesIO | None:
+                       date_from=None, date_to=None,
+                       dates_df: pd.DataFrame | None = None) -> io.BytesIO | None:
     """
     Создать гистограмму посещаемости по датам.
 
@@ -29,11 +163,13 @@ def create_dates_chart(subject_id: int, subject_name: str,
         subject_name: Название дисциплины для заголовка
         date_from: Начальная дата периода
         date_to: Конечная дата периода
+        dates_df: Готовый результат get_attendance_by_dates
+            (если передан, данные повторно из БД не загружаются)
 
     Returns:
         BytesIO с изображением PNG или None если нет данных
     """
-    df = get_attendance_by_dates(subject_id)
+    df = get_attendance_by_dates(subject_id) if dates_df is None else dates_df
 
     # Фильтруем по периоду
     if not df.empty:
@@ -45,10 +181,11 @@ def create_dates_chart(subject_id: int, subject_name: str,
     if df.empty:
         return None
 
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig, ax = _get_figure((12, 6))
 
     # Форматируем даты для отображения
-    df['date_str'] = df['date'].apply(lambda x: x.strftime('%d.%m'))
+    # (assign не изменяет исходный DataFrame — он может быть из кэша)
+    df = df.assign(date_str=pd.to_datetime(df['date']).dt.strftime('%d.%m'))
 
     # Создаём Stacked Bar — один столбец на дату
     x = range(len(df))
@@ -83,43 +220,36 @@ def create_dates_chart(subject_id: int, subject_name: str,
     ax.set_xticks(x)
     ax.set_xticklabels(df['date_str'], rotation=45, ha='right')
 
-    # Подписи на столбцах
-    for _, (bar_p, bar_a, present, absent) in enumerate(zip(bars_present, bars_absent, df['present'], df['absent'])):
-        total = present + absent
-        # Подпись присутствующих (в центре зелёной части)
-        if present > 0:
-            ax.annotate(f'{int(present)}',
-                        xy=(bar_p.get_x() + bar_p.get_width() / 2, present / 2),
-                        ha='center', va='center', fontsize=10, fontweight='bold', color='white')
-        # Подпись отсутствующих (в центре красной части)
-        if absent > 0:
-            ax.annotate(f'{int(absent)}',
-                        xy=(bar_a.get_x() + bar_a.get_width() /
-                            2, present + absent / 2),
-                        ha='center', va='center', fontsize=10, fontweight='bold', color='white')
-        # Процент сверху столбца
-        pct = present / total * 100 if total > 0 else 0
-        ax.annotate(f'{pct:.0f}%',
-                    xy=(bar_p.get_x() + bar_p.get_width() / 2, total),
-                    xytext=(0, 5),
-                    textcoords="offset points",
-                    ha='center', va='bottom', fontsize=9, fontweight='bold')
+    # Подписи на столбцах (нулевые значения не подписываются)
+    present = df['present'].to_numpy()
+    absent = df['absent'].to_numpy()
+    total = present + absent
+    pct = np.divide(present * 100, total,
+                    out=np.zeros(len(total), dtype=float), where=total > 0)
+
+    inner_style = dict(label_type='center', fontsize=10,
+                       fontweight='bold', color='white')
+    ax.bar_label(bars_present,
+                 labels=np.where(present > 0, present.astype(int).astype(str), ''),
+                 **inner_style)
+    ax.bar_label(bars_absent,
+                 labels=np.where(absent > 0, absent.astype(int).astype(str), ''),
+                 **inner_style)
+    # Процент сверху столбца
+    ax.bar_label(bars_absent,
+                 labels=[f'{p:.0f}%' for p in pct],
+                 label_type='edge', padding=5, fontsize=9, fontweight='bold')
 
     ax.legend(loc='upper right')
 
-    plt.tight_layout()
+    fig.tight_layout()
 
-    # Сохраняем в BytesIO
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', facecolor='white')
-    plt.close(fig)
-    buf.seek(0)
-
-    return buf
+    return _render_png(fig)
 
 
 def create_students_chart(subject_id: int, subject_name: str,
-                          date_from=None, date_to=None) -> io.BytesIO | None:
+                          date_from=None, date_to=None,
+                          students_stats: list | None = None) -> io.BytesIO | None:
     """
     Создать гистограмму посещаемости по студентам.
 
@@ -128,11 +258,19 @@ def create_students_chart(subject_id: int, subject_name: str,
         subject_name: Название дисциплины для заголовка
         date_from: Начальная дата периода
         date_to: Конечная дата периода
+        students_stats: Готовая статистика студентов из get_subject_stats
+            (если передана, данные повторно из БД не загружаются)
 
     Returns:
         BytesIO с изображением PNG или None если нет данных
     """
-    df = get_students_attendance_df(subject_id, date_from, date_to)
+    if students_stats is None:
+        df = get_students_attendance_df(subject_id, date_from, date_to)
+    else:
+        df = pd.DataFrame([
+            {"name": st["student_name"], "percentage": st["percentage"]}
+            for st in students_stats
+        ])
 
     if df.empty:
         return None
@@ -142,27 +280,19 @@ def create_students_chart(subject_id: int, subject_name: str,
     if len(df) > max_students:
         df = df.head(max_students)
 
-    fig, ax = plt.subplots(figsize=(12, max(6, len(df) * 0.4)))
+    fig, ax = _get_figure((12, max(6, len(df) * 0.4)))
 
-    # Сокращаем длинные имена
-    df['short_name'] = df['name'].apply(
-        lambda x: x[:25] + '...' if len(x) > 25 else x)
+    # Столбцы извлекаются из DataFrame один раз; длинные имена сокращаются
+    names = df['name']
+    short_names = names.where(
+        names.str.len() <= 25, names.str.slice(0, 25) + '...').to_numpy()
+    pct = df['percentage'].to_numpy(dtype=float)
 
     # Цветовая палитра в зависимости от процента
-    colors = []
-    for pct in df['percentage']:
-        if pct >= 80:
-            colors.append('#4CAF50')  # Зелёный
-        elif pct >= 60:
-            colors.append('#FFC107')  # Жёлтый
-        elif pct >= 40:
-            colors.append('#FF9800')  # Оранжевый
-        else:
-            colors.append('#F44336')  # Красный
+    colors = _bar_colors(pct)
 
     # Горизонтальная гистограмма
-    bars = ax.barh(df['short_name'], df['percentage'],
-                   color=colors, edgecolor='white')
+    bars = ax.barh(short_names, pct, color=colors, edgecolor='white')
 
     # Настройки
     ax.set_xlabel('Посещаемость (%)', fontsize=12)
@@ -172,9 +302,9 @@ def create_students_chart(subject_id: int, subject_name: str,
     ax.set_xlim(0, 105)
 
     # Добавляем значения на столбцы
-    for rect, pct in zip(bars, df['percentage']):
+    for rect, value in zip(bars, pct):
         width = rect.get_width()
-        ax.annotate(f'{pct:.0f}%',
+        ax.annotate(f'{value:.0f}%',
                     xy=(width, rect.get_y() + rect.get_height() / 2),
                     xytext=(5, 0),
                     textcoords="offset points",
@@ -187,15 +317,9 @@ def create_students_chart(subject_id: int, subject_name: str,
     # Инвертируем ось Y чтобы лучшие были сверху
     ax.invert_yaxis()
 
-    plt.tight_layout()
+    fig.tight_layout()
 
-    # Сохраняем в BytesIO
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', facecolor='white')
-    plt.close(fig)
-    buf.seek(0)
-
-    return buf
+    return _render_png(fig)
 
 
 def create_overall_chart(subjects_stats: list) -> io.BytesIO | None:
@@ -215,34 +339,21 @@ def create_overall_chart(subjects_stats: list) -> io.BytesIO | None:
     if not subjects_with_data:
         return None
 
-    df = pd.DataFrame([
-        {
-            "name": s.get("subject_name", ""),
-            "avg_attendance": s.get("avg_attendance", 0),
-            "total_students": s.get("total_students", 0),
-            "total_dates": s.get("total_dates", 0),
-        }
-        for s in subjects_with_data
-    ])
+    # Для нескольких дисциплин достаточно массивов numpy — без DataFrame
+    names = np.array([s.get("subject_name", "") for s in subjects_with_data])
+    avg = np.array([s.get("avg_attendance", 0) for s in subjects_with_data], dtype=float)
+    students = np.array([s.get("total_students", 0) for s in subjects_with_data])
+    dates = np.array([s.get("total_dates", 0) for s in subjects_with_data])
 
-    df = df.sort_values("avg_attendance", ascending=True)
+    order = np.argsort(avg, kind="stable")
+    names, avg, students, dates = names[order], avg[order], students[order], dates[order]
 
-    fig, ax = plt.subplots(figsize=(10, max(5, len(df) * 0.6)))
+    fig, ax = _get_figure((10, max(5, len(names) * 0.6)))
 
     # Цветовая палитра
-    colors = []
-    for pct in df['avg_attendance']:
-        if pct >= 80:
-            colors.append('#4CAF50')
-        elif pct >= 60:
-            colors.append('#FFC107')
-        elif pct >= 40:
-            colors.append('#FF9800')
-        else:
-            colors.append('#F44336')
-
-    bars = ax.barh(df['name'], df['avg_attendance'],
-                   color=colors, edgecolor='white')
+    colors = _bar_colors(avg)
+
+    bars = ax.barh(names, avg, color=colors, edgecolor='white')
 
     ax.set_xlabel('Средняя посещаемость (%)', fontsize=12)
     ax.set_ylabel('')
@@ -250,9 +361,9 @@ def create_overall_chart(subjects_stats: list) -> io.BytesIO | None:
                  fontsize=14, fontweight='bold')
     ax.set_xlim(0, 105)
 
-    for rect, pct, students, dates in zip(bars, df['avg_attendance'], df['total_students'], df['total_dates']):
+    for rect, pct, n_students, n_dates in zip(bars, avg, students, dates):
         width = rect.get_width()
-        ax.annotate(f'{pct:.0f}% ({students} студ., {dates} дат)',
+        ax.annotate(f'{pct:.0f}% ({n_students} студ., {n_dates} дат)',
                     xy=(width, rect.get_y() + rect.get_height() / 2),
                     xytext=(5, 0),
                     textcoords="offset points",
@@ -261,11 +372,6 @@ def create_overall_chart(subjects_stats: list) -> io.BytesIO | None:
     ax.axvline(x=80, color='#4CAF50', linestyle='--', linewidth=1, alpha=0.5)
     ax.axvline(x=60, color='#FFC107', linestyle='--', linewidth=1, alpha=0.5)
 
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', facecolor='white')
-    plt.close(fig)
-    buf.seek(0)
+    fig.tight_layout()
 
-    return buf
+    return _render_png(fig)
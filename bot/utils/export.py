@@ -6,18 +6,76 @@ import io
 from datetime import date
 from typing import List, Dict
 
+import xlsxwriter
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
 
+from bot.config import EXPORT_ENGINE
 from bot.database import get_session, crud
 from bot.database.models import Subject, Student, Attendance
 
+# Стили ячеек (создаются один раз и переиспользуются всеми отчётами)
+_TITLE_FONT = Font(bold=True, size=14)
+_HEADER_FONT = Font(bold=True, size=12)
+_HEADER_FONT_WHITE = Font(bold=True, size=12, color="FFFFFF")
+_SHEET_HEADER_FONT_WHITE = Font(bold=True, size=11, color="FFFFFF")
+_BOLD_FONT = Font(bold=True)
+_HEADER_FILL = PatternFill(
+    start_color="4472C4", end_color="4472C4", fill_type="solid")
+_PRESENT_FILL = PatternFill(
+    start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+_ABSENT_FILL = PatternFill(
+    start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+_CENTER_ALIGN = Alignment(horizontal="center", vertical="center")
+_THIN_BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+
+
+def _header_cell(ws, row: int, column: int, value, font: Font, centered: bool = True):
+    """Записать ячейку заголовка таблицы (ячейка запрашивается один раз)."""
+    cell = ws.cell(row=row, column=column, value=value)
+    cell.font = font
+    cell.fill = _HEADER_FILL
+    if centered:
+        cell.alignment = _CENTER_ALIGN
+    cell.border = _THIN_BORDER
+    return cell
+
+
+def _data_cell(ws, row: int, column: int, value, centered: bool = True):
+    """Записать ячейку данных с рамкой."""
+    cell = ws.cell(row=row, column=column, value=value)
+    if centered:
+        cell.alignment = _CENTER_ALIGN
+    cell.border = _THIN_BORDER
+    return cell
+
+
+def _stream_cell(ws, value, font: Font | None = None, fill: PatternFill | None = None,
+                 centered: bool = True) -> WriteOnlyCell:
+    """Ячейка с рамкой для листа в режиме write-only (добавляется через append)."""
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if centered:
+        cell.alignment = _CENTER_ALIGN
+    cell.border = _THIN_BORDER
+    return cell
+
 
 def create_attendance_report(
     subject_id: int,
     date_from: date | None = None,
-    date_to: date | None = None
+    date_to: date | None = None,
+    engine: str = EXPORT_ENGINE
 ) -> io.BytesIO:
     """
     Создать отчёт о посещаемости по дисциплине.
@@ -27,44 +85,18 @@ def create_attendance_report(
         subject_id: ID дисциплины
         date_from: Начало периода (включительно)
         date_to: Конец периода (включительно)
+        engine: Библиотека для записи: "openpyxl" или "xlsxwriter"
     """
     session = get_session()
 
     try:
         subject = crud.get_subject_by_id(session, subject_id)
         students = crud.get_students_by_subject(session, subject_id)
-        all_dates = crud.get_subject_attendance_dates(session, subject_id)
-
-        # Фильтруем даты по периоду
-        dates = all_dates
-        if date_from:
-            dates = [d for d in dates if d >= date_from]
-        if date_to:
-            dates = [d for d in dates if d <= date_to]
-
-        # Создаём книгу
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Посещаемость"
+        dates = crud.get_subject_attendance_dates(session, subject_id, date_from, date_to)
 
-        # Стили
-        header_font = Font(bold=True, size=12)
-        header_fill = PatternFill(
-            start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font_white = Font(bold=True, size=12, color="FFFFFF")
-        center_align = Alignment(horizontal="center", vertical="center")
-
-        present_fill = PatternFill(
-            start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-        absent_fill = PatternFill(
-            start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
+        # Вся посещаемость за период загружается одним запросом
+        matrix = crud.get_attendance_matrix(
+            session, subject_id, date_from, date_to)
 
         # Заголовок таблицы
         title = f"Посещаемость: {subject.name}"
@@ -78,112 +110,77 @@ def create_attendance_report(
                 period = f" (по {date_to.strftime('%d.%m.%Y')})"
             title += period
 
+        if engine == "xlsxwriter":
+            return _write_attendance_report_xlsxwriter(
+                title, students, dates, matrix)
+
+        # Создаём книгу
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Посещаемость"
+
         ws['A1'] = title
-        ws['A1'].font = Font(bold=True, size=14)
+        ws['A1'].font = _TITLE_FONT
         ws.merge_cells(start_row=1, start_column=1, end_row=1,
                        end_column=max(4, len(dates) + 3))
 
         # Заголовки колонок
         row = 3
-        ws.cell(row=row, column=1, value="№").font = header_font_white
-        ws.cell(row=row, column=1).fill = header_fill
-        ws.cell(row=row, column=1).alignment = center_align
-        ws.cell(row=row, column=1).border = thin_border
+        _header_cell(ws, row, 1, "№", _HEADER_FONT_WHITE)
 
-        ws.cell(row=row, column=2, value="ФИО").font = header_font_white
-        ws.cell(row=row, column=2).fill = header_fill
-        ws.cell(row=row, column=2).alignment = center_align
-        ws.cell(row=row, column=2).border = thin_border
+        _header_cell(ws, row, 2, "ФИО", _HEADER_FONT_WHITE)
 
         # Колонки дат
         col = 3
         for d in dates:
-            cell = ws.cell(row=row, column=col, value=d.strftime("%d.%m"))
-            cell.font = header_font_white
-            cell.fill = header_fill
-            cell.alignment = center_align
-            cell.border = thin_border
+            _header_cell(ws, row, col, d.strftime("%d.%m"), _HEADER_FONT_WHITE)
             col += 1
 
         # Колонки итогов
-        ws.cell(row=row, column=col, value="Всего").font = header_font_white
-        ws.cell(row=row, column=col).fill = header_fill
-        ws.cell(row=row, column=col).alignment = center_align
-        ws.cell(row=row, column=col).border = thin_border
+        _header_cell(ws, row, col, "Всего", _HEADER_FONT_WHITE)
 
-        ws.cell(row=row, column=col + 1, value="%").font = header_font_white
-        ws.cell(row=row, column=col + 1).fill = header_fill
-        ws.cell(row=row, column=col + 1).alignment = center_align
-        ws.cell(row=row, column=col + 1).border = thin_border
+        _header_cell(ws, row, col + 1, "%", _HEADER_FONT_WHITE)
 
         # Данные студентов
         row = 4
         for idx, student in enumerate(students, 1):
-            # Номер
-            ws.cell(row=row, column=1, value=idx).alignment = center_align
-            ws.cell(row=row, column=1).border = thin_border
-
-            # ФИО
-            ws.cell(row=row, column=2,
-                    value=student.full_name).border = thin_border
+            # Номер и ФИО
+            _data_cell(ws, row, 1, idx)
+            _data_cell(ws, row, 2, student.full_name, centered=False)
 
             # Посещаемость по датам
-            col = 3
             present_count = 0
 
-            for d in dates:
-                attendance_data = crud.get_attendance_by_subject_and_date(
-                    session, subject_id, d)
-                is_present = attendance_data.get(student.id, False)
-
-                cell = ws.cell(row=row, column=col)
-                if is_present:
-                    cell.value = "+"
-                    cell.fill = present_fill
+            for col, d in enumerate(dates, 3):
+                if matrix.get((student.id, d), False):
+                    _data_cell(ws, row, col, "+").fill = _PRESENT_FILL
                     present_count += 1
                 else:
-                    cell.value = "-"
-                    cell.fill = absent_fill
-
-                cell.alignment = center_align
-                cell.border = thin_border
-                col += 1
+                    _data_cell(ws, row, col, "-").fill = _ABSENT_FILL
+            col = len(dates) + 3
 
             # Итоги
             total_dates = len(dates)
             percent = round(present_count / total_dates *
                             100) if total_dates > 0 else 0
 
-            ws.cell(row=row, column=col,
-                    value=present_count).alignment = center_align
-            ws.cell(row=row, column=col).border = thin_border
-
-            ws.cell(row=row, column=col + 1,
-                    value=f"{percent}%").alignment = center_align
-            ws.cell(row=row, column=col + 1).border = thin_border
+            _data_cell(ws, row, col, present_count)
+            _data_cell(ws, row, col + 1, f"{percent}%")
 
             row += 1
 
         # Итоговая строка
         if students and dates:
             row += 1
-            ws.cell(row=row, column=1, value="").border = thin_border
-            ws.cell(row=row, column=2, value="ИТОГО").font = header_font
-            ws.cell(row=row, column=2).border = thin_border
-
-            col = 3
-            for d in dates:
-                attendance_data = crud.get_attendance_by_subject_and_date(
-                    session, subject_id, d)
+            _data_cell(ws, row, 1, "", centered=False)
+            _data_cell(ws, row, 2, "ИТОГО", centered=False).font = _HEADER_FONT
+
+            for col, d in enumerate(dates, 3):
                 present = sum(
-                    1 for s in students if attendance_data.get(s.id, False))
+                    1 for s in students if matrix.get((s.id, d), False))
 
-                cell = ws.cell(row=row, column=col,
-                               value=f"{present}/{len(students)}")
-                cell.alignment = center_align
-                cell.font = Font(bold=True)
-                cell.border = thin_border
-                col += 1
+                _data_cell(ws, row, col, f"{present}/{len(students)}").font = _BOLD_FONT
+            col = len(dates) + 3
 
         # Автоширина колонок
         ws.column_dimensions['A'].width = 5
@@ -202,6 +199,86 @@ def create_attendance_report(
         session.close()
 
 
+def _write_attendance_report_xlsxwriter(
+    title: str,
+    students: List[Student],
+    dates: List[date],
+    matrix: dict
+) -> io.BytesIO:
+    """
+    Записать отчёт по дисциплине через xlsxwriter.
+
+    Макет и оформление совпадают с вариантом на openpyxl. Режим
+    constant_memory сбрасывает каждую строку на диск сразу после записи,
+    поэтому строки пишутся строго сверху вниз.
+    """
+    output = io.BytesIO()
+    wb = xlsxwriter.Workbook(output, {"constant_memory": True})
+    ws = wb.add_worksheet("Посещаемость")
+
+    # Форматы (аналоги стилей openpyxl из начала модуля)
+    center = {"align": "center", "valign": "vcenter", "border": 1}
+    title_fmt = wb.add_format({"bold": True, "font_size": 14})
+    header_fmt = wb.add_format({
+        "bold": True, "font_size": 12, "font_color": "#FFFFFF",
+        "bg_color": "#4472C4", **center})
+    center_fmt = wb.add_format(center)
+    border_fmt = wb.add_format({"border": 1})
+    present_fmt = wb.add_format({"bg_color": "#C6EFCE", **center})
+    absent_fmt = wb.add_format({"bg_color": "#FFC7CE", **center})
+    total_label_fmt = wb.add_format({"bold": True, "font_size": 12, "border": 1})
+    total_fmt = wb.add_format({"bold": True, **center})
+
+    # Колонки (с нуля): №, ФИО, даты, «Всего», «%»
+    total_col = len(dates) + 2
+    ws.set_column(0, 0, 5)
+    ws.set_column(1, 1, 30)
+    ws.set_column(2, total_col + 1, 8)
+
+    ws.merge_range(0, 0, 0, max(3, total_col), title, title_fmt)
+
+    # Заголовки колонок
+    ws.write_row(2, 0, [
+        "№", "ФИО", *(d.strftime("%d.%m") for d in dates), "Всего", "%"
+    ], header_fmt)
+
+    # Данные студентов
+    total_dates = len(dates)
+    row = 3
+    for idx, student in enumerate(students, 1):
+        ws.write_number(row, 0, idx, center_fmt)
+        ws.write_string(row, 1, student.full_name, border_fmt)
+
+        present_count = 0
+        for col, d in enumerate(dates, 2):
+            if matrix.get((student.id, d), False):
+                ws.write_string(row, col, "+", present_fmt)
+                present_count += 1
+            else:
+                ws.write_string(row, col, "-", absent_fmt)
+
+        percent = round(present_count / total_dates *
+                        100) if total_dates > 0 else 0
+
+        ws.write_number(row, total_col, present_count, center_fmt)
+        ws.write_string(row, total_col + 1, f"{percent}%", center_fmt)
+        row += 1
+
+    # Итоговая строка (после пустой строки)
+    if students and dates:
+        row += 1
+        ws.write_blank(row, 0, None, border_fmt)
+        ws.write_string(row, 1, "ИТОГО", total_label_fmt)
+        for col, d in enumerate(dates, 2):
+            present = sum(1 for s in students if matrix.get((s.id, d), False))
+            ws.write_string(row, col, f"{present}/{len(students)}", total_fmt)
+
+    wb.close()
+    output.seek(0)
+
+    return output
+
+
 def create_all_subjects_report(
     teacher_id: int,
     date_from: date | None = None,
@@ -221,13 +298,13 @@ def create_all_subjects_report(
     try:
         subjects = crud.get_subjects_by_teacher(session, teacher_id)
 
-        wb = Workbook()
-        # Удаляем дефолтный лист
-        wb.remove(wb.active)
+        # Книга только для записи: строки сразу сериализуются в XML,
+        # объекты ячеек не накапливаются в памяти
+        wb = Workbook(write_only=True)
 
         if not subjects:
             ws = wb.create_sheet("Нет данных")
-            ws['A1'] = "Нет дисциплин"
+            ws.append(["Нет дисциплин"])
         else:
             for subject in subjects:
                 # Имя листа до 31 символа
@@ -251,110 +328,55 @@ def _fill_subject_sheet(
     date_from: date | None = None,
     date_to: date | None = None
 ):
-    """Заполнить лист данными о посещаемости дисциплины."""
+    """Заполнить лист (режим write-only) данными о посещаемости дисциплины."""
     students = crud.get_students_by_subject(session, subject.id)
-    all_dates = crud.get_subject_attendance_dates(session, subject.id)
-
-    # Фильтруем даты по периоду
-    dates = all_dates
-    if date_from:
-        dates = [d for d in dates if d >= date_from]
-    if date_to:
-        dates = [d for d in dates if d <= date_to]
-
-    # Стили
-    header_font = Font(bold=True, size=11)
-    header_fill = PatternFill(start_color="4472C4",
-                              end_color="4472C4", fill_type="solid")
-    header_font_white = Font(bold=True, size=11, color="FFFFFF")
-    center_align = Alignment(horizontal="center", vertical="center")
-
-    present_fill = PatternFill(
-        start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-    absent_fill = PatternFill(start_color="FFC7CE",
-                              end_color="FFC7CE", fill_type="solid")
-
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    dates = crud.get_subject_attendance_dates(session, subject.id, date_from, date_to)
+
+    # Вся посещаемость за период загружается одним запросом
+    matrix = crud.get_attendance_matrix(session, subject.id, date_from, date_to)
+
+    # Ширина колонок задаётся до первой строки: в режиме write-only
+    # она записывается в начало листа
+    ws.column_dimensions['A'].width = 5
+    ws.column_dimensions['B'].width = 30
+    for i in range(3, len(dates) + 5):
+        ws.column_dimensions[get_column_letter(i)].width = 8
 
     # Заголовки
-    row = 1
-    ws.cell(row=row, column=1, value="№").font = header_font_white
-    ws.cell(row=row, column=1).fill = header_fill
-    ws.cell(row=row, column=1).alignment = center_align
-    ws.cell(row=row, column=1).border = thin_border
-
-    ws.cell(row=row, column=2, value="ФИО").font = header_font_white
-    ws.cell(row=row, column=2).fill = header_fill
-    ws.cell(row=row, column=2).border = thin_border
-
-    col = 3
-    for d in dates:
-        cell = ws.cell(row=row, column=col, value=d.strftime("%d.%m"))
-        cell.font = header_font_white
-        cell.fill = header_fill
-        cell.alignment = center_align
-        cell.border = thin_border
-        col += 1
-
-    ws.cell(row=row, column=col, value="Всего").font = header_font_white
-    ws.cell(row=row, column=col).fill = header_fill
-    ws.cell(row=row, column=col).alignment = center_align
-    ws.cell(row=row, column=col).border = thin_border
-
-    ws.cell(row=row, column=col + 1, value="%").font = header_font_white
-    ws.cell(row=row, column=col + 1).fill = header_fill
-    ws.cell(row=row, column=col + 1).alignment = center_align
-    ws.cell(row=row, column=col + 1).border = thin_border
+    ws.append([
+        _stream_cell(ws, "№", _SHEET_HEADER_FONT_WHITE, _HEADER_FILL),
+        _stream_cell(ws, "ФИО", _SHEET_HEADER_FONT_WHITE, _HEADER_FILL, centered=False),
+        *(_stream_cell(ws, d.strftime("%d.%m"), _SHEET_HEADER_FONT_WHITE, _HEADER_FILL)
+          for d in dates),
+        _stream_cell(ws, "Всего", _SHEET_HEADER_FONT_WHITE, _HEADER_FILL),
+        _stream_cell(ws, "%", _SHEET_HEADER_FONT_WHITE, _HEADER_FILL),
+    ])
+
+    # Ячейки «+» и «-» одинаковы во всех строках: append сразу пишет строку
+    # в XML (координаты подставляются при записи), поэтому эти две ячейки
+    # создаются один раз на лист и переиспользуются
+    present_cell = _stream_cell(ws, "+", fill=_PRESENT_FILL)
+    absent_cell = _stream_cell(ws, "-", fill=_ABSENT_FILL)
 
     # Данные
-    row = 2
+    total_dates = len(dates)
     for idx, student in enumerate(students, 1):
-        ws.cell(row=row, column=1, value=idx).alignment = center_align
-        ws.cell(row=row, column=1).border = thin_border
-
-        ws.cell(row=row, column=2, value=student.full_name).border = thin_border
-
-        col = 3
+        row = [
+            _stream_cell(ws, idx),
+            _stream_cell(ws, student.full_name, centered=False),
+        ]
         present_count = 0
 
         for d in dates:
-            attendance_data = crud.get_attendance_by_subject_and_date(
-                session, subject.id, d)
-            is_present = attendance_data.get(student.id, False)
-
-            cell = ws.cell(row=row, column=col)
-            if is_present:
-                cell.value = "+"
-                cell.fill = present_fill
+            if matrix.get((student.id, d), False):
+                row.append(present_cell)
                 present_count += 1
             else:
-                cell.value = "-"
-                cell.fill = absent_fill
-
-            cell.alignment = center_align
-            cell.border = thin_border
-            col += 1
+                row.append(absent_cell)
 
-        total_dates = len(dates)
         percent = round(present_count / total_dates *
                         100) if total_dates > 0 else 0
 
-        ws.cell(row=row, column=col, value=present_count).alignment = center_align
-        ws.cell(row=row, column=col).border = thin_border
-
-        ws.cell(row=row, column=col + 1,
-                value=f"{percent}%").alignment = center_align
-        ws.cell(row=row, column=col + 1).border = thin_border
-
-        row += 1
-
-    # Автоширина
-    ws.column_dimensions['A'].width = 5
-    ws.column_dimensions['B'].width = 30
-    for i in range(3, col + 2):
-        ws.column_dimensions[get_column_letter(i)].width = 8
+        row.append(_stream_cell(ws, present_count))
+        row.append(_stream_cell(ws, f"{percent}%"))
+        ws.append(row)
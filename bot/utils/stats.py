@@ -3,61 +3,77 @@
 """
 
 from datetime import date
+from operator import itemgetter
 from typing import Optional
+import numpy as np
 import pandas as pd
+from sqlalchemy.orm import Session
 
-from bot.database import get_session, crud
+from bot.database import optional_session, crud
+from bot.utils.stats_cache import cached_subject, cached_teacher
+
+
+def _compute_student_stats(student, dates: frozenset[date],
+                           present_dates: set[date]) -> dict:
+    """
+    Статистика студента по дисциплине из заранее загруженных данных.
+
+    Даты делятся на присутствия и пропуски операциями над множествами
+    (без цикла по датам); отсутствие записи считается пропуском.
+
+    Args:
+        student: Студент (нужно full_name)
+        dates: Даты занятий за период
+        present_dates: Даты, когда студент присутствовал
+    """
+    dates_present = sorted(dates & present_dates)
+    dates_absent = sorted(dates - present_dates)
+
+    total = len(dates)
+    present = len(dates_present)
+
+    return {
+        "student_name": student.full_name,
+        "total": total,
+        "present": present,
+        "absent": len(dates_absent),
+        "percentage": round(present / total * 100, 1) if total > 0 else 0,
+        "dates_present": dates_present,
+        "dates_absent": dates_absent,
+    }
 
 
 def get_student_stats(student_id: int, subject_id: Optional[int] = None,
-                      date_from: Optional[date] = None, date_to: Optional[date] = None) -> dict:
+                      date_from: Optional[date] = None, date_to: Optional[date] = None,
+                      session: Optional[Session] = None) -> dict:
     """
     Статистика по конкретному студенту.
 
     Args:
         student_id: ID студента
         subject_id: ID дисциплины (если None - по всем дисциплинам)
+        session: Открытая сессия вызывающего кода (если None - своя)
 
     Returns:
         dict с полями: total, present, absent, percentage, dates_present, dates_absent
     """
-    session = get_session()
-    try:
+    with optional_session(session) as session:
         student = crud.get_student_by_id(session, student_id)
         if not student:
             return {}
 
         if subject_id:
-            # Получаем ВСЕ даты занятий по дисциплине
-            all_dates = crud.get_subject_attendance_dates(session, subject_id)
-
-            # Фильтруем по периоду
-            if date_from:
-                all_dates = [d for d in all_dates if d >= date_from]
-            if date_to:
-                all_dates = [d for d in all_dates if d <= date_to]
+            # Даты занятий по дисциплине за период
+            all_dates = crud.get_subject_attendance_dates(
+                session, subject_id, date_from, date_to)
 
             # Получаем записи посещаемости студента
             attendances = crud.get_student_attendance_by_subject(
                 session, student_id, subject_id
             )
-            attendance_dict = {att.date: att.is_present for att in attendances}
+            present_dates = {att.date for att in attendances if att.is_present}
 
-            dates_present = []
-            dates_absent = []
-
-            # Проверяем каждую дату занятия
-            for d in all_dates:
-                if d in attendance_dict:
-                    if attendance_dict[d]:
-                        dates_present.append(d)
-                    else:
-                        dates_absent.append(d)
-                else:
-                    # Нет записи = пропуск
-                    dates_absent.append(d)
-
-            total = len(all_dates)
+            return _compute_student_stats(student, frozenset(all_dates), present_dates)
         else:
             # Статистика по всем дисциплинам (старая логика)
             attendances = crud.get_student_all_attendance(session, student_id)
@@ -86,33 +102,27 @@ def get_student_stats(student_id: int, subject_id: Optional[int] = None,
             "dates_present": sorted(dates_present),
             "dates_absent": sorted(dates_absent),
         }
-    finally:
-        session.close()
 
 
+@cached_subject
 def get_subject_stats(subject_id: int, date_from: Optional[date] = None,
-                      date_to: Optional[date] = None) -> dict:
+                      date_to: Optional[date] = None,
+                      session: Optional[Session] = None) -> dict:
     """
     Статистика по дисциплине.
 
     Returns:
         dict с полями: subject_name, total_dates, total_students, 
-                       avg_attendance, students_stats (отсортированные)
+                       avg_attendance, students_stats (отсортированные;
+                       student_name, total, present, absent, percentage)
     """
-    session = get_session()
-    try:
+    with optional_session(session) as session:
         subject = crud.get_subject_by_id(session, subject_id)
         if not subject:
             return {}
 
         students = crud.get_students_by_subject(session, subject_id)
-        dates = crud.get_subject_attendance_dates(session, subject_id)
-
-        # Фильтруем по периоду
-        if date_from:
-            dates = [d for d in dates if d >= date_from]
-        if date_to:
-            dates = [d for d in dates if d <= date_to]
+        dates = crud.get_subject_attendance_dates(session, subject_id, date_from, date_to)
 
         if not students or not dates:
             return {
@@ -123,17 +133,29 @@ def get_subject_stats(subject_id: int, date_from: Optional[date] = None,
                 "students_stats": [],
             }
 
+        # Присутствия всех студентов за период — одним запросом GROUP BY;
+        # отсутствие записи считается пропуском
+        present_counts = crud.get_present_counts_by_student(
+            session, subject_id, date_from, date_to)
+
+        total = len(dates)
         students_stats = []
         total_percentage = 0
 
         for student in students:
-            stats = get_student_stats(
-                student.id, subject_id, date_from, date_to)
-            students_stats.append(stats)
-            total_percentage += stats.get("percentage", 0)
+            present = present_counts.get(student.id, 0)
+            percentage = round(present / total * 100, 1)
+            students_stats.append({
+                "student_name": student.full_name,
+                "total": total,
+                "present": present,
+                "absent": total - present,
+                "percentage": percentage,
+            })
+            total_percentage += percentage
 
         # Сортируем по проценту (лучшие сверху)
-        students_stats.sort(key=lambda x: x.get("percentage", 0), reverse=True)
+        students_stats.sort(key=itemgetter("percentage"), reverse=True)
 
         avg_attendance = round(
             total_percentage / len(students), 1) if students else 0
@@ -145,110 +167,109 @@ def get_subject_stats(subject_id: int, date_from: Optional[date] = None,
             "avg_attendance": avg_attendance,
             "students_stats": students_stats,
         }
-    finally:
-        session.close()
 
 
-def get_attendance_by_dates(subject_id: int) -> pd.DataFrame:
+@cached_subject
+def get_attendance_by_dates(subject_id: int,
+                            session: Optional[Session] = None) -> pd.DataFrame:
     """
     Получить DataFrame с посещаемостью по датам.
 
     Returns:
         DataFrame: index=даты, columns=['date', 'present', 'absent', 'total', 'percentage']
     """
-    session = get_session()
-    try:
-        dates = crud.get_subject_attendance_dates(session, subject_id)
-        students = crud.get_students_by_subject(session, subject_id)
-
-        if not dates or not students:
+    with optional_session(session) as session:
+        counts = crud.get_attendance_counts_by_date(session, subject_id)
+        if not counts:
             return pd.DataFrame()
 
-        data = []
-        for d in sorted(dates):
-            present = 0
-            absent = 0
-
-            for student in students:
-                att = crud.get_attendance(session, student.id, subject_id, d)
-                if att:
-                    if att.is_present:
-                        present += 1
-                    else:
-                        absent += 1
-                else:
-                    absent += 1  # Нет записи = отсутствие
-
-            total = present + absent
-            percentage = round(present / total * 100, 1) if total > 0 else 0
-
-            data.append({
-                "date": d,
-                "present": present,
-                "absent": absent,
-                "total": total,
-                "percentage": percentage,
-            })
+        total = crud.count_students_in_subject(session, subject_id)
+        if not total:
+            return pd.DataFrame()
 
-        return pd.DataFrame(data)
-    finally:
-        session.close()
+        # Нет записи = отсутствие, поэтому отсутствующие считаются от состава
+        return pd.DataFrame.from_records(
+            [
+                (d, present, total - present, total,
+                 round(present / total * 100, 1))
+                for d, present, _recorded in counts
+            ],
+            columns=["date", "present", "absent", "total", "percentage"],
+        )
 
 
+@cached_subject
 def get_students_attendance_df(subject_id: int, date_from: Optional[date] = None,
-                               date_to: Optional[date] = None) -> pd.DataFrame:
+                               date_to: Optional[date] = None,
+                               session: Optional[Session] = None) -> pd.DataFrame:
     """
     Получить DataFrame с посещаемостью по студентам.
 
     Returns:
         DataFrame: columns=['name', 'present', 'absent', 'total', 'percentage']
     """
-    session = get_session()
-    try:
+    with optional_session(session) as session:
         students = crud.get_students_by_subject(session, subject_id)
 
         if not students:
             return pd.DataFrame()
 
-        data = []
-        for student in students:
-            stats = get_student_stats(
-                student.id, subject_id, date_from, date_to)
-            data.append({
-                "name": student.full_name,
-                "present": stats.get("present", 0),
-                "absent": stats.get("absent", 0),
-                "total": stats.get("total", 0),
-                "percentage": stats.get("percentage", 0),
-            })
+        dates = crud.get_subject_attendance_dates(session, subject_id, date_from, date_to)
+        total = len(dates)
+
+        # Присутствия за период по студентам — один запрос GROUP BY
+        present_counts = crud.get_present_counts_by_student(
+            session, subject_id, date_from, date_to)
+        present = np.fromiter(
+            (present_counts.get(student.id, 0) for student in students),
+            dtype=int, count=len(students))
 
-        df = pd.DataFrame(data)
+        df = pd.DataFrame({
+            "name": [student.full_name for student in students],
+            "present": present,
+            "absent": total - present,
+            "total": total,
+            "percentage": (present / total * 100).round(1) if total else 0.0,
+        })
         df = df.sort_values("percentage", ascending=False)
 
         return df
-    finally:
-        session.close()
 
 
+@cached_teacher
 def get_teacher_overall_stats(teacher_id: int, date_from: Optional[date] = None,
-                              date_to: Optional[date] = None) -> dict:
+                              date_to: Optional[date] = None,
+                              session: Optional[Session] = None) -> dict:
     """
     Общая статистика преподавателя по всем дисциплинам.
+
+    Счётчики по дисциплинам считаются одним запросом. Средняя посещаемость
+    дисциплины — доля присутствий среди всех пар (студент, дата занятия);
+    отсутствие записи считается пропуском.
     """
-    session = get_session()
-    try:
-        subjects = crud.get_subjects_by_teacher(session, teacher_id)
+    with optional_session(session) as session:
+        rows = crud.get_teacher_attendance_aggregate(
+            session, teacher_id, date_from, date_to)
 
         total_students = 0
-        total_subjects = len(subjects)
+        total_subjects = len(rows)
         total_dates = 0
         subjects_stats = []
 
-        for subject in subjects:
-            stats = get_subject_stats(subject.id, date_from, date_to)
-            subjects_stats.append(stats)
-            total_students += stats.get("total_students", 0)
-            total_dates += stats.get("total_dates", 0)
+        for _subject_id, name, students_count, dates_count, present_count in rows:
+            if not students_count or not dates_count:
+                dates_count = 0
+            avg_attendance = round(
+                present_count / (students_count * dates_count) * 100, 1) if dates_count else 0
+
+            subjects_stats.append({
+                "subject_name": name,
+                "total_dates": dates_count,
+                "total_students": students_count,
+                "avg_attendance": avg_attendance,
+            })
+            total_students += students_count
+            total_dates += dates_count
 
         # Средняя посещаемость по всем дисциплинам
         avg_attendances = [s.get("avg_attendance", 0)
@@ -263,5 +284,3 @@ def get_teacher_overall_stats(teacher_id: int, date_from: Optional[date] = None,
             "overall_avg_attendance": overall_avg,
             "subjects_stats": subjects_stats,
         }
-    finally:
-        session.close()
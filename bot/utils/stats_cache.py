@@ -0,0 +1,87 @@
+"""
+Кэш результатов расчёта статистики.
+
+Статистика пересчитывается заново не чаще раза в STATS_CACHE_TTL секунд
+для одних и тех же аргументов. При изменении данных (отметка посещаемости,
+изменение состава дисциплины и т.п.) записи сбрасываются явно.
+"""
+
+import inspect
+from functools import wraps
+from threading import Lock
+
+from cachetools import TTLCache
+
+# Время жизни записи в кэше (секунды)
+STATS_CACHE_TTL = 60
+
+# Кэши по типу сущности: ключ — (ID, имя функции, остальные аргументы
+# кроме session...)
+_subject_cache = TTLCache(maxsize=1024, ttl=STATS_CACHE_TTL)
+_teacher_cache = TTLCache(maxsize=1024, ttl=STATS_CACHE_TTL)
+
+_lock = Lock()
+
+
+def _cached(cache: TTLCache):
+    """Декоратор: кэшировать результат по всем аргументам функции."""
+    def decorator(func):
+        signature = inspect.signature(func)
+        name = func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            # Сессия БД не влияет на результат и в ключ не входит
+            bound.arguments.pop("session", None)
+            entity_id, *rest = bound.arguments.values()
+            # Имя функции в ключе: несколько функций делят один кэш
+            key = (entity_id, name, *rest)
+
+            with _lock:
+                if key in cache:
+                    return cache[key]
+
+            result = func(*args, **kwargs)
+
+            with _lock:
+                cache[key] = result
+            return result
+
+        return wrapper
+    return decorator
+
+
+def cached_subject(func):
+    """Кэшировать статистику дисциплины (первый аргумент — subject_id)."""
+    return _cached(_subject_cache)(func)
+
+
+def cached_teacher(func):
+    """Кэшировать статистику преподавателя (первый аргумент — teacher_id)."""
+    return _cached(_teacher_cache)(func)
+
+
+def _invalidate(cache: TTLCache, entity_id: int) -> None:
+    """Удалить из кэша все записи для указанного ID."""
+    with _lock:
+        for key in [k for k in cache.keys() if k[0] == entity_id]:
+            cache.pop(key, None)
+
+
+def invalidate_subject(subject_id: int) -> None:
+    """Сбросить закэшированную статистику дисциплины."""
+    _invalidate(_subject_cache, subject_id)
+
+
+def invalidate_teacher(teacher_id: int) -> None:
+    """Сбросить закэшированную общую статистику преподавателя."""
+    _invalidate(_teacher_cache, teacher_id)
+
+
+def clear() -> None:
+    """Полностью очистить кэш статистики."""
+    with _lock:
+        _subject_cache.clear()
+        _teacher_cache.clear()
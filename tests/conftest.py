@@ -3,29 +3,101 @@
 """
 
 from datetime import date
+from unittest.mock import MagicMock
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 
+from bot.database import session_ctx
 from bot.database.models import Base, Teacher, Subject, Student, SubjectStudent, Attendance
+from bot.utils import stats, stats_cache, chart_cache
 
 
-@pytest.fixture(scope="function")
+@pytest.fixture(autouse=True)
+def clear_stats_cache():
+    """Сбрасывать кэш статистики и графиков между тестами."""
+    stats_cache.clear()
+    chart_cache.clear()
+    yield
+    stats_cache.clear()
+    chart_cache.clear()
+
+
+@pytest.fixture(scope="session")
 def engine():
-    """Создать тестовый движок SQLite в памяти."""
-    engine = create_engine("sqlite:///:memory:", echo=False)
+    """Создать тестовый движок SQLite в памяти (схема создаётся один раз)."""
+    # Одно соединение на все тесты и потоки: база в памяти живёт, пока
+    # открыто соединение, и должна быть видна из любого потока
+    engine = create_engine(
+        "sqlite:///:memory:",
+        echo=False,
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+
+    # pysqlite сам управляет транзакциями и не поддерживает SAVEPOINT
+    # внутри них: отключаем это и начинаем транзакции явно
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, _connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_transaction(connection):
+        connection.exec_driver_sql("BEGIN")
+
     Base.metadata.create_all(engine)
     yield engine
-    Base.metadata.drop_all(engine)
+    engine.dispose()
 
 
 @pytest.fixture(scope="function")
 def session(engine):
-    """Создать тестовую сессию."""
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    """
+    Создать тестовую сессию.
+
+    Тест работает внутри внешней транзакции, которая откатывается после
+    него; commit в коде фиксирует только точку сохранения (SAVEPOINT).
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+    # expire_on_commit=False — как в SessionLocal приложения: после commit
+    # объекты фикстур не перечитываются из БД при каждом обращении
+    session = Session(bind=connection, join_transaction_mode="create_savepoint",
+                      expire_on_commit=False)
     yield session
     session.close()
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def sql_queries(engine):
+    """Список SELECT-запросов к тестовой БД, выполненных во время теста."""
+    queries = []
+
+    def _collect(_conn, _cursor, statement, _parameters, _context, _executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _collect)
+    yield queries
+    event.remove(engine, "before_cursor_execute", _collect)
+
+
+@pytest.fixture
+def stats_session(monkeypatch, session):
+    """Тестовая сессия, которую функции статистики получают через get_session."""
+    monkeypatch.setattr(session_ctx, "get_session", lambda: session)
+    return session
+
+
+@pytest.fixture
+def mock_crud(monkeypatch):
+    """Заменить crud в модуле статистики на MagicMock."""
+    mock = MagicMock()
+    monkeypatch.setattr(stats, "crud", mock)
+    return mock
 
 
 @pytest.fixture
@@ -34,7 +106,6 @@ def teacher(session):
     teacher = Teacher(telegram_id=123456789, name="Тестовый Преподаватель")
     session.add(teacher)
     session.commit()
-    session.refresh(teacher)
     return teacher
 
 
@@ -44,31 +115,33 @@ def subject(session, teacher):
     subject = Subject(teacher_id=teacher.id, name="Тестовая дисциплина")
     session.add(subject)
     session.commit()
-    session.refresh(subject)
     return subject
 
 
 @pytest.fixture
 def students(session, teacher):
     """Создать тестовых студентов."""
-    students_data = [
-        Student(teacher_id=teacher.id, full_name="Иванов Иван Иванович"),
-        Student(teacher_id=teacher.id, full_name="Петров Пётр Петрович"),
-        Student(teacher_id=teacher.id, full_name="Сидоров Сидор Сидорович"),
+    names = [
+        "Иванов Иван Иванович",
+        "Петров Пётр Петрович",
+        "Сидоров Сидор Сидорович",
     ]
-    session.add_all(students_data)
+    # Один INSERT ... RETURNING вместо вставки и refresh каждого объекта
+    students = session.scalars(
+        insert(Student).returning(Student, sort_by_parameter_order=True),
+        [{"teacher_id": teacher.id, "full_name": name} for name in names],
+    ).all()
     session.commit()
-    for s in students_data:
-        session.refresh(s)
-    return students_data
+    return students
 
 
 @pytest.fixture
 def subject_with_students(session, subject, students):
     """Дисциплина с привязанными студентами."""
-    for student in students:
-        link = SubjectStudent(subject_id=subject.id, student_id=student.id)
-        session.add(link)
+    session.execute(
+        insert(SubjectStudent),
+        [{"subject_id": subject.id, "student_id": student.id} for student in students],
+    )
     session.commit()
     return subject
 
@@ -82,31 +155,23 @@ def attendance_data(session, subject_with_students, students):
     # Петров - 66% (2/3)
     # Сидоров - 33% (1/3)
 
-    attendance_records = [
-        # 01.11 - все присутствовали
-        Attendance(
-            student_id=students[0].id, subject_id=subject_with_students.id, date=dates[0], is_present=True),
-        Attendance(
-            student_id=students[1].id, subject_id=subject_with_students.id, date=dates[0], is_present=True),
-        Attendance(
-            student_id=students[2].id, subject_id=subject_with_students.id, date=dates[0], is_present=True),
-        # 08.11 - Сидоров отсутствует
-        Attendance(
-            student_id=students[0].id, subject_id=subject_with_students.id, date=dates[1], is_present=True),
-        Attendance(
-            student_id=students[1].id, subject_id=subject_with_students.id, date=dates[1], is_present=True),
-        Attendance(
-            student_id=students[2].id, subject_id=subject_with_students.id, date=dates[1], is_present=False),
-        # 15.11 - только Иванов
-        Attendance(
-            student_id=students[0].id, subject_id=subject_with_students.id, date=dates[2], is_present=True),
-        Attendance(
-            student_id=students[1].id, subject_id=subject_with_students.id, date=dates[2], is_present=False),
-        Attendance(
-            student_id=students[2].id, subject_id=subject_with_students.id, date=dates[2], is_present=False),
+    # Отметки по датам в порядке студентов
+    marks = [
+        (True, True, True),     # 01.11 - все присутствовали
+        (True, True, False),    # 08.11 - Сидоров отсутствует
+        (True, False, False),   # 15.11 - только Иванов
     ]
 
-    session.add_all(attendance_records)
+    session.execute(insert(Attendance), [
+        {
+            "student_id": student.id,
+            "subject_id": subject_with_students.id,
+            "date": day,
+            "is_present": is_present,
+        }
+        for day, day_marks in zip(dates, marks)
+        for student, is_present in zip(students, day_marks)
+    ])
     session.commit()
 
     return {
@@ -65,6 +65,17 @@ class TestSubjectCRUD:
         assert "Физика" in names
         assert "Химия" in names
 
+    def test_get_subjects_with_counts(self, session, teacher, attendance_data):
+        """Получение дисциплин с количеством студентов и дат."""
+        crud.create_subject(session, teacher.id, "Пустая")
+
+        rows = crud.get_subjects_with_counts(session, teacher.id)
+        counts = {row.name: (row.students_count, row.dates_count)
+                  for row in rows}
+
+        assert counts[attendance_data["subject"].name] == (3, 3)
+        assert counts["Пустая"] == (0, 0)
+
     def test_get_subject_by_id(self, session, subject):
         """Получение дисциплины по ID."""
         found = crud.get_subject_by_id(session, subject.id)
@@ -106,6 +117,8 @@ class TestStudentCRUD:
 
         assert len(students) == 3
         assert all(s.teacher_id == teacher.id for s in students)
+        assert [s.full_name for s in students] == names
+        assert all(s.id is not None for s in students)
 
     def test_get_all_students_by_teacher(self, session, teacher, students):  # pylint: disable=unused-argument
         """Получение всех студентов преподавателя."""
@@ -129,6 +142,25 @@ class TestStudentCRUD:
         assert result is True
         assert crud.get_student_by_id(session, student_id) is None
 
+    def test_get_student_profile(self, session, attendance_data):
+        """Карточка студента с дисциплинами и посещаемостью."""
+        student = attendance_data["students"][1]
+        profile = crud.get_student_profile(session, student.id)
+
+        assert profile.full_name == student.full_name
+        assert profile.subjects == [attendance_data["subject"].name]
+        assert profile.total == 3
+        assert profile.present == 2
+
+    def test_get_student_profile_without_attendance(self, session, students):
+        """Карточка студента без дисциплин и отметок."""
+        profile = crud.get_student_profile(session, students[0].id)
+
+        assert profile.subjects == []
+        assert profile.total == 0
+        assert profile.present == 0
+        assert crud.get_student_profile(session, 999) is None
+
 
 class TestSubjectStudentCRUD:
     """Тесты для связи студент-дисциплина."""
@@ -143,14 +175,53 @@ class TestSubjectStudentCRUD:
 
     def test_add_student_to_subject_duplicate(self, session, subject, students):
         """Повторное добавление не создаёт дубликат."""
-        crud.add_student_to_subject(session, subject.id, students[0].id)
-        _ = crud.add_student_to_subject(
+        link = crud.add_student_to_subject(session, subject.id, students[0].id)
+        same_link = crud.add_student_to_subject(
             session, subject.id, students[0].id)
 
         # Должен вернуть существующую связь
+        assert same_link.id == link.id
         students_in_subject = crud.get_students_by_subject(session, subject.id)
         assert len(students_in_subject) == 1
 
+    def test_create_and_add_single_commit(self, session, teacher, subject):
+        """Создание студента и добавление в дисциплину без промежуточных коммитов."""
+        student = crud.create_student(
+            session, teacher.id, "Новый Студент", commit=False)
+        assert student.id is not None
+
+        crud.add_student_to_subject(
+            session, subject.id, student.id, commit=False)
+        session.rollback()
+
+        # Без коммита ничего не сохраняется
+        assert crud.get_students_by_subject(session, subject.id) == []
+        assert crud.get_all_students_by_teacher(session, teacher.id) == []
+
+    def test_get_students_not_in_subject(self, session, teacher, subject, students):
+        """Студенты пула, ещё не добавленные в дисциплину."""
+        crud.add_student_to_subject(session, subject.id, students[0].id)
+
+        available = crud.get_students_not_in_subject(
+            session, teacher.id, subject.id)
+
+        assert {s.id for s in available} == {students[1].id, students[2].id}
+
+    def test_students_not_in_subject_pagination(self, session, teacher, subject, students):
+        """Постраничная выборка и подсчёт студентов вне дисциплины."""
+        crud.add_student_to_subject(session, subject.id, students[0].id)
+
+        assert crud.count_students_not_in_subject(
+            session, teacher.id, subject.id) == 2
+
+        first = crud.get_students_not_in_subject(
+            session, teacher.id, subject.id, limit=1)
+        second = crud.get_students_not_in_subject(
+            session, teacher.id, subject.id, limit=1, offset=1)
+
+        assert [s.full_name for s in first + second] == [
+            "Петров Пётр Петрович", "Сидоров Сидор Сидорович"]
+
     def test_get_students_by_subject(self, session, subject_with_students, students):  # pylint: disable=unused-argument
         """Получение студентов дисциплины."""
         # students фикстура нужна для subject_with_students
@@ -170,6 +241,24 @@ class TestSubjectStudentCRUD:
             session, subject_with_students.id)
         assert len(remaining) == 2
 
+    def test_count_subjects_per_student(self, session, teacher, subject_with_students, students):  # pylint: disable=unused-argument
+        """Количество дисциплин у каждого студента одним запросом."""
+        extra = crud.create_student(session, teacher.id, "Без Дисциплин")
+        counts = crud.count_subjects_per_student(session, teacher.id)
+
+        assert counts == {s.id: 1 for s in students}
+        assert extra.id not in counts
+
+    def test_get_student_and_subject(self, session, subject, students):
+        """Студент и дисциплина одним запросом."""
+        student, found = crud.get_student_and_subject(
+            session, students[0].id, subject.id)
+
+        assert student.id == students[0].id
+        assert found.id == subject.id
+        assert crud.get_student_and_subject(
+            session, students[0].id, 999) == (None, None)
+
     def test_count_students_in_subject(self, session, subject_with_students):
         """Подсчёт студентов в дисциплине."""
         count = crud.count_students_in_subject(
@@ -196,7 +285,7 @@ class TestAttendanceCRUD:
         today = date.today()
 
         # Создаём с is_present=True
-        crud.set_attendance(
+        created = crud.set_attendance(
             session, students[0].id, subject_with_students.id, today, True)
 
         # Обновляем на False
@@ -205,6 +294,9 @@ class TestAttendanceCRUD:
         )
 
         assert att.is_present is False
+        assert att.id == created.id
+        assert crud.get_attendance_by_subject_and_date(
+            session, subject_with_students.id, today) == {students[0].id: False}
 
     def test_get_attendance_by_subject_and_date(self, session, attendance_data):
         """Получение посещаемости на дату."""
@@ -218,6 +310,44 @@ class TestAttendanceCRUD:
         # Все присутствовали 01.11
         assert all(v is True for v in result.values())
 
+    def test_get_attendance_matrix(self, session, attendance_data):
+        """Матрица посещаемости загружается одним запросом с учётом периода."""
+        subject = attendance_data["subject"]
+        students = attendance_data["students"]
+        dates = attendance_data["dates"]
+
+        matrix = crud.get_attendance_matrix(session, subject.id)
+        assert len(matrix) == 9
+        assert matrix[(students[0].id, dates[2])] is True
+        assert matrix[(students[2].id, dates[1])] is False
+
+        matrix = crud.get_attendance_matrix(
+            session, subject.id, date_from=dates[1], date_to=dates[1])
+        assert set(matrix) == {(st.id, dates[1]) for st in students}
+
+    def test_get_attendance_counts_by_date(self, session, attendance_data):
+        """Подсчёт присутствующих по датам одним запросом."""
+        subject = attendance_data["subject"]
+        dates = attendance_data["dates"]
+
+        counts = crud.get_attendance_counts_by_date(session, subject.id)
+
+        assert counts == [(dates[0], 3, 3), (dates[1], 2, 3), (dates[2], 1, 3)]
+
+    def test_get_present_counts_by_student(self, session, attendance_data):
+        """Число присутствий по студентам считается в БД."""
+        subject = attendance_data["subject"]
+        students = attendance_data["students"]
+        dates = attendance_data["dates"]
+
+        counts = crud.get_present_counts_by_student(session, subject.id)
+        assert counts == {students[0].id: 3, students[1].id: 2, students[2].id: 1}
+
+        # Сидоров за 08.11–15.11 не был ни разу — записи нет
+        counts = crud.get_present_counts_by_student(
+            session, subject.id, dates[1], dates[2])
+        assert counts == {students[0].id: 2, students[1].id: 1}
+
     def test_get_subject_attendance_dates(self, session, attendance_data):
         """Получение дат занятий."""
         subject = attendance_data["subject"]
@@ -229,6 +359,16 @@ class TestAttendanceCRUD:
         assert date(2024, 11, 8) in dates
         assert date(2024, 11, 15) in dates
 
+    def test_get_subject_attendance_dates_period(self, session, attendance_data):
+        """Даты занятий за период отбираются в БД и идут по порядку."""
+        subject = attendance_data["subject"]
+        dates = attendance_data["dates"]
+
+        assert crud.get_subject_attendance_dates(
+            session, subject.id, dates[1], dates[2]) == dates[1:]
+        assert crud.get_subject_attendance_dates(
+            session, subject.id, date_to=dates[0]) == dates[:1]
+
     def test_get_student_attendance_by_subject(self, session, attendance_data):
         """Получение посещаемости студента по дисциплине."""
         subject = attendance_data["subject"]
@@ -240,3 +380,16 @@ class TestAttendanceCRUD:
 
         assert len(att) == 3
         assert all(a.is_present for a in att)
+
+    def test_get_student_attendance_summary(self, session, attendance_data):
+        """Сводка посещаемости студента считается в SQL."""
+        subject = attendance_data["subject"]
+        students = attendance_data["students"]
+
+        # Сидоров - 1 из 3
+        assert crud.get_student_attendance_summary(
+            session, students[2].id) == (3, 1)
+        assert crud.get_student_attendance_summary(
+            session, students[2].id, subject.id) == (3, 1)
+        assert crud.get_student_attendance_summary(
+            session, students[2].id, subject.id + 1) == (0, 0)
@@ -2,34 +2,43 @@
 Тесты для модуля статистики.
 """
 
+from collections import namedtuple
 from datetime import date
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 import pytest
+from sqlalchemy import select
 
 from bot.database.models import Attendance
-from bot.utils.stats import get_student_stats, get_subject_stats
+from bot.utils import stats_cache, chart_cache
+from bot.utils.stats import (
+    get_student_stats,
+    get_subject_stats,
+    get_teacher_overall_stats,
+    get_attendance_by_dates,
+    get_students_attendance_df,
+)
+
+# Строка посещаемости для подмены crud (читаются только date и is_present)
+AttRow = namedtuple("AttRow", ["date", "is_present"])
 
 
 class TestStudentStats:
     """Тесты статистики по студенту."""
 
-    def test_student_stats_full_attendance(self, session, attendance_data):
+    def test_student_stats_full_attendance(self, stats_session, mock_crud, attendance_data):
         """Студент с полной посещаемостью."""
 
         students = attendance_data["students"]
         subject = attendance_data["subject"]
 
-        # Мокаем get_session чтобы использовать тестовую сессию
-        with patch('bot.utils.stats.get_session', return_value=session):
-            with patch('bot.utils.stats.crud') as mock_crud:
-                # Настраиваем моки
-                mock_crud.get_student_by_id.return_value = students[0]
-                mock_crud.get_subject_attendance_dates.return_value = attendance_data["dates"]
-                mock_crud.get_student_attendance_by_subject.return_value = [
-                    MagicMock(date=d, is_present=True) for d in attendance_data["dates"]
-                ]
+        # Настраиваем моки
+        mock_crud.get_student_by_id.return_value = students[0]
+        mock_crud.get_subject_attendance_dates.return_value = attendance_data["dates"]
+        mock_crud.get_student_attendance_by_subject.return_value = [
+            AttRow(d, True) for d in attendance_data["dates"]
+        ]
 
-                stats = get_student_stats(students[0].id, subject.id)
+        stats = get_student_stats(students[0].id, subject.id)
 
         assert stats["student_name"] == students[0].full_name
         assert stats["total"] == 3
@@ -37,46 +46,42 @@ class TestStudentStats:
         assert stats["absent"] == 0
         assert stats["percentage"] == 100.0
 
-    def test_student_stats_partial_attendance(self, session, attendance_data):
+    def test_student_stats_partial_attendance(self, stats_session, mock_crud, attendance_data):
         """Студент с частичной посещаемостью."""
 
         students = attendance_data["students"]
         subject = attendance_data["subject"]
         dates = attendance_data["dates"]
 
-        with patch('bot.utils.stats.get_session', return_value=session):
-            with patch('bot.utils.stats.crud') as mock_crud:
-                # Сидоров
-                mock_crud.get_student_by_id.return_value = students[2]
-                mock_crud.get_subject_attendance_dates.return_value = dates
-                # Сидоров: 1 присутствие, 2 пропуска
-                mock_crud.get_student_attendance_by_subject.return_value = [
-                    MagicMock(date=dates[0], is_present=True),
-                    MagicMock(date=dates[1], is_present=False),
-                    MagicMock(date=dates[2], is_present=False),
-                ]
+        # Сидоров
+        mock_crud.get_student_by_id.return_value = students[2]
+        mock_crud.get_subject_attendance_dates.return_value = dates
+        # Сидоров: 1 присутствие, 2 пропуска
+        mock_crud.get_student_attendance_by_subject.return_value = [
+            AttRow(dates[0], True),
+            AttRow(dates[1], False),
+            AttRow(dates[2], False),
+        ]
 
-                stats = get_student_stats(students[2].id, subject.id)
+        stats = get_student_stats(students[2].id, subject.id)
 
         assert stats["total"] == 3
         assert stats["present"] == 1
         assert stats["absent"] == 2
         assert stats["percentage"] == pytest.approx(33.3, rel=0.1)
 
-    def test_student_stats_no_records(self, session, attendance_data):
+    def test_student_stats_no_records(self, stats_session, mock_crud, attendance_data):
         """Студент без записей посещаемости."""
 
         students = attendance_data["students"]
         subject = attendance_data["subject"]
         dates = attendance_data["dates"]
 
-        with patch('bot.utils.stats.get_session', return_value=session):
-            with patch('bot.utils.stats.crud') as mock_crud:
-                mock_crud.get_student_by_id.return_value = students[0]
-                mock_crud.get_subject_attendance_dates.return_value = dates
-                mock_crud.get_student_attendance_by_subject.return_value = []  # Нет записей
+        mock_crud.get_student_by_id.return_value = students[0]
+        mock_crud.get_subject_attendance_dates.return_value = dates
+        mock_crud.get_student_attendance_by_subject.return_value = []  # Нет записей
 
-                stats = get_student_stats(students[0].id, subject.id)
+        stats = get_student_stats(students[0].id, subject.id)
 
         # Нет записей = все пропуски
         assert stats["total"] == 3
@@ -88,82 +93,235 @@ class TestStudentStats:
 class TestSubjectStats:
     """Тесты статистики по дисциплине."""
 
-    def test_subject_stats_basic(self, session, attendance_data):
+    def test_subject_stats_basic(self, stats_session, attendance_data):
         """Базовая статистика по дисциплине."""
 
         subject = attendance_data["subject"]
         students = attendance_data["students"]
         dates = attendance_data["dates"]
 
-        with patch('bot.utils.stats.get_session', return_value=session):
-            with patch('bot.utils.stats.crud') as mock_crud:
-                mock_crud.get_subject_by_id.return_value = subject
-                mock_crud.get_students_by_subject.return_value = students
-                mock_crud.get_subject_attendance_dates.return_value = dates
-
-                # Мокаем get_student_stats для каждого студента
-                with patch('bot.utils.stats.get_student_stats') as mock_student_stats:
-                    mock_student_stats.side_effect = [
-                        {"student_name": "Иванов", "percentage": 100.0,
-                            "total": 3, "present": 3, "absent": 0},
-                        {"student_name": "Петров", "percentage": 66.7,
-                            "total": 3, "present": 2, "absent": 1},
-                        {"student_name": "Сидоров", "percentage": 33.3,
-                            "total": 3, "present": 1, "absent": 2},
-                    ]
-
-                    stats = get_subject_stats(subject.id)
+        stats = get_subject_stats(subject.id)
 
         assert stats["subject_name"] == subject.name
         assert stats["total_students"] == 3
-        assert stats["total_dates"] == 3
+        assert stats["total_dates"] == len(dates)
         # Средняя: (100 + 66.7 + 33.3) / 3 ≈ 66.7
         assert stats["avg_attendance"] == pytest.approx(66.7, rel=0.1)
+        assert [st["percentage"] for st in stats["students_stats"]] == [100.0, 66.7, 33.3]
+        assert stats["students_stats"][0]["student_name"] == students[0].full_name
+        assert stats["students_stats"][2]["present"] == 1
+        assert stats["students_stats"][2]["absent"] == 2
+
+    def test_subject_stats_period(self, stats_session, attendance_data):
+        """Статистика за период учитывает только даты внутри периода."""
+
+        subject = attendance_data["subject"]
+        dates = attendance_data["dates"]
+
+        stats = get_subject_stats(subject.id, dates[1], dates[2])
+
+        assert stats["total_dates"] == 2
+        # Иванов 2/2, Петров 1/2, Сидоров 0/2
+        assert [st["percentage"] for st in stats["students_stats"]] == [100.0, 50.0, 0.0]
 
-    def test_subject_stats_empty(self, session, subject):
+    def test_subject_stats_no_n_plus_one(self, stats_session, attendance_data, sql_queries):
+        """Число запросов не зависит от количества студентов и дат."""
+
+        stats = get_subject_stats(attendance_data["subject"].id)
+
+        assert len(stats["students_stats"]) == 3
+        # Дисциплина, состав, даты и число присутствий по студентам
+        assert len(sql_queries) <= 4, sql_queries
+
+    def test_subject_stats_empty(self, stats_session, mock_crud, subject):
         """Статистика по пустой дисциплине."""
 
-        with patch('bot.utils.stats.get_session', return_value=session):
-            with patch('bot.utils.stats.crud') as mock_crud:
-                mock_crud.get_subject_by_id.return_value = subject
-                mock_crud.get_students_by_subject.return_value = []
-                mock_crud.get_subject_attendance_dates.return_value = []
+        mock_crud.get_subject_by_id.return_value = subject
+        mock_crud.get_students_by_subject.return_value = []
+        mock_crud.get_subject_attendance_dates.return_value = []
 
-                stats = get_subject_stats(subject.id)
+        stats = get_subject_stats(subject.id)
 
         assert stats["total_students"] == 0
         assert stats["total_dates"] == 0
         assert stats["avg_attendance"] == 0
 
 
+class TestTeacherOverallStats:
+    """Тесты общей статистики преподавателя."""
+
+    def test_teacher_overall_stats(self, stats_session, teacher, attendance_data):
+        """Сводка по дисциплинам считается одним запросом."""
+        subject_name = attendance_data["subject"].name
+        dates = attendance_data["dates"]
+
+        stats = get_teacher_overall_stats(teacher.id)
+        period_stats = get_teacher_overall_stats(teacher.id, dates[1], dates[2])
+
+        assert stats["total_subjects"] == 1
+        assert stats["total_students"] == 3
+        assert stats["total_dates"] == 3
+        # 6 присутствий из 9 возможных
+        assert stats["overall_avg_attendance"] == 66.7
+        assert stats["subjects_stats"][0]["subject_name"] == subject_name
+
+        # За период 08.11–15.11: 3 присутствия из 6
+        assert period_stats["total_dates"] == 2
+        assert period_stats["overall_avg_attendance"] == 50.0
+
+
+class TestStatsCache:
+    """Тесты кэширования статистики."""
+
+    def test_subject_stats_cached(self, stats_session, mock_crud, subject):
+        """Повторный вызов не пересчитывает статистику."""
+
+        mock_crud.get_subject_by_id.return_value = subject
+        mock_crud.get_students_by_subject.return_value = []
+        mock_crud.get_subject_attendance_dates.return_value = []
+
+        first = get_subject_stats(subject.id)
+        second = get_subject_stats(subject.id, None, None)
+
+        assert first is second
+        assert mock_crud.get_subject_by_id.call_count == 1
+
+    def test_subject_stats_invalidate(self, stats_session, mock_crud, subject):
+        """После сброса статистика пересчитывается."""
+
+        mock_crud.get_subject_by_id.return_value = subject
+        mock_crud.get_students_by_subject.return_value = []
+        mock_crud.get_subject_attendance_dates.return_value = []
+
+        get_subject_stats(subject.id)
+        stats_cache.invalidate_subject(subject.id)
+        get_subject_stats(subject.id)
+
+        assert mock_crud.get_subject_by_id.call_count == 2
+
+    def test_outer_session_reused(self, session, subject_with_students):
+        """Переданная сессия не закрывается и не входит в ключ кэша."""
+
+        with patch('bot.database.session_ctx.get_session') as mock_get_session:
+            first = get_subject_stats(subject_with_students.id, session=session)
+            second = get_subject_stats(subject_with_students.id)
+
+        assert first is second
+        mock_get_session.assert_not_called()
+        # Сессия осталась открытой для вызывающего кода
+        assert subject_with_students.name == first["subject_name"]
+
+    def test_chart_data_cached_separately(self, stats_session, subject_with_students):
+        """Данные графиков кэшируются и не смешиваются со статистикой."""
+        stats = get_subject_stats(subject_with_students.id)
+        students_df = get_students_attendance_df(subject_with_students.id)
+        dates_df = get_attendance_by_dates(subject_with_students.id)
+
+        assert isinstance(stats, dict)
+        assert students_df is get_students_attendance_df(
+            subject_with_students.id)
+        assert dates_df is get_attendance_by_dates(subject_with_students.id)
+
+        stats_cache.invalidate_subject(subject_with_students.id)
+        assert dates_df is not get_attendance_by_dates(
+            subject_with_students.id)
+
+    def test_chart_cache_key_and_file_id(self):
+        """Ключ графика зависит только от данных, file_id запоминается."""
+
+        data = [{"name": "Математика", "percentage": 50.0}]
+        key = chart_cache.make_key("overall", data)
+
+        assert key == chart_cache.make_key("overall", list(data))
+        assert key != chart_cache.make_key("dates", data)
+        assert chart_cache.make_key("dates", [date(2024, 11, 1)]) == \
+            chart_cache.make_key("dates", [date(2024, 11, 1)])
+        assert chart_cache.get(key) is None
+
+        chart_cache.put(key, b"png")
+        chart_cache.set_file_id(key, "file-1")
+
+        assert chart_cache.get(key) == {"bytes": b"png", "file_id": "file-1"}
+
+
+    def test_dates_chart_key_follows_dates(self, stats_session, attendance_data):
+        """Ключ графика по датам меняется вместе с распределением по датам."""
+        from bot.handlers.stats import dates_chart_key
+
+        subject = attendance_data["subject"]
+        students = attendance_data["students"]
+        dates = attendance_data["dates"]
+
+        before_stats = get_subject_stats(subject.id)
+        before_key = dates_chart_key(
+            subject.name, get_attendance_by_dates(subject.id), None, None)
+
+        # Петров: 08.11 присутствие -> пропуск, 15.11 пропуск -> присутствие;
+        # итоги по студентам не меняются
+        swapped = stats_session.scalars(select(Attendance).where(
+            Attendance.student_id == students[1].id,
+            Attendance.date.in_(dates[1:]),
+        ))
+        for att in swapped:
+            att.is_present = not att.is_present
+        stats_session.commit()
+        stats_cache.invalidate_subject(subject.id)
+
+        after_key = dates_chart_key(
+            subject.name, get_attendance_by_dates(subject.id), None, None)
+
+        assert get_subject_stats(subject.id) == before_stats
+        assert after_key != before_key
+        assert after_key != dates_chart_key(
+            subject.name, get_attendance_by_dates(subject.id), dates[0], None)
+
+
 class TestPeriodFiltering:
     """Тесты фильтрации по периоду."""
 
-    def test_student_stats_with_period(self, session, attendance_data):
+    def test_student_stats_with_period(self, stats_session, attendance_data):
         """Статистика студента за период."""
 
         students = attendance_data["students"]
         subject = attendance_data["subject"]
-        all_dates = attendance_data["dates"]
 
         # Фильтруем только первые 2 даты (2024-11-01 и 2024-11-08)
         date_from = date(2024, 11, 1)
         date_to = date(2024, 11, 10)
 
-        with patch('bot.utils.stats.get_session', return_value=session):
-            with patch('bot.utils.stats.crud') as mock_crud:
-                mock_crud.get_student_by_id.return_value = students[0]
-                mock_crud.get_subject_attendance_dates.return_value = all_dates
-                mock_crud.get_student_attendance_by_subject.return_value = [
-                    MagicMock(date=d, is_present=True) for d in all_dates
-                ]
-
-                stats = get_student_stats(
-                    students[0].id, subject.id, date_from, date_to)
+        # Сидоров: присутствовал 01.11, отсутствовал 08.11
+        stats = get_student_stats(
+            students[2].id, subject.id, date_from, date_to)
 
         # Должно быть 2 даты в периоде
         assert stats["total"] == 2
-        assert stats["present"] == 2
+        assert stats["present"] == 1
+        assert stats["dates_absent"] == [date(2024, 11, 8)]
+
+
+class TestFormatting:
+    """Тесты форматирования процентов."""
+
+    def test_format_percentages_matches_single(self):
+        """Пакетное форматирование совпадает с поштучным."""
+        from bot.handlers.stats import format_percentage, format_percentages
+
+        values = [0, 12.5, 39.9, 40, 59.5, 60, 66.7, 79.5, 80, 100]
+
+        assert format_percentages(values) == [
+            format_percentage(v) for v in values]
+        assert format_percentages([]) == []
+
+    def test_bar_colors_thresholds(self):
+        """Цвета столбцов графиков по порогам 40/60/80%."""
+        from bot.utils.charts import _bar_colors
+
+        colors = _bar_colors([0, 39.9, 40, 59.9, 60, 79.9, 80, 100])
+
+        assert list(colors) == [
+            '#F44336', '#F44336', '#FF9800', '#FF9800',
+            '#FFC107', '#FFC107', '#4CAF50', '#4CAF50',
+        ]
 
 
 class TestModels: